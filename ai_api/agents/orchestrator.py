@@ -1,21 +1,34 @@
-def pick_agent(prompt: str) -> str:
-    p = (prompt or "").lower()
+from typing import List
 
+# Mots-clés par agent, dans l'ordre de priorité de pick_agent
+AGENT_KEYWORDS = {
     # Frontend
-    if any(k in p for k in ["react", "vite", "frontend", "ui", "css", "tailwind", "component", "page", "landing"]):
-        return "frontend"
-
+    "frontend": ["react", "vite", "frontend", "ui", "css", "tailwind", "component", "page", "landing"],
     # Backend
-    if any(k in p for k in ["fastapi", "api", "endpoint", "jwt", "auth", "sqlalchemy", "database", "postgres", "schema"]):
-        return "backend"
-
+    "backend": ["fastapi", "api", "endpoint", "jwt", "auth", "sqlalchemy", "database", "postgres", "schema"],
     # DevOps
-    if any(k in p for k in ["docker", "deploy", "ci/cd", "github actions", "nginx", "render", "railway", "vercel"]):
-        return "devops"
-
+    "devops": ["docker", "deploy", "ci/cd", "github actions", "nginx", "render", "railway", "vercel"],
     # Writer / communication
-    if any(k in p for k in ["email", "message", "cv", "lettre", "proposal", "rapport", "rédige", "résume"]):
-        return "writer"
+    "writer": ["email", "message", "cv", "lettre", "proposal", "rapport", "rédige", "résume"],
+}
+
+
+def pick_agent(prompt: str) -> str:
+    p = (prompt or "").lower()
+
+    for agent, keywords in AGENT_KEYWORDS.items():
+        if any(k in p for k in keywords):
+            return agent
 
     # Par défaut
     return "backend"
+
+
+def pick_agents(prompt: str) -> List[str]:
+    """
+    Tous les agents concernés par la demande (ex: "API FastAPI + front React
+    + Dockerfile" -> backend, frontend, devops), pour le mode fan-out.
+    """
+    p = (prompt or "").lower()
+    agents = [agent for agent, keywords in AGENT_KEYWORDS.items() if any(k in p for k in keywords)]
+    return agents or ["backend"]
@@ -0,0 +1,69 @@
+# ai_api/auth/cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+# Durées de vie courtes : l'invalidation est locale au worker, le TTL borne
+# le décalage entre workers (ex: profil modifié via un autre process)
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "60"))
+AUTH_PROFILE_CACHE_TTL = float(os.getenv("AUTH_PROFILE_CACHE_TTL", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+
+class TTLCache:
+    """
+    Petit cache LRU + TTL, thread-safe (les endpoints sync tournent dans le
+    threadpool). Chaque entrée peut avoir sa propre échéance (ex: exp du JWT).
+    """
+
+    def __init__(self, ttl: float, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+# token JWT -> email (échéance = min(TTL, exp du token))
+token_cache = TTLCache(AUTH_TOKEN_CACHE_TTL)
+
+# email -> ProfileResponse
+profile_cache = TTLCache(AUTH_PROFILE_CACHE_TTL)
+
+
+def auth_cache_stats() -> dict:
+    return {"tokens": token_cache.stats(), "profiles": profile_cache.stats()}
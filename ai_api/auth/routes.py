@@ -1,9 +1,11 @@
 # ai_api/auth/routes.py
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from ai_api.deps import get_db
+from ai_api.deps import get_db, get_async_db
 from ai_api.models import User
 
 from ai_api.auth.schemas import (
@@ -15,44 +17,60 @@ from ai_api.auth.schemas import (
 )
 
 from ai_api.auth.security import (
-    hash_password,
-    verify_password,
+    ahash_password,
+    averify_password,
     create_access_token,
-    decode_token,
+    decode_token_with_ttl,
 )
+from ai_api.auth.cache import token_cache, profile_cache
 
 router = APIRouter(tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
+def _find_user(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+async def _afind_user(db, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+
 @router.post("/register")
-def register(payload: RegisterRequest, db: Session = Depends(get_db)):
+async def register(payload: RegisterRequest, db=Depends(get_async_db)):
     email = payload.email.lower().strip()
 
-    existing = db.query(User).filter(User.email == email).first()
+    existing = await _afind_user(db, email)
     if existing:
         raise HTTPException(status_code=400, detail="Utilisateur déjà existant")
 
+    # bcrypt dans le pool de process : la boucle reste libre pendant le hash
     user = User(
         email=email,
-        hashed_password=hash_password(payload.password),
+        hashed_password=await ahash_password(payload.password),
         default_agent=payload.default_agent,
     )
     db.add(user)
-    db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # inscription concurrente du même email
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Utilisateur déjà existant")
 
     return {"ok": True}
 
 
 @router.post("/login", response_model=TokenResponse)
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
+async def login(payload: LoginRequest, db=Depends(get_async_db)):
     email = payload.email.lower().strip()
 
-    user = db.query(User).filter(User.email == email).first()
+    user = await _afind_user(db, email)
     if not user:
         raise HTTPException(status_code=401, detail="Identifiants invalides")
 
-    if not verify_password(payload.password, user.hashed_password):
+    if not await averify_password(payload.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Identifiants invalides")
 
     token = create_access_token(user.email)
@@ -60,31 +78,38 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
 
 
 def get_current_user_email(token: str = Depends(oauth2_scheme)) -> str:
-    email = decode_token(token)
-    if not email or not isinstance(email, str):
+    # token déjà vérifié récemment : pas de décodage / vérif de signature
+    email = token_cache.get(token)
+    if email is not None:
+        return email
+
+    decoded = decode_token_with_ttl(token)
+    if not decoded:
         raise HTTPException(status_code=401, detail="Token invalide ou expiré")
+    email, remaining = decoded
+    token_cache.set(token, email, ttl=remaining)
     return email
 
 
-@router.get("/profile", response_model=ProfileResponse)
-def get_profile(
-    email: str = Depends(get_current_user_email),
-    db: Session = Depends(get_db),
-):
-    user = db.query(User).filter(User.email == email).first()
+def load_profile(db: Session, email: str) -> ProfileResponse:
+    """
+    Profil de l'utilisateur, servi depuis le cache si possible.
+    """
+    profile = profile_cache.get(email)
+    if profile is not None:
+        return profile
+
+    user = _find_user(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
 
-    return ProfileResponse(email=user.email, default_agent=user.default_agent)
+    profile = ProfileResponse(email=user.email, default_agent=user.default_agent)
+    profile_cache.set(email, profile)
+    return profile
 
 
-@router.put("/profile", response_model=ProfileResponse)
-def update_profile(
-    payload: UpdateProfileRequest,
-    email: str = Depends(get_current_user_email),
-    db: Session = Depends(get_db),
-):
-    user = db.query(User).filter(User.email == email).first()
+def save_profile(db: Session, email: str, payload: UpdateProfileRequest) -> ProfileResponse:
+    user = _find_user(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur introuvable")
 
@@ -92,4 +117,22 @@ def update_profile(
     db.commit()
     db.refresh(user)
 
+    profile_cache.invalidate(email)
     return ProfileResponse(email=user.email, default_agent=user.default_agent)
+
+
+@router.get("/profile", response_model=ProfileResponse)
+def get_profile(
+    email: str = Depends(get_current_user_email),
+    db: Session = Depends(get_db),
+):
+    return load_profile(db, email)
+
+
+@router.put("/profile", response_model=ProfileResponse)
+def update_profile(
+    payload: UpdateProfileRequest,
+    email: str = Depends(get_current_user_email),
+    db: Session = Depends(get_db),
+):
+    return save_profile(db, email, payload)
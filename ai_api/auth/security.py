@@ -1,7 +1,13 @@
 # ai_api/auth/security.py
 
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 from passlib.context import CryptContext
 from jose import jwt, JWTError
@@ -14,7 +20,14 @@ FAKE_USERS_DB: Dict[str, Dict[str, Any]] = {}
 # =========================
 # 🔹 Password hashing
 # =========================
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Facteur de coût bcrypt (2^rounds itérations) ; les hash existants gardent
+# le leur et restent vérifiables
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Process dédiés au hash : bcrypt est CPU-bound, hors de la boucle et du threadpool
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def hash_password(password: str) -> str:
     password = (password or "")[:72]
@@ -24,6 +37,41 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     plain_password = (plain_password or "")[:72]
     return pwd_context.verify(plain_password, hashed_password)
 
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+
+
+def _get_hash_pool() -> ProcessPoolExecutor:
+    # créé au premier login, quand le serveur a déjà des threads : "spawn"
+    # plutôt que fork (un fork hériterait de verrous tenus par d'autres threads)
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                _hash_pool = ProcessPoolExecutor(
+                    max_workers=AUTH_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _hash_pool
+
+
+async def ahash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), hash_password, password)
+
+
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_pool(), verify_password, plain_password, hashed_password)
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
 # =========================
 # 🔹 JWT Config
 # =========================
@@ -43,7 +91,10 @@ def create_access_token(email: str, expires_delta: Optional[timedelta] = None) -
 
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def decode_token(token: str) -> Optional[str]:
+def decode_token_with_ttl(token: str) -> Optional[Tuple[str, float]]:
+    """
+    (email, secondes restantes avant exp) ou None si le token est invalide.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         sub = payload.get("sub")
@@ -51,6 +102,12 @@ def decode_token(token: str) -> Optional[str]:
         if not sub or not isinstance(sub, str):
             return None
 
-        return sub
+        exp = payload.get("exp")
+        remaining = float(exp) - time.time() if isinstance(exp, (int, float)) else float("inf")
+        return sub, remaining
     except JWTError:
         return None
+
+def decode_token(token: str) -> Optional[str]:
+    decoded = decode_token_with_ttl(token)
+    return decoded[0] if decoded else None
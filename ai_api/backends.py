@@ -0,0 +1,224 @@
+# ai_api/backends.py
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+
+def _default_urls() -> str:
+    # compat : OLLAMA_URL pointait directement sur /api/generate
+    legacy = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434/api/generate")
+    return legacy.split("/api/")[0]
+
+
+# Instances Ollama, séparées par des virgules
+OLLAMA_URLS = [
+    u.strip().rstrip("/")
+    for u in os.getenv("OLLAMA_URLS", _default_urls()).split(",")
+    if u.strip()
+]
+
+# Requêtes simultanées max par instance (= OLLAMA_NUM_PARALLEL côté serveur)
+OLLAMA_BACKEND_MAX_CONCURRENCY = int(os.getenv("OLLAMA_BACKEND_MAX_CONCURRENCY", "4"))
+
+# Health checks actifs
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+
+# Attente max d'une place libre quand toutes les instances sont pleines
+OLLAMA_BACKEND_WAIT_TIMEOUT = float(os.getenv("OLLAMA_BACKEND_WAIT_TIMEOUT", "60"))
+
+# Nombre de sessions dont on mémorise l'instance (affinité)
+SESSION_AFFINITY_MAX = int(os.getenv("SESSION_AFFINITY_MAX", "10000"))
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int, name: str = ""):
+        self.url = url
+        self.name = name or url
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.total_requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None       # détail (logs, debug)
+        self.last_error_type: Optional[str] = None  # classe de l'erreur (métriques)
+        self.last_check = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.outstanding < self.max_concurrency
+
+    def stats(self) -> dict:
+        return {
+            # ni URL ni message d'erreur : les métriques peuvent sortir du réseau interne
+            "name": self.name,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency,
+            "total_requests": self.total_requests,
+            "failures": self.failures,
+            "last_error": self.last_error_type,
+        }
+
+
+class BackendPool:
+    """
+    Répartition des appels sur plusieurs instances Ollama :
+    - moins de requêtes en cours d'abord (least-outstanding)
+    - plafond de requêtes simultanées par instance
+    - affinité par session_id (le cache KV de la session reste chaud)
+    - une instance en échec sort de la rotation jusqu'au prochain
+      health check réussi
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        max_concurrency: int = OLLAMA_BACKEND_MAX_CONCURRENCY,
+        wait_timeout: float = OLLAMA_BACKEND_WAIT_TIMEOUT,
+        affinity_max: int = SESSION_AFFINITY_MAX,
+    ):
+        if not urls:
+            raise ValueError("Aucune URL Ollama configurée")
+        self.backends = [Backend(u, max_concurrency, f"ollama-{i}") for i, u in enumerate(urls)]
+        self.wait_timeout = wait_timeout
+        self.affinity_max = affinity_max
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict()
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _least_loaded(self) -> Optional[Backend]:
+        candidates = [b for b in self.backends if b.available]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.outstanding, b.total_requests))
+
+    def _pin(self, session_id: str, backend: Backend):
+        self._affinity[session_id] = backend
+        self._affinity.move_to_end(session_id)
+        while len(self._affinity) > self.affinity_max:
+            self._affinity.popitem(last=False)
+
+    def choose(self, session_id: Optional[str] = None) -> Optional[Backend]:
+        """
+        Instance pour cette requête, ou None si toutes sont pleines.
+        Lève NoBackendAvailable si aucune n'est saine.
+        """
+        if not any(b.healthy for b in self.backends):
+            raise NoBackendAvailable("Aucune instance Ollama disponible")
+
+        if session_id:
+            pinned = self._affinity.get(session_id)
+            if pinned is not None and pinned.healthy:
+                self._affinity.move_to_end(session_id)
+                if pinned.available:
+                    return pinned
+                # instance de la session saturée : débordement ponctuel
+                return self._least_loaded()
+
+        backend = self._least_loaded()
+        if backend is not None and session_id:
+            self._pin(session_id, backend)
+        return backend
+
+    async def acquire(self, session_id: Optional[str] = None) -> Backend:
+        cond = self._condition()
+        deadline = time.monotonic() + self.wait_timeout
+        async with cond:
+            while True:
+                backend = self.choose(session_id)
+                if backend is not None:
+                    backend.outstanding += 1
+                    backend.total_requests += 1
+                    return backend
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoBackendAvailable("Toutes les instances Ollama sont saturées")
+                try:
+                    await asyncio.wait_for(cond.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, backend: Backend):
+        cond = self._condition()
+        async with cond:
+            backend.outstanding -= 1
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def lease(self, session_id: Optional[str] = None) -> AsyncIterator[Backend]:
+        backend = await self.acquire(session_id)
+        try:
+            yield backend
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500:
+                self.mark_failed(backend, e)
+            raise
+        finally:
+            await self.release(backend)
+
+    def pick_sync(self, session_id: Optional[str] = None) -> Backend:
+        """
+        Pour les clients sync (code_agent, scripts) : pas de réservation,
+        simplement l'instance saine la moins chargée.
+        """
+        backend = self.choose(session_id)
+        if backend is None:
+            backend = min((b for b in self.backends if b.healthy), key=lambda b: b.outstanding)
+        return backend
+
+    def mark_failed(self, backend: Backend, error: Exception):
+        backend.healthy = False
+        backend.failures += 1
+        backend.last_error = repr(error)
+        backend.last_error_type = type(error).__name__
+
+    # -------------------------
+    # Health checks
+    # -------------------------
+
+    async def check(self, client: httpx.AsyncClient, backend: Backend):
+        backend.last_check = time.time()
+        try:
+            r = await client.get(f"{backend.url}/api/tags", timeout=OLLAMA_HEALTH_TIMEOUT)
+            r.raise_for_status()
+        except Exception as e:
+            self.mark_failed(backend, e)
+            return
+
+        if not backend.healthy:
+            backend.healthy = True
+            cond = self._condition()
+            async with cond:
+                cond.notify_all()
+
+    async def check_all(self, client: httpx.AsyncClient):
+        await asyncio.gather(*(self.check(client, b) for b in self.backends))
+
+    async def run_health_checks(self, client: httpx.AsyncClient, interval: float = OLLAMA_HEALTH_INTERVAL):
+        while True:
+            await self.check_all(client)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "backends": [b.stats() for b in self.backends],
+            "sessions_pinned": len(self._affinity),
+        }
+
+
+pool = BackendPool(OLLAMA_URLS)
@@ -1,11 +1,10 @@
 # ai_api/code_agent.py
 from typing import Dict, Any, Union
-import json
-import re
 
 from smolagents import CodeAgent, tool
 
 from ai_api.ollama_client import generate as ollama_generate
+from ai_api.json_utils import extract_json_block
 
 
 # =========================
@@ -19,52 +18,6 @@ def _safe_str(x: Any) -> str:
         return ""
 
 
-def extract_json_block(text: str) -> dict:
-    """
-    Extrait le premier objet JSON valide trouvé dans un texte.
-    Supporte aussi les blocs ```json ... ```
-    """
-    if not text:
-        raise ValueError("Réponse vide du modèle")
-
-    # bloc ```json ... ```
-    m = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if m:
-        return json.loads(m.group(1))
-
-    # sinon premier {...}
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        candidate = text[start:end + 1]
-        return json.loads(candidate)
-
-    raise ValueError("JSON non trouvé dans la réponse du modèle")
-
-
-def repair_json_loose(text: str) -> str:
-    """
-    Répare les erreurs JSON classiques :
-    - clés sans guillemets -> "key":
-    - quotes simples -> quotes doubles
-    """
-    if not text:
-        return text
-
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        text = text[start:end + 1]
-
-    # quotes simples -> doubles
-    text = re.sub(r"(?<!\\)'", '"', text)
-
-    # ajouter quotes aux clés non quotées
-    text = re.sub(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:', r'\1"\2":', text)
-
-    return text
-
-
 # =========================
 # 🔹 LLM wrapper (smolagents compatible)
 # =========================
@@ -213,15 +166,8 @@ Demande utilisateur:
     raw_text = raw if isinstance(raw, str) else _safe_str(raw)
     raw_text = (raw_text or "").strip()
 
-    # 1) extraction JSON direct
+    # extraction + réparation JSON en un passage
     try:
         return extract_json_block(raw_text)
-    except Exception:
-        pass
-
-    # 2) réparation JSON
-    fixed = repair_json_loose(raw_text)
-    try:
-        return json.loads(fixed)
-    except Exception as e:
+    except ValueError as e:
         raise ValueError(f"CodeAgent JSON invalide après réparation: {str(e)}")
@@ -1,12 +1,188 @@
-from sqlalchemy import create_engine
+# ai_api/db.py
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ai_api.db")
+
+# URL du moteur async (dérivée de DATABASE_URL si vide : sqlite -> aiosqlite,
+# postgresql -> asyncpg)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+
+# Pool de connexions (ignoré pour SQLite en mémoire)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite : attente max sur un verrou d'écriture avant "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+class PoolMetrics:
+    """
+    Compteurs des pools (sync + async) : checkouts, temps d'attente pour
+    obtenir une connexion, timeouts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def record(self, wait_ms: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(self.wait_ms_total / calls, 3) if calls else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class _MeteredPool:
+    # mesure le temps passé à obtenir une connexion (attente + ouverture)
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_metrics.record((time.perf_counter() - started) * 1000)
+        return conn
+
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
 
-DATABASE_URL = "sqlite:///./ai_api.db"
+def _is_memory_sqlite(url: str) -> bool:
+    path = url.partition("://")[2].lstrip("/")
+    return _is_sqlite(url) and (path in ("", ":memory:") or "mode=memory" in url)
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
+
+def _async_url(url: str) -> str:
+    if ASYNC_DATABASE_URL:
+        return ASYNC_DATABASE_URL
+    scheme, sep, rest = url.partition("://")
+    driver = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}.get(scheme, scheme)
+    return driver + sep + rest
+
+
+def _engine_kwargs(url: str, pool_class) -> dict:
+    kwargs = {}
+    if _is_sqlite(url):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not _is_memory_sqlite(url):
+        kwargs.update(
+            poolclass=pool_class,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=not _is_sqlite(url),
+        )
+    return kwargs
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL : lectures pendant les écritures ; NORMAL : fsync au checkpoint seulement
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL, MeteredQueuePool))
+if _is_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", _sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+# =========================
+# 🔹 Moteur async (créé au premier usage : sqlalchemy[asyncio] + driver
+# async requis seulement si un endpoint s'en sert)
+# =========================
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+        url = _async_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, **_engine_kwargs(url, MeteredAsyncQueuePool))
+        if _is_sqlite(url):
+            event.listen(_async_engine.sync_engine, "connect", _sqlite_pragmas)
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, class_=AsyncSession, expire_on_commit=False)
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _AsyncSessionLocal()
+
+
+async def dispose_engines():
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    engine.dispose()
+
+
+def _pool_status(eng) -> dict:
+    pool = eng.pool
+    if not isinstance(pool, QueuePool):
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "idle": pool.checkedin(),
+    }
+
+
+def db_stats() -> dict:
+    stats = {
+        "dialect": engine.url.get_backend_name(),
+        "pool": _pool_status(engine),
+        "metrics": pool_metrics.stats(),
+    }
+    if _async_engine is not None:
+        stats["async_pool"] = _pool_status(_async_engine.sync_engine)
+    return stats
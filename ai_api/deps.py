@@ -1,8 +1,44 @@
-from ai_api.db import SessionLocal
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from sqlalchemy.orm import Session
+
+from ai_api.db import SessionLocal, AsyncSessionLocal
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class LazySession:
+    """
+    Session ouverte au premier usage : une requête servie depuis un cache
+    (profil, token...) ne crée ni session ni connexion.
+    """
+
+    __slots__ = ("_session",)
+
+    def __init__(self):
+        self._session: Optional[Session] = None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = SessionLocal()
+        return getattr(self._session, name)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
 
 def get_db():
-    db = SessionLocal()
+    db = LazySession()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncIterator["AsyncSession"]:
+    # AsyncSession n'ouvre sa connexion qu'à la première requête SQL
+    async with AsyncSessionLocal() as db:
+        yield db
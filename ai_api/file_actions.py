@@ -1,77 +1,211 @@
 # ai_api/file_actions.py
+import hashlib
+import logging
 import os
+import shutil
+import uuid
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ai_api.workspace_index import RESERVED_DIRS
+from ai_api.workspaces import Workspace, QuotaExceeded, workspaces  # noqa: F401
+
+logger = logging.getLogger(__name__)
 
 WORKSPACE_DIR = Path("workspace").resolve()
 
+# fsync des fichiers (et dossiers) avant de rendre la main (durable, plus lent)
+WORKSPACE_FSYNC = os.getenv("WORKSPACE_FSYNC", "0") == "1"
+
+# Écritures en cours (uploads, lots), hors index (voir RESERVED_DIRS)
+STAGING_DIR = ".staging"
+
+# Workspace partagé historique (scripts, appels sans utilisateur) ;
+# les endpoints utilisent le workspace de l'utilisateur (workspaces.get)
+shared_workspace = Workspace(WORKSPACE_DIR)
+
+
+def _ws(workspace: Optional[Workspace]) -> Workspace:
+    return workspace if workspace is not None else shared_workspace
 
-def ensure_workspace():
-    WORKSPACE_DIR.mkdir(parents=True, exist_ok=True)
 
+def ensure_workspace(workspace: Optional[Workspace] = None):
+    _ws(workspace).ensure()
 
-def safe_path(relative_path: str) -> Path:
+
+def safe_path(relative_path: str, workspace: Optional[Workspace] = None) -> Path:
     """
-    Empêche d'écrire/lire en dehors de workspace/
+    Empêche d'écrire/lire en dehors du workspace
     """
-    ensure_workspace()
+    ws = _ws(workspace)
+    ws.ensure()
 
     rel = (relative_path or "").strip().lstrip("/").replace("\\", "/")
     if not rel:
         raise ValueError("Chemin vide")
 
-    full = (WORKSPACE_DIR / rel).resolve()
+    full = (ws.root / rel).resolve()
+
+    if full == ws.root or not full.is_relative_to(ws.root):
+        raise ValueError("Chemin non autorisé")
 
-    if not str(full).startswith(str(WORKSPACE_DIR)):
+    # dossiers internes (.staging...) : pas accessibles via l'API
+    if full.relative_to(ws.root).parts[0] in RESERVED_DIRS:
         raise ValueError("Chemin non autorisé")
 
     return full
 
 
-def write_file(relative_path: str, content: str) -> str:
-    p = safe_path(relative_path)
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(content or "", encoding="utf-8")
-    return str(p)
+@dataclass
+class BatchWriteResult:
+    written: List[str] = field(default_factory=list)    # chemins écrits (nouveaux ou modifiés)
+    unchanged: List[str] = field(default_factory=list)  # contenu identique : pas réécrits
+    skipped: List[str] = field(default_factory=list)    # chemin vide ou doublon dans le lot
 
 
-def read_file(relative_path: str) -> str:
-    p = safe_path(relative_path)
-    if not p.exists():
-        raise ValueError("Fichier introuvable")
-    if p.is_dir():
-        raise ValueError("Chemin pointe vers un dossier")
-    return p.read_text(encoding="utf-8")
+def _unchanged(ws: Workspace, full: Path, data: bytes) -> bool:
+    entry = ws.index.get(ws.index.rel(full))
+    if entry is None or entry.size != len(data):
+        return False
+    try:
+        st = full.stat()
+    except OSError:
+        return False
+    # l'entrée de l'index doit décrire le fichier actuel (pas de modif hors API)
+    return st.st_mtime_ns == entry.mtime_ns and entry.hash == hashlib.sha256(data).hexdigest()
 
 
-def delete_file(relative_path: str) -> bool:
-    p = safe_path(relative_path)
-    if not p.exists():
-        raise ValueError("Fichier introuvable")
-    if p.is_dir():
-        raise ValueError("Chemin pointe vers un dossier")
-    p.unlink()
-    return True
+def _fsync_dir(path: Path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # pas de fsync de dossier (Windows)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
-def list_files() -> list[str]:
-    ensure_workspace()
-    out = []
-    for root, _, files in os.walk(WORKSPACE_DIR):
-        for f in files:
-            full = Path(root) / f
-            out.append(str(full.relative_to(WORKSPACE_DIR)).replace("\\", "/"))
-    return sorted(out)
+def commit_staged(staging: Path, staged: List[Tuple[Path, Path]], fsync: bool):
+    """
+    Met les fichiers en place (os.replace, atomique par fichier). Si un
+    remplacement échoue, ceux déjà faits sont annulés : anciennes versions
+    restaurées depuis leur sauvegarde (hardlink), nouveaux fichiers retirés.
+    """
+    done: List[Tuple[Path, Optional[Path]]] = []
+    try:
+        for i, (tmp, full) in enumerate(staged):
+            full.parent.mkdir(parents=True, exist_ok=True)
+            backup = None
+            if full.exists():
+                backup = staging / f"{i}.bak"
+                try:
+                    os.link(full, backup)
+                except OSError:
+                    shutil.copy2(full, backup)
+            os.replace(tmp, full)
+            done.append((full, backup))
+    except BaseException:
+        for full, backup in reversed(done):
+            try:
+                if backup is not None:
+                    os.replace(backup, full)
+                else:
+                    full.unlink()
+            except OSError:
+                logger.exception("annulation impossible pour %s", full)
+        raise
+
+    if fsync:
+        for parent in {full.parent for _, full in staged}:
+            _fsync_dir(parent)
+
+
+def write_files(
+    files: Iterable[Tuple[str, str]],
+    workspace: Optional[Workspace] = None,
+    fsync: bool = WORKSPACE_FSYNC,
+) -> BatchWriteResult:
+    """
+    Écrit un lot de fichiers (chemin relatif, contenu) :
+    - tous les chemins sont validés avant la moindre écriture (ValueError)
+    - les fichiers dont le contenu est identique (hash) ne sont pas réécrits
+    - les nouveaux contenus sont préparés dans .staging/, puis mis en place
+      par os.replace ; un lot en échec ne laisse pas le workspace à moitié écrit
+    - le quota est réservé une fois pour tout le lot
+    """
+    ws = _ws(workspace)
+    result = BatchWriteResult()
+
+    planned: Dict[Path, bytes] = {}
+    for path, content in files:
+        if not (path or "").strip():
+            result.skipped.append(path or "")
+            continue
+        full = safe_path(path, ws)
+        if full in planned:
+            result.skipped.append(path)  # la dernière version du lot l'emporte
+        planned[full] = (content or "").encode("utf-8")
+
+    changes: List[Tuple[Path, bytes]] = []
+    for full, data in planned.items():
+        if _unchanged(ws, full, data):
+            result.unchanged.append(str(full))
+        else:
+            changes.append((full, data))
+    if not changes:
+        return result
+
+    staging = ws.root / STAGING_DIR / uuid.uuid4().hex
+    staging.mkdir(parents=True)
+    try:
+        staged: List[Tuple[Path, Path]] = []
+        for i, (full, data) in enumerate(changes):
+            tmp = staging / str(i)
+            with open(tmp, "wb") as f:
+                f.write(data)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            staged.append((tmp, full))
+
+        with ws.reserve_all([(full, len(data)) for full, data in changes]):
+            commit_staged(staging, staged, fsync)
+            for full, data in changes:
+                ws.index.refresh(full, data)
+                result.written.append(str(full))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return result
+
+
+def write_file(relative_path: str, content: str, workspace: Optional[Workspace] = None) -> str:
+    if not (relative_path or "").strip():
+        raise ValueError("Chemin vide")
+    result = write_files([(relative_path, content)], workspace)
+    return (result.written or result.unchanged)[0]
+
 
-def read_file(relative_path: str) -> str:
-    p = safe_path(relative_path)
+def read_file(relative_path: str, workspace: Optional[Workspace] = None) -> str:
+    p = safe_path(relative_path, workspace)
     if not p.exists():
         raise FileNotFoundError("Fichier introuvable")
     return p.read_text(encoding="utf-8")
 
 
-def delete_file(relative_path: str) -> str:
-    p = safe_path(relative_path)
+def delete_file(relative_path: str, workspace: Optional[Workspace] = None) -> str:
+    ws = _ws(workspace)
+    p = safe_path(relative_path, ws)
     if not p.exists():
         raise FileNotFoundError("Fichier introuvable")
     p.unlink()
+    ws.index.remove(p)
     return str(p)
+
+
+def list_files(workspace: Optional[Workspace] = None) -> list[str]:
+    ws = _ws(workspace)
+    ws.ensure()
+    return ws.index.paths()
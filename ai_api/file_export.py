@@ -0,0 +1,179 @@
+# ai_api/file_export.py
+import fnmatch
+import gzip
+import os
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from ai_api.file_transfer import FILES_CHUNK_SIZE
+from ai_api.workspaces import Workspace
+
+# Niveau de compression des exports (1 = rapide ... 9 = compact). Pour le
+# zip, appliqué via ZipInfo.compress_level (Python >= 3.13), sinon niveau
+# par défaut de zlib (6)
+EXPORT_COMPRESS_LEVEL = int(os.getenv("EXPORT_COMPRESS_LEVEL", "6"))
+
+# Contenus déjà compressés : stockés tels quels dans le zip (CPU inutile)
+_STORED_SUFFIXES = frozenset({
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".jar", ".whl",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".pdf",
+})
+
+# niveau par entrée exposé publiquement depuis Python 3.13
+_ZIPINFO_LEVEL = hasattr(zipfile.ZipInfo, "compress_level")
+
+_ZIP_MIN_MTIME = 315619200  # 02/01/1980 : le format zip ne date pas avant 1980
+
+# (chemin dans l'archive, fichier sur le disque)
+ExportItem = Tuple[str, Path]
+
+
+def match_glob(path: str, pattern: Optional[str]) -> bool:
+    """
+    Motif sans "/" : comparé au nom du fichier (*.py) ;
+    sinon au chemin complet (src/*.py, src/**).
+    """
+    if not pattern:
+        return True
+    target = path if "/" in pattern else path.rsplit("/", 1)[-1]
+    return fnmatch.fnmatchcase(target, pattern)
+
+
+def workspace_items(workspace: Workspace, prefix: str = "", pattern: Optional[str] = None) -> List[ExportItem]:
+    """
+    Fichiers du workspace à exporter (depuis l'index, sans parcourir le disque).
+    """
+    entries, _ = workspace.index.list(prefix=prefix)
+    return [(e.path, workspace.root / e.path) for e in entries if match_glob(e.path, pattern)]
+
+
+class _Sink:
+    """
+    Flux d'écriture non seekable : l'archive y écrit, le générateur le
+    vide après chaque bloc. La mémoire reste bornée à quelques blocs.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# =========================
+# 🔹 ZIP
+# =========================
+
+def iter_zip(items: Iterable[ExportItem]) -> Iterator[bytes]:
+    """
+    Zip construit à la volée : sur un flux non seekable, zipfile écrit les
+    tailles / CRC après chaque fichier (data descriptor), sans fichier
+    temporaire. Les fichiers disparus entre-temps sont ignorés.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, full in items:
+            try:
+                f = open(full, "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                info = zipfile.ZipInfo(name, date_time=time.localtime(max(st.st_mtime, _ZIP_MIN_MTIME))[:6])
+                info.external_attr = 0o644 << 16
+                info.file_size = st.st_size  # zip64 décidé d'après la taille annoncée
+                if Path(name).suffix.lower() in _STORED_SUFFIXES:
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    if _ZIPINFO_LEVEL:
+                        info.compress_level = EXPORT_COMPRESS_LEVEL
+                with zf.open(info, "w") as dest:
+                    for chunk in iter(lambda: f.read(FILES_CHUNK_SIZE), b""):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+# =========================
+# 🔹 TAR.GZ
+# =========================
+
+def iter_tar_gz(items: Iterable[ExportItem]) -> Iterator[bytes]:
+    """
+    tar.gz construit à la volée : en-têtes tar écrits à la main pour pouvoir
+    rendre la main entre deux blocs d'un même fichier (tarfile.addfile copie
+    un fichier entier d'un coup). La taille annoncée dans l'en-tête est
+    respectée même si le fichier change pendant l'export.
+    """
+    sink = _Sink()
+    gz = gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=EXPORT_COMPRESS_LEVEL, mtime=0)
+    offset = 0
+    for name, full in items:
+        try:
+            f = open(full, "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            st = os.fstat(f.fileno())
+            info = tarfile.TarInfo(name)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            gz.write(header)
+            offset += len(header)
+
+            remaining = info.size
+            while remaining > 0:
+                chunk = f.read(min(FILES_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                gz.write(chunk)
+                remaining -= len(chunk)
+                data = sink.drain()
+                if data:
+                    yield data
+            if remaining:
+                # fichier raccourci pendant l'export : complété par des zéros
+                gz.write(tarfile.NUL * remaining)
+
+            padding = -info.size % tarfile.BLOCKSIZE
+            gz.write(tarfile.NUL * padding)
+            offset += info.size + padding
+        data = sink.drain()
+        if data:
+            yield data
+
+    # fin d'archive : deux blocs vides, puis complétée à un multiple de RECORDSIZE
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(offset + end) % tarfile.RECORDSIZE
+    gz.write(tarfile.NUL * end)
+    gz.close()
+    yield sink.drain()
+
+
+def iter_archive(items: Iterable[ExportItem], fmt: str) -> Iterator[bytes]:
+    if fmt == "zip":
+        return iter_zip(items)
+    if fmt == "tar.gz":
+        return iter_tar_gz(items)
+    raise ValueError(f"Format inconnu : {fmt}")
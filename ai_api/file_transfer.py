@@ -0,0 +1,133 @@
+# ai_api/file_transfer.py
+import os
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from ai_api.file_actions import STAGING_DIR, safe_path
+from ai_api.workspaces import Workspace
+
+# Taille des blocs lus / écrits : la mémoire par requête reste bornée
+FILES_CHUNK_SIZE = int(os.getenv("FILES_CHUNK_SIZE", str(256 * 1024)))
+
+# Taille max d'un upload (le quota du workspace s'applique en plus)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+# =========================
+# 🔹 Download
+# =========================
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    En-tête Range -> (début, fin incluse), ou None pour le fichier entier.
+    Une seule plage est servie : les demandes multi-plages (rares) reçoivent
+    le fichier entier, ce que la RFC 9110 autorise.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # "-N" : les N derniers octets
+            n = int(last)
+            if n <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(0, size - n), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def iter_file(full: Path, start: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Lit [start, start + length) par blocs de FILES_CHUNK_SIZE.
+    """
+    with open(full, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = FILES_CHUNK_SIZE if remaining is None else min(FILES_CHUNK_SIZE, remaining)
+            chunk = f.read(n)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+# =========================
+# 🔹 Upload
+# =========================
+
+async def receive_upload(
+    workspace: Workspace,
+    relative_path: str,
+    chunks: AsyncIterator[bytes],
+    expected_size: Optional[int] = None,
+) -> Tuple[str, int]:
+    """
+    Écrit un upload par blocs dans .staging/, puis le met en place d'un
+    os.replace (atomique : jamais de fichier à moitié écrit dans le
+    workspace). Le quota est vérifié avant de lire le corps si la taille
+    est annoncée, et réservé au moment du remplacement.
+    Retourne (chemin enregistré, taille).
+    """
+    full = safe_path(relative_path, workspace)
+    if expected_size is not None:
+        if expected_size > UPLOAD_MAX_BYTES:
+            raise UploadTooLarge(f"Fichier trop volumineux (max {UPLOAD_MAX_BYTES} octets)")
+        workspace.check_quota(full, expected_size)
+
+    staging = workspace.root / STAGING_DIR
+    staging.mkdir(parents=True, exist_ok=True)
+    tmp = staging / uuid.uuid4().hex
+
+    size = 0
+    f = await run_in_threadpool(open, tmp, "wb")
+    try:
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge(f"Fichier trop volumineux (max {UPLOAD_MAX_BYTES} octets)")
+                await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+
+        def commit():
+            with workspace.reserve(full, size):
+                full.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, full)
+                workspace.index.refresh(full)
+
+        await run_in_threadpool(commit)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    return str(full), size
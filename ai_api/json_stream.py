@@ -0,0 +1,173 @@
+# ai_api/json_stream.py
+import json
+from typing import List, Optional
+
+
+class BuildStreamParser:
+    """
+    Parseur JSON incrémental pour les réponses de /build :
+        {"summary": "...", "files": [{"path": ..., "content": ...}, ...]}
+
+    On lui passe les morceaux du stream au fil de l'eau ; feed() retourne le
+    texte brut de chaque objet de "files" dès que son accolade fermante
+    arrive. Chaque caractère n'est examiné qu'une fois (suivi de la
+    profondeur et des chaînes), et le texte déjà traité hors d'un objet en
+    cours est libéré.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._i = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._str_start: Optional[int] = None
+        self._obj_start: Optional[int] = None
+        self._last_str: Optional[str] = None
+        self._key: Optional[str] = None
+        self._fenced = False       # bloc ```json ouvert avant le JSON
+        self._other_block = False  # dans un bloc ``` d'un autre langage
+
+        self.started = False
+        self.closed = False
+        self.summary: Optional[str] = None
+        self.objects = 0
+
+    def feed(self, chunk: str) -> List[str]:
+        if self.closed or not chunk:
+            return []
+        self._buf += chunk
+        out: List[str] = []
+        buf = self._buf
+        i = self._i
+
+        while i < len(buf):
+            c = buf[i]
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._depth == 1:
+                        self._on_string(buf[self._str_start:i + 1])
+                    self._str_start = None
+                i += 1
+                continue
+
+            if not self.started:
+                # texte avant le JSON (```json, phrase d'intro...)
+                i = self._skip_intro(buf, i)
+                if not self.started:
+                    break
+                continue
+
+            if c == '"':
+                self._in_str = True
+                self._str_start = i
+            elif c in "{[":
+                self._depth += 1
+                if c == "{" and self._depth == 3 and self._key == "files":
+                    self._obj_start = i
+            elif c in "}]":
+                if c == "}" and self._depth == 3 and self._obj_start is not None:
+                    out.append(buf[self._obj_start:i + 1])
+                    self._obj_start = None
+                    self.objects += 1
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+                    i += 1
+                    break
+            elif self._depth == 1:
+                if c == ":":
+                    self._key = self._last_str
+                elif c == ",":
+                    self._key = None
+
+            i += 1
+
+        self._i = i
+        self._compact()
+        return out
+
+    def _skip_intro(self, buf: str, i: int) -> int:
+        """
+        Cherche l'accolade ouvrante du JSON, comme extract_json_block :
+        après un bloc ```json s'il y en a un ; sinon seule une accolade
+        suivie de '"' ou '}' compte (pas celles de la prose : "{path, content}",
+        "utilise { en fin de ligne"...). Les blocs d'autres langages sont
+        sautés. Retourne la position où reprendre : si le morceau s'arrête
+        sur un motif incomplet ("``", "```js", "{  "), on attend la suite.
+        """
+        n = len(buf)
+        while i < n:
+            c = buf[i]
+            if c == "`":
+                if not buf.startswith("```", i):
+                    if "```".startswith(buf[i:]):
+                        return i
+                    i += 1
+                    continue
+                end = i + 3
+                while end < n and (buf[end].isalnum() or buf[end] in "_-+"):
+                    end += 1
+                if end == n:
+                    return i
+                tag = buf[i + 3:end].lower()
+                if self._other_block:
+                    self._other_block = False
+                elif tag == "json":
+                    self._fenced = True
+                elif tag:
+                    self._other_block = True
+                i = end
+                continue
+            if c == "{" and not self._other_block:
+                if not self._fenced:
+                    j = i + 1
+                    while j < n and buf[j].isspace():
+                        j += 1
+                    if j == n:
+                        return i
+                    if buf[j] not in '"}':
+                        i += 1
+                        continue
+                self.started = True
+                self._depth = 1
+                return i + 1
+            i += 1
+        return i
+
+    def _on_string(self, literal: str):
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            value = literal[1:-1]
+        if self._key == "summary":
+            self.summary = value
+        self._last_str = value
+
+    def _compact(self):
+        # ne garder que ce qui peut encore servir : l'objet ou la chaîne en cours
+        keep = self._i
+        for start in (self._obj_start, self._str_start):
+            if start is not None:
+                keep = min(keep, start)
+        if keep == 0:
+            return
+        self._buf = self._buf[keep:]
+        self._i -= keep
+        if self._obj_start is not None:
+            self._obj_start -= keep
+        if self._str_start is not None:
+            self._str_start -= keep
+
+    @property
+    def truncated(self) -> bool:
+        """
+        True si le stream s'est arrêté avant la fin du JSON.
+        """
+        return not self.closed
@@ -0,0 +1,187 @@
+# ai_api/json_utils.py
+import json
+import re
+from typing import List, Optional, Tuple
+
+# Un seul passage sur le texte : on saute d'un caractère utile au suivant
+# avec des regex compilées (le contenu des chaînes n'est pas parcouru en Python).
+_TOKEN = re.compile(r"""["'{}\[\],:]|[A-Za-z_][A-Za-z0-9_]*""")
+_DQ_STRING = re.compile(r'"[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*"')
+_DQ_LOOSE = re.compile(r'"[^"\\]*(?:\\[\s\S][^"\\]*)*"')
+_SQ_STOP = re.compile(r"""['"\\\x00-\x1f]""")
+_COLON_AHEAD = re.compile(r"\s*:")
+_CTRL = re.compile(r"[\x00-\x1f]")
+
+_decoder = json.JSONDecoder()
+
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CTRL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_CTRL_TABLE = {i: _CTRL_ESCAPES.get(chr(i)) or f"\\u{i:04x}" for i in range(0x20)}
+
+
+def _escape_ctrl(c: str) -> str:
+    return _CTRL_TABLE[ord(c)]
+
+
+def _escape_ctrl_all(s: str) -> str:
+    # les cas courants via str.replace (rapide), le reste au cas par cas
+    s = s.replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+    if _CTRL.search(s):
+        s = _CTRL.sub(lambda m: _escape_ctrl(m.group()), s)
+    return s
+
+
+def _scan_object(text: str, start: int) -> Tuple[int, Optional[str]]:
+    """
+    Parcourt l'objet qui commence à text[start] ("{") en tenant compte des
+    chaînes, et le répare au passage :
+    - quotes simples -> quotes doubles
+    - clés sans guillemets -> "key":
+    - virgules en trop avant } ou ]
+    - retours à la ligne / tabulations bruts dans les chaînes
+    - True / False / None (Python) -> true / false / null
+
+    Retourne (fin, texte réparé ou None si rien à réparer) ; fin = -1 si
+    l'objet n'est pas refermé.
+    """
+    out: List[str] = []
+    last = start  # text[last:...] pas encore recopié dans out
+    stack: List[str] = []
+    comma_at = -1
+    pos = start
+
+    while True:
+        m = _TOKEN.search(text, pos)
+        if m is None:
+            return -1, None
+        tok = m.group()
+        i = m.start()
+        pos = m.end()
+
+        if tok == '"':
+            valid = _DQ_STRING.match(text, i)
+            if valid is not None:
+                pos = valid.end()
+                comma_at = -1
+                continue
+            # caractères de contrôle bruts dans la chaîne : échappés d'un coup
+            loose = _DQ_LOOSE.match(text, i)
+            if loose is None:
+                return -1, None
+            out.append(text[last:i])
+            out.append(_escape_ctrl_all(loose.group()))
+            last = pos = loose.end()
+
+        elif tok == "'":
+            out.append(text[last:i])
+            out.append('"')
+            while True:
+                s = _SQ_STOP.search(text, pos)
+                if s is None:
+                    return -1, None
+                c = s.group()
+                k = s.start()
+                out.append(text[pos:k])
+                if c == "'":
+                    out.append('"')
+                    pos = k + 1
+                    break
+                if c == "\\":
+                    nxt = text[k + 1:k + 2]
+                    out.append("'" if nxt == "'" else "\\" + nxt)
+                    pos = k + 2
+                elif c == '"':
+                    out.append('\\"')
+                    pos = k + 1
+                else:
+                    out.append(_escape_ctrl(c))
+                    pos = k + 1
+            last = pos
+
+        elif tok in "{[":
+            stack.append(tok)
+
+        elif tok in "}]":
+            if comma_at != -1 and not text[comma_at + 1:i].strip():
+                out.append(text[last:comma_at])
+                last = comma_at + 1
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                if not out:
+                    return end, None
+                out.append(text[last:end])
+                return end, "".join(out)
+
+        elif tok == ",":
+            comma_at = i
+            continue
+
+        elif tok != ":":
+            # identifiant nu : clé sans guillemets ou littéral Python
+            if stack and stack[-1] == "{" and _COLON_AHEAD.match(text, pos):
+                out.append(text[last:i])
+                out.append(f'"{tok}"')
+                last = pos
+            elif tok in _PY_LITERALS:
+                out.append(text[last:i])
+                out.append(_PY_LITERALS[tok])
+                last = pos
+
+        comma_at = -1
+
+
+def _first_object(text: str, start: int) -> Optional[dict]:
+    while True:
+        pos = text.find("{", start)
+        if pos == -1:
+            return None
+
+        # cas courant : JSON déjà valide, décodé directement
+        try:
+            obj = _decoder.raw_decode(text, pos)[0]
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+
+        end, repaired = _scan_object(text, pos)
+        if end == -1:
+            # accolade jamais refermée (texte d'intro) : on essaie la suivante
+            start = pos + 1
+            continue
+        if repaired is not None:
+            try:
+                obj = json.loads(repaired)
+                if isinstance(obj, dict):
+                    return obj
+            except ValueError:
+                pass
+        start = end
+
+
+def extract_json_block(text: str) -> dict:
+    """
+    Extrait le premier objet JSON valide trouvé dans un texte, en réparant
+    les erreurs classiques des modèles. Supporte les blocs ```json ... ```
+    et le texte avant/après le JSON (y compris s'il contient des accolades,
+    même non refermées).
+    Le bloc ```json est essayé en premier. Temps linéaire dans le cas
+    courant : chaque objet candidat est décodé puis, si besoin, parcouru
+    une fois ; seule une accolade jamais refermée fait reprendre le
+    parcours à l'accolade suivante.
+    """
+    if not text:
+        raise ValueError("Réponse vide du modèle")
+
+    fence = text.find("```json")
+    if fence != -1:
+        obj = _first_object(text, fence)
+        if obj is not None:
+            return obj
+    obj = _first_object(text, 0)
+    if obj is not None:
+        return obj
+
+    raise ValueError("JSON non trouvé dans la réponse du modèle")
@@ -1,6 +1,7 @@
 import requests
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+from ai_api.backends import pool
+
 MODEL = "deepseek-coder"
 
 SYSTEM_PROMPTS = {
@@ -31,7 +32,7 @@ def generate(prompt: str, language: str = "fr") -> str:
         "stream": False
     }
 
-    response = requests.post(OLLAMA_URL, json=payload)
+    response = requests.post(pool.pick_sync().url + "/api/generate", json=payload)
     response.raise_for_status()
 
     return response.json()["response"]
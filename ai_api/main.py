@@ -1,17 +1,30 @@
 # ai_api/main.py
 from ai_api.tools import TOOLS
-import json
+import asyncio
+import hmac
+import logging
+import mimetypes
+import os
 import re
+import time
 import uuid
+from urllib.parse import quote
+from typing import AsyncIterator, Callable, List, Literal, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Request, File, Form, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 from sqlalchemy.orm import Session
 
 from ai_api.schemas import BuildRequest, BuildResponse
+from ai_api.schemas import BuildPipelineRequest, BuildPipelineResponse, BuildFileResult
 from ai_api.auth.routes import router as auth_router
-from ai_api.auth.routes import get_current_user_email
+from ai_api.auth.routes import get_current_user_email, load_profile, save_profile, oauth2_scheme
+from ai_api.auth.cache import auth_cache_stats
+from ai_api.auth.security import shutdown_hash_pool
 
 from ai_api.schemas import (
     GenerateRequest,
@@ -19,11 +32,24 @@ from ai_api.schemas import (
     ContinueRequest,
     OrchestrateRequest,
     OrchestrateResponse,
+    OrchestrateFanoutRequest,
+    OrchestrateFanoutResponse,
+    AgentResult,
     CreateFileRequest,
     CreateFileResponse,
     ListFilesResponse,
+    FileInfo,
+    SearchMatchInfo,
+    SearchResponse,
     ReadFileRequest,
     ReadFileResponse,
+    UploadFileResponse,
+    BatchWriteRequest,
+    BatchWriteResponse,
+    SnapshotInfo,
+    SnapshotListResponse,
+    SnapshotDiffResponse,
+    SnapshotRestoreResponse,
     DeleteFileRequest,
     DeleteFileResponse,
 )
@@ -33,25 +59,71 @@ from ai_api.auth.schemas import (
     UpdateProfileRequest,
 )
 
-from ai_api.file_actions import write_file, list_files, read_file, delete_file
+from ai_api.file_actions import write_file, write_files, read_file, delete_file, safe_path
+from ai_api.workspaces import Workspace, QuotaExceeded, workspaces
+from ai_api.snapshots import (
+    create_snapshot,
+    list_snapshots,
+    diff_snapshots,
+    restore_snapshot,
+    snapshot_files,
+    store_usage,
+)
+from ai_api.file_export import match_glob, workspace_items, iter_archive
+from ai_api.file_transfer import (
+    FILES_CHUNK_SIZE,
+    RangeNotSatisfiable,
+    UploadTooLarge,
+    parse_range,
+    iter_file,
+    receive_upload,
+)
 
-from ai_api.agents.orchestrator import pick_agent
-from ai_api.agents.prompts import system_prompt_for
+from ai_api.agents.orchestrator import pick_agent, pick_agents
+from ai_api.agents.prompts import (
+    system_prompt_for,
+    generate_system_prompt,
+    continue_system_prompt,
+    build_system_prompt,
+    plan_system_prompt,
+    file_system_prompt,
+)
 
-from ai_api.ollama_client import generate
+from ai_api.ollama_client import (
+    ChatResult,
+    get_async_client,
+    achat,
+    astream_chat,
+    flights,
+    prefix_stats,
+    aclose as close_ollama_client,
+)
+from ai_api.providers.base import GenerationResult
+from ai_api.backends import pool
+from ai_api.scheduler import scheduler, Ticket, LANE_INTERACTIVE, LANE_BATCH
+from ai_api.sse import sse_event, SSE_HEADERS
+from ai_api.json_stream import BuildStreamParser
+from ai_api.json_utils import extract_json_block
+from ai_api.output_cleaner import StreamCleaner, clean_output
+from ai_api.response_cache import response_cache
+from ai_api.near_cache import near_cache, near_scope, NEAR_CACHE_ENABLED
+from ai_api.tokens import context_budget
 
 from ai_api.memory import (
-    get_session_history,
+    get_session_turns,
     add_to_session,
+    add_turns,
     list_sessions,
     get_session_messages,
     create_session,
+    session_store_stats,
 )
 
 from ai_api.init_db import init_db
 from ai_api.deps import get_db
-from ai_api.models import User
+from ai_api.db import db_stats, dispose_engines
 
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Custom AI API", version="1.0")
 app.include_router(auth_router)
@@ -71,135 +143,27 @@ app.add_middleware(
 )
 
 
-# =========================
-# 🔹 JSON helpers
-# =========================
-
-def extract_json_block(text: str) -> dict:
-    """
-    Extrait le premier objet JSON valide trouvé dans un texte.
-    Supporte aussi les blocs ```json ... ```
-    """
-    if not text:
-        raise ValueError("Réponse vide du modèle")
-
-    # 1) bloc ```json ... ```
-    m = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if m:
-        return json.loads(m.group(1))
-
-    # 2) sinon chercher le premier {...}
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        candidate = text[start:end + 1]
-        return json.loads(candidate)
-
-    raise ValueError("JSON non trouvé dans la réponse du modèle")
-
-
-def repair_json_loose(text: str) -> str:
-    """
-    Répare les erreurs JSON classiques :
-    - clés sans guillemets -> "key":
-    - quotes simples -> quotes doubles
-    """
-    if not text:
-        return text
-
-    # garder seulement la zone JSON
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        text = text[start:end + 1]
-
-    # remplacer quotes simples par doubles
-    text = re.sub(r"(?<!\\)'", '"', text)
-
-    # ajouter quotes aux clés non-quotées: summary: -> "summary":
-    text = re.sub(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:', r'\1"\2":', text)
-
-    return text
-
-
 # =========================
 # 🔹 Startup
 # =========================
 
 @app.on_event("startup")
-def on_startup():
-    init_db()
-
-
-# =========================
-# 🔹 Utils output
-# =========================
-
-def estimate_tokens(text: str) -> int:
-    return int(len(text.split()) * 1.3)
-
-
-def clean_output(text: str) -> str:
-    if not text:
-        return text
-
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
-    if not lines:
-        return text.strip()
-
-    bad_prefixes = [
-        "bonjour",
-        "salut",
-        "hello",
-        "coucou",
-        "bonsoir",
-        "je suis",
-        "en tant qu",
-        "avec plaisir",
-        "bien sûr",
-        "bien sur",
-        "d'accord",
-        "ok",
-        "certainement",
-        "bienvenue",
-        "que voulez-vous",
-        "que veux-tu",
-        "comment puis-je",
-        "comment je peux",
-        "je peux",
-        "laissez-moi",
-        "laisse-moi",
-    ]
-
-    while lines:
-        low = lines[0].lower()
-        if any(low.startswith(x) for x in bad_prefixes):
-            lines.pop(0)
-            continue
-        if low.startswith("agent:") or low.startswith("ai:") or low.startswith("assistant:"):
-            lines.pop(0)
-            continue
-        break
-
-    cleaned = "\n".join(lines).strip()
-
-    endings_to_remove = [
-        "que voulez-vous que je réponde",
-        "que veux-tu que je réponde",
-        "voulez-vous que je continue",
-        "souhaitez-vous que je continue",
-        "comment puis-je vous aider",
-        "comment je peux t'aider",
-    ]
+async def on_startup():
+    await run_in_threadpool(init_db)
+    await run_in_threadpool(response_cache.open)
+    app.state.workspace_task = asyncio.create_task(workspaces.run())
+    app.state.health_task = asyncio.create_task(pool.run_health_checks(get_async_client()))
 
-    low_cleaned = cleaned.lower()
-    for end in endings_to_remove:
-        if end in low_cleaned:
-            idx = low_cleaned.find(end)
-            cleaned = cleaned[:idx].strip()
-            break
 
-    return cleaned if cleaned else text.strip()
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.health_task.cancel()
+    app.state.workspace_task.cancel()
+    await run_in_threadpool(workspaces.save_indexes)
+    await run_in_threadpool(response_cache.flush)
+    await close_ollama_client()
+    shutdown_hash_pool()
+    await dispose_engines()
 
 
 # =========================
@@ -211,6 +175,33 @@ def health():
     return {"status": "ok"}
 
 
+# Jeton statique pour les collecteurs de métriques (Prometheus...) ;
+# sans lui, /metrics demande un utilisateur connecté (JWT)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+def _metrics_access(token: str = Depends(oauth2_scheme)):
+    if METRICS_TOKEN and hmac.compare_digest(token.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
+        return
+    get_current_user_email(token)
+
+
+@app.get("/metrics", dependencies=[Depends(_metrics_access)])
+def metrics():
+    return {
+        "singleflight": flights.stats(),
+        "response_cache": response_cache.stats(),
+        "near_cache": near_cache.stats(),
+        "sessions": session_store_stats(),
+        "prefix_cache": prefix_stats,
+        "ollama": pool.stats(),
+        "scheduler": scheduler.stats(),
+        "auth": auth_cache_stats(),
+        "db": db_stats(),
+        "workspaces": workspaces.stats(),
+    }
+
+
 # =====================================
 # 🔹 Sessions (JWT requis)
 # =====================================
@@ -241,11 +232,7 @@ def me(
     email: str = Depends(get_current_user_email),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Utilisateur introuvable")
-
-    return ProfileResponse(email=user.email, default_agent=user.default_agent)
+    return load_profile(db, email)
 
 
 @app.get("/profile", response_model=ProfileResponse)
@@ -253,11 +240,7 @@ def get_profile(
     email: str = Depends(get_current_user_email),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Utilisateur introuvable")
-
-    return ProfileResponse(email=user.email, default_agent=user.default_agent)
+    return load_profile(db, email)
 
 
 @app.put("/profile", response_model=ProfileResponse)
@@ -266,15 +249,175 @@ def update_profile(
     email: str = Depends(get_current_user_email),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Utilisateur introuvable")
+    return save_profile(db, email, payload)
+
+
+# =========================
+# 🔹 Messages de génération
+# =========================
+#
+# Chaque appel est envoyé à /api/chat sous la forme :
+#   [system (identique par agent/langue), ...tours de la session, user]
+# Le préfixe stable permet à Ollama de réutiliser son cache KV.
 
-    user.default_agent = payload.default_agent
-    db.commit()
-    db.refresh(user)
+def _cap_max_tokens(value: int, default: int = 512, hard_max: int = 2048) -> int:
+    return min(value or default, hard_max)
 
-    return ProfileResponse(email=user.email, default_agent=user.default_agent)
+
+def _chat_messages(system_prompt: str, turns: List[dict], user_content: str) -> List[dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        *turns,
+        {"role": "user", "content": user_content},
+    ]
+
+
+def _continue_user_content(request: ContinueRequest) -> str:
+    return f"""
+Suite directe du texte ci-dessous, sans rien ajouter :
+
+{request.last_output}
+
+Continue.
+""".strip()
+
+
+def _build_user_content(request: BuildRequest, agent: str) -> str:
+    return f"""
+Agent sélectionné: {agent}
+
+Demande :
+{request.prompt}
+""".strip()
+
+
+async def _turns_for(session_id: str, max_tokens: int, system_prompt: str, user_content: str) -> List[dict]:
+    """
+    Tours de session packés dans ce qu'il reste de la fenêtre de contexte
+    une fois réservés la génération, le prompt système et la demande.
+    """
+    budget = context_budget(max_tokens, system_prompt, user_content)
+    return await run_in_threadpool(get_session_turns, session_id, budget_tokens=budget)
+
+
+def _resolve_agent(request) -> str:
+    agent = request.agent
+    if agent == "auto":
+        agent = pick_agent(request.prompt)
+    return agent
+
+
+def _generation_stats(result: GenerationResult) -> dict:
+    """
+    Compteurs réels renvoyés par Ollama : tronqué si la génération s'est
+    arrêtée sur num_predict (done_reason == "length"). À 0 si la réponse
+    vient d'un cache.
+    """
+    return {
+        "truncated": result.truncated,
+        "prompt_tokens": result.prompt_eval_count,
+        "completion_tokens": result.eval_count,
+        "tokens_per_second": result.tokens_per_second,
+    }
+
+
+async def _chat_near_cached(
+    scope: str,
+    user_prompt: str,
+    messages: List[dict],
+    max_tokens: int,
+    cache_scope: str,
+    session_id: Optional[str] = None,
+) -> Tuple[ChatResult, Optional[float]]:
+    """
+    Passe par le cache approximatif (prompts quasi identiques) avant Ollama.
+    Seulement sans historique : sinon la réponse dépend du contexte.
+    MinHash en pur Python : lookup / add passent par le threadpool.
+    Les réponses tronquées ne sont pas mises en cache.
+    Retourne (résultat, similarité si hit approximatif).
+    """
+    use_near = NEAR_CACHE_ENABLED and len(messages) == 2
+    if use_near:
+        hit = await run_in_threadpool(near_cache.lookup, scope, user_prompt)
+        if hit is not None:
+            text, similarity = hit
+            return ChatResult(text=text, cached=True), similarity
+
+    result = await achat(messages, max_tokens=max_tokens, cache_scope=cache_scope, session_id=session_id)
+
+    if use_near and not result.truncated:
+        await run_in_threadpool(near_cache.add, scope, user_prompt, result.text)
+    return result, None
+
+
+async def _sse_generation(
+    messages: List[dict],
+    max_tokens: int,
+    session_id: str,
+    on_done: Callable[[str], None],
+    extra: Optional[dict] = None,
+    cache_scope: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Relaie les tokens d'Ollama en événements SSE "token", nettoyés au fil
+    de l'eau (salutations, phrases de fin), puis un événement final "done"
+    avec le résultat complet. L'historique de session n'est écrit (via
+    on_done, exécuté dans le threadpool) qu'une fois le stream terminé.
+    """
+    cleaner = StreamCleaner()
+    parts: list[str] = []
+    final = ChatResult(text="")
+    try:
+        async for chunk in astream_chat(
+            messages, max_tokens=max_tokens, cache_scope=cache_scope, session_id=session_id
+        ):
+            if isinstance(chunk, ChatResult):
+                final = chunk
+                continue
+            piece = cleaner.feed(chunk)
+            if piece:
+                parts.append(piece)
+                yield sse_event({"token": piece}, event="token")
+    except Exception as e:
+        yield sse_event({"detail": f"Ollama error: {repr(e)}"}, event="error")
+        return
+
+    piece = cleaner.finish()
+    if piece:
+        parts.append(piece)
+        yield sse_event({"token": piece}, event="token")
+
+    result = "".join(parts)
+    await run_in_threadpool(on_done, result)
+
+    done = {
+        "result": result,
+        "session_id": session_id,
+        "prefill_saved_ms": final.prefill_saved_ms,
+    }
+    done.update(_generation_stats(final))
+    done.update(extra or {})
+    yield sse_event(done, event="done")
+
+
+def _sse_response(ticket: Ticket, events: AsyncIterator[str]) -> StreamingResponse:
+    """
+    Le slot du scheduler reste pris pendant tout le stream ; il est libéré
+    à la fin, ou par la tâche de fond si le client est parti avant.
+    """
+    async def guarded():
+        try:
+            async for event in events:
+                yield event
+        finally:
+            scheduler.release(ticket)
+
+    return StreamingResponse(
+        guarded(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(scheduler.release, ticket),
+    )
 
 
 # =========================
@@ -282,7 +425,7 @@ def update_profile(
 # =========================
 
 @app.post("/generate", response_model=GenerateResponse)
-def generate_text(
+async def generate_text(
     request: GenerateRequest,
     email: str = Depends(get_current_user_email)
 ):
@@ -290,53 +433,50 @@ def generate_text(
         raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
 
     session_id = request.session_id or str(uuid.uuid4())
-    history = get_session_history(session_id)
-
-    DEFAULT_MAX = 512
-    HARD_MAX = 2048
-    max_tokens = min(request.max_tokens or DEFAULT_MAX, HARD_MAX)
-
-    system_prompt = f"""
-[INSTRUCTIONS STRICTES]
-Tu es un moteur d’API IA.
-
-RÈGLES OBLIGATOIRES :
-- Réponds uniquement avec la réponse finale.
-- Pas de salutations.
-- Pas d’excuses.
-- Ne parle jamais de toi-même.
-- Ne pose aucune question.
-- Ne mets aucun préfixe : pas "Assistant :", pas "Utilisateur :".
-- Langue obligatoire : {request.language}.
-
-Si la réponse est coupée, termine EXACTEMENT par :
-Souhaitez-vous que je continue ?
-""".strip()
+    max_tokens = _cap_max_tokens(request.max_tokens)
 
-    full_prompt = f"""
-{system_prompt}
+    system_prompt = generate_system_prompt(request.language)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, request.prompt)
+    messages = _chat_messages(system_prompt, turns, request.prompt)
 
-Contexte utile :
-{history}
+    async with scheduler.slot(email, LANE_INTERACTIVE):
+        try:
+            chat = await achat(messages, max_tokens=max_tokens, cache_scope="generate", session_id=session_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
 
-Question :
-{request.prompt}
-""".strip()
+    result = clean_output(chat.text)
 
-    try:
-        result = generate(prompt=full_prompt, max_tokens=max_tokens)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+    await run_in_threadpool(add_turns, session_id, f"USER: {request.prompt.strip()}", f"AI: {result.strip()}")
+
+    return GenerateResponse(
+        result=result,
+        session_id=session_id,
+        prefill_saved_ms=chat.prefill_saved_ms,
+        **_generation_stats(chat),
+    )
+
+
+@app.post("/generate/stream")
+async def generate_text_stream(
+    request: GenerateRequest,
+    email: str = Depends(get_current_user_email)
+):
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
 
-    result = clean_output(result)
+    session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
 
-    add_to_session(session_id, f"USER: {request.prompt.strip()}")
-    add_to_session(session_id, f"AI: {result.strip()}")
+    system_prompt = generate_system_prompt(request.language)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, request.prompt)
+    messages = _chat_messages(system_prompt, turns, request.prompt)
 
-    estimated_tokens = estimate_tokens(result)
-    truncated = estimated_tokens >= int(max_tokens * 0.9)
+    def on_done(result: str):
+        add_turns(session_id, f"USER: {request.prompt.strip()}", f"AI: {result.strip()}")
 
-    return GenerateResponse(result=result, truncated=truncated, session_id=session_id)
+    ticket = await scheduler.acquire(email, LANE_INTERACTIVE)
+    return _sse_response(ticket, _sse_generation(messages, max_tokens, session_id, on_done, cache_scope="generate"))
 
 
 # =========================
@@ -344,7 +484,7 @@ Question :
 # =========================
 
 @app.post("/continue", response_model=GenerateResponse)
-def continue_text(
+async def continue_text(
     request: ContinueRequest,
     email: str = Depends(get_current_user_email)
 ):
@@ -352,49 +492,46 @@ def continue_text(
         raise HTTPException(status_code=400, detail="Texte précédent vide")
 
     session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
 
-    DEFAULT_MAX = 512
-    HARD_MAX = 2048
-    max_tokens = min(request.max_tokens or DEFAULT_MAX, HARD_MAX)
-
-    system_prompt = f"""
-Tu es un moteur de réponse API.
-
-RÈGLES STRICTES (obligatoires) :
-- Réponds uniquement par la réponse finale.
-- Aucune salutation (pas Bonjour, Salut, etc.)
-- Aucune excuse.
-- Ne parle jamais de toi-même (pas "je", pas "en tant qu'IA").
-- Ne pose aucune question.
-- Pas de texte inutile.
-- Langue obligatoire : {request.language}
+    messages = _chat_messages(continue_system_prompt(request.language), [], _continue_user_content(request))
 
-Réponds en UNE seule phrase si possible.
-""".strip()
+    async with scheduler.slot(email, LANE_INTERACTIVE):
+        try:
+            chat = await achat(messages, max_tokens=max_tokens, cache_scope="continue", session_id=session_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
 
-    full_prompt = f"""
-{system_prompt}
+    result = clean_output(chat.text)
 
-Suite directe du texte ci-dessous, sans rien ajouter :
+    await run_in_threadpool(add_to_session, session_id, f"AI: {result.strip()}")
 
-{request.last_output}
+    return GenerateResponse(
+        result=result,
+        session_id=session_id,
+        prefill_saved_ms=chat.prefill_saved_ms,
+        **_generation_stats(chat),
+    )
 
-Continue.
-""".strip()
 
-    try:
-        result = generate(prompt=full_prompt, max_tokens=max_tokens)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+@app.post("/continue/stream")
+async def continue_text_stream(
+    request: ContinueRequest,
+    email: str = Depends(get_current_user_email)
+):
+    if not request.last_output or not request.last_output.strip():
+        raise HTTPException(status_code=400, detail="Texte précédent vide")
 
-    result = clean_output(result)
+    session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
 
-    add_to_session(session_id, f"AI: {result.strip()}")
+    messages = _chat_messages(continue_system_prompt(request.language), [], _continue_user_content(request))
 
-    estimated_tokens = estimate_tokens(result)
-    truncated = estimated_tokens >= int(max_tokens * 0.9)
+    def on_done(result: str):
+        add_to_session(session_id, f"AI: {result.strip()}")
 
-    return GenerateResponse(result=result, truncated=truncated, session_id=session_id)
+    ticket = await scheduler.acquire(email, LANE_INTERACTIVE)
+    return _sse_response(ticket, _sse_generation(messages, max_tokens, session_id, on_done, cache_scope="continue"))
 
 
 # =========================
@@ -402,7 +539,7 @@ Continue.
 # =========================
 
 @app.post("/orchestrate", response_model=OrchestrateResponse)
-def orchestrate(
+async def orchestrate(
     request: OrchestrateRequest,
     email: str = Depends(get_current_user_email)
 ):
@@ -410,46 +547,166 @@ def orchestrate(
         raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
 
     session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
+    agent = _resolve_agent(request)
 
-    DEFAULT_MAX = 512
-    HARD_MAX = 2048
-    max_tokens = min(request.max_tokens or DEFAULT_MAX, HARD_MAX)
+    system_prompt = system_prompt_for(agent, request.language)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, request.prompt)
+    messages = _chat_messages(system_prompt, turns, request.prompt)
 
-    agent = request.agent
-    if agent == "auto":
-        agent = pick_agent(request.prompt)
+    async with scheduler.slot(email, LANE_INTERACTIVE):
+        try:
+            chat, similarity = await _chat_near_cached(
+                near_scope("orchestrate", agent, request.language),
+                request.prompt,
+                messages,
+                max_tokens,
+                cache_scope="orchestrate",
+                session_id=session_id,
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+
+    result = clean_output(chat.text)
+
+    await run_in_threadpool(add_turns, session_id, f"USER: {request.prompt.strip()}", f"AI({agent}): {result.strip()}")
+
+    return OrchestrateResponse(
+        agent=agent,
+        result=result,
+        session_id=session_id,
+        similarity=similarity,
+        prefill_saved_ms=chat.prefill_saved_ms,
+        **_generation_stats(chat),
+    )
+
+
+@app.post("/orchestrate/stream")
+async def orchestrate_stream(
+    request: OrchestrateRequest,
+    email: str = Depends(get_current_user_email)
+):
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
+
+    session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
+    agent = _resolve_agent(request)
 
-    history = get_session_history(session_id)
     system_prompt = system_prompt_for(agent, request.language)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, request.prompt)
+    messages = _chat_messages(system_prompt, turns, request.prompt)
 
-    full_prompt = f"""
-{system_prompt}
+    def on_done(result: str):
+        add_turns(session_id, f"USER: {request.prompt.strip()}", f"AI({agent}): {result.strip()}")
 
-Contexte utile :
-{history}
+    ticket = await scheduler.acquire(email, LANE_INTERACTIVE)
+    return _sse_response(
+        ticket,
+        _sse_generation(messages, max_tokens, session_id, on_done, extra={"agent": agent}, cache_scope="orchestrate"),
+    )
 
-Demande :
-{request.prompt}
-""".strip()
 
-    try:
-        result = generate(prompt=full_prompt, max_tokens=max_tokens)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+# =========================
+# 🔹 /orchestrate/fanout (JWT requis)
+# =========================
 
-    result = clean_output(result)
+# Agents interrogés en parallèle au maximum, et délai max par agent
+FANOUT_MAX_PARALLEL = int(os.getenv("FANOUT_MAX_PARALLEL", "4"))
+FANOUT_AGENT_TIMEOUT = float(os.getenv("FANOUT_AGENT_TIMEOUT", "120"))
 
-    add_to_session(session_id, f"USER: {request.prompt.strip()}")
-    add_to_session(session_id, f"AI({agent}): {result.strip()}")
 
-    estimated_tokens = estimate_tokens(result)
-    truncated = estimated_tokens >= int(max_tokens * 0.9)
+async def _run_agent(
+    agent: str,
+    request: OrchestrateFanoutRequest,
+    email: str,
+    session_id: str,
+    max_tokens: int,
+    limit: asyncio.Semaphore,
+    timeout: float,
+) -> AgentResult:
+    """
+    Un agent du fan-out : slot du scheduler + appel Ollama, le tout borné
+    par le délai. Une erreur ou un dépassement ne remonte que dans le
+    résultat de cet agent.
+    """
+    system_prompt = system_prompt_for(agent, request.language)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, request.prompt)
+    messages = _chat_messages(system_prompt, turns, request.prompt)
+
+    async def call() -> Tuple[ChatResult, Optional[float]]:
+        async with limit, scheduler.slot(email, LANE_INTERACTIVE):
+            return await _chat_near_cached(
+                near_scope("orchestrate", agent, request.language),
+                request.prompt,
+                messages,
+                max_tokens,
+                cache_scope="orchestrate",
+                session_id=session_id,
+            )
 
-    return OrchestrateResponse(
+    started = time.perf_counter()
+    try:
+        chat, similarity = await asyncio.wait_for(call(), timeout=timeout)
+    except asyncio.TimeoutError:
+        error = f"timeout après {timeout:g}s"
+    except HTTPException as e:
+        error = str(e.detail)
+    except Exception as e:
+        error = f"Ollama error: {repr(e)}"
+    else:
+        result = clean_output(chat.text)
+        return AgentResult(
+            agent=agent,
+            result=result,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+            similarity=similarity,
+            prefill_saved_ms=chat.prefill_saved_ms,
+            **_generation_stats(chat),
+        )
+
+    return AgentResult(
         agent=agent,
-        result=result,
-        truncated=truncated,
-        session_id=session_id
+        ok=False,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        error=error,
+    )
+
+
+@app.post("/orchestrate/fanout", response_model=OrchestrateFanoutResponse)
+async def orchestrate_fanout(
+    request: OrchestrateFanoutRequest,
+    email: str = Depends(get_current_user_email)
+):
+    """
+    Même demande envoyée à plusieurs agents en parallèle (liste explicite,
+    ou tous les agents pertinents si la liste est vide). Les résultats
+    arrivent ensemble, y compris partiels si un agent échoue.
+    """
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
+
+    session_id = request.session_id or str(uuid.uuid4())
+    max_tokens = _cap_max_tokens(request.max_tokens)
+    agents = list(dict.fromkeys(request.agents)) or pick_agents(request.prompt)
+    timeout = min(request.timeout_s or FANOUT_AGENT_TIMEOUT, FANOUT_AGENT_TIMEOUT)
+
+    limit = asyncio.Semaphore(max(1, FANOUT_MAX_PARALLEL))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        _run_agent(agent, request, email, session_id, max_tokens, limit, timeout)
+        for agent in agents
+    ))
+
+    history = [f"USER: {request.prompt.strip()}"]
+    history += [f"AI({r.agent}): {r.result.strip()}" for r in results if r.ok]
+    await run_in_threadpool(add_turns, session_id, *history)
+
+    return OrchestrateFanoutResponse(
+        session_id=session_id,
+        results=results,
+        partial=not all(r.ok for r in results),
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
     )
 
 
@@ -466,21 +723,116 @@ def tools(email: str = Depends(get_current_user_email)):
 # 🔹 Files (JWT requis)
 # =========================
 
+# Taille max d'une page de GET /files (sans limit : tout le listing)
+FILES_PAGE_MAX = int(os.getenv("FILES_PAGE_MAX", "1000"))
+
+
 @app.post("/files/create", response_model=CreateFileResponse)
 def create_file(
     payload: CreateFileRequest,
     email: str = Depends(get_current_user_email)
 ):
     try:
-        saved_path = write_file(payload.path, payload.content)
+        saved_path = write_file(payload.path, payload.content, workspaces.get(email))
         return CreateFileResponse(ok=True, path=saved_path)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post("/files/batch", response_model=BatchWriteResponse)
+def files_batch(
+    payload: BatchWriteRequest,
+    email: str = Depends(get_current_user_email),
+):
+    try:
+        result = write_files(
+            [(f.path, f.content) for f in payload.files],
+            workspaces.get(email),
+            fsync=payload.fsync,
+        )
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return BatchWriteResponse(
+        ok=True,
+        written=result.written,
+        unchanged=result.unchanged,
+        skipped=result.skipped,
+    )
+
+
 @app.get("/files", response_model=ListFilesResponse)
-def files(email: str = Depends(get_current_user_email)):
-    return ListFilesResponse(files=list_files())
+def files(
+    prefix: str = "",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=FILES_PAGE_MAX),
+    sort: Literal["path", "size", "mtime"] = "path",
+    order: Literal["asc", "desc"] = "asc",
+    email: str = Depends(get_current_user_email),
+):
+    # servi depuis l'index mémoire (pas de parcours du disque)
+    try:
+        entries, next_cursor = workspaces.get(email).index.list(
+            prefix=prefix.lstrip("/"), cursor=cursor, limit=limit, sort=sort, order=order
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return ListFilesResponse(
+        files=[e.path for e in entries],
+        entries=[FileInfo(path=e.path, size=e.size, mtime=e.mtime, hash=e.hash) for e in entries],
+        next_cursor=next_cursor,
+    )
+
+
+@app.get("/files/usage")
+def files_usage(email: str = Depends(get_current_user_email)):
+    # fichiers (quota du workspace) + store des snapshots (plafond à part)
+    workspace = workspaces.get(email)
+    return {**workspace.usage(), **store_usage(workspace)}
+
+
+SEARCH_PAGE_MAX = int(os.getenv("SEARCH_PAGE_MAX", "500"))
+
+
+@app.get("/files/search", response_model=SearchResponse)
+def files_search(
+    q: str = Query(..., min_length=1),
+    regex: bool = False,
+    case_sensitive: bool = True,
+    prefix: str = "",
+    glob: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=SEARCH_PAGE_MAX),
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Recherche texte (littérale ou regex) dans les fichiers du workspace.
+    Index trigrammes : seuls les fichiers candidats sont lus.
+    Résultats (fichier, ligne, extrait) paginés par curseur.
+    """
+    workspace = workspaces.get(email)
+    try:
+        matches, next_cursor, scanned = workspace.search.search(
+            q,
+            is_regex=regex,
+            case_sensitive=case_sensitive,
+            prefix=prefix.strip().lstrip("/"),
+            accept=(lambda p: match_glob(p, glob)) if glob else None,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SearchResponse(
+        matches=[SearchMatchInfo(path=m.path, line=m.line, column=m.column, snippet=m.snippet) for m in matches],
+        next_cursor=next_cursor,
+        files_scanned=scanned,
+    )
 
 
 @app.post("/files/read", response_model=ReadFileResponse)
@@ -489,30 +841,244 @@ def files_read(
     email: str = Depends(get_current_user_email),
 ):
     try:
-        content = read_file(payload.path)
+        content = read_file(payload.path, workspaces.get(email))
         return ReadFileResponse(ok=True, path=payload.path, content=content)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/files/download")
+def files_download(
+    path: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Contenu brut du fichier, lu par blocs (pas de chargement en mémoire),
+    avec support de Range (reprise, lecture partielle des gros logs).
+    """
+    workspace = workspaces.get(email)
+    try:
+        full = safe_path(path, workspace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not full.is_file():
+        raise HTTPException(status_code=404, detail="Fichier introuvable")
+    st = full.stat()
+    size = st.st_size
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(full.name)}",
+    }
+    entry = workspace.index.get(workspace.index.rel(full))
+    if entry is not None and entry.mtime_ns == st.st_mtime_ns:
+        headers["ETag"] = f'"{entry.hash}"'
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        raise HTTPException(
+            status_code=416,
+            detail="Plage demandée invalide",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    media_type = mimetypes.guess_type(full.name)[0] or "application/octet-stream"
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(full, 0, size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file(full, start, end - start + 1),
+        status_code=206,
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+@app.get("/files/export")
+def files_export(
+    format: Literal["zip", "tar.gz"] = "zip",
+    prefix: str = "",
+    glob: Optional[str] = None,
+    snapshot_id: Optional[str] = None,
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Archive (zip ou tar.gz) du workspace, d'un sous-dossier (prefix), de
+    fichiers choisis (glob) ou de l'état d'un build (snapshot_id).
+    Construite à la volée par blocs : ni archive en mémoire ni fichier
+    temporaire, le téléchargement commence tout de suite.
+    """
+    workspace = workspaces.get(email)
+    prefix = prefix.strip().lstrip("/").replace("\\", "/")
+
+    if snapshot_id:
+        try:
+            items = [
+                (path, blob) for path, blob in snapshot_files(workspace, snapshot_id)
+                if path.startswith(prefix) and match_glob(path, glob)
+            ]
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        name = snapshot_id
+    else:
+        items = workspace_items(workspace, prefix, glob)
+        name = prefix.rstrip("/").rsplit("/", 1)[-1] or "workspace"
+
+    if not items:
+        raise HTTPException(status_code=404, detail="Aucun fichier à exporter")
+
+    filename = f"{name}.{format}"
+    return StreamingResponse(
+        iter_archive(items, format),
+        media_type="application/zip" if format == "zip" else "application/gzip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
+
+
+async def _upload(workspace: Workspace, path: str, chunks: AsyncIterator[bytes], size: Optional[int]) -> UploadFileResponse:
+    try:
+        saved, written = await receive_upload(workspace, path, chunks, size)
+    except (QuotaExceeded, UploadTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return UploadFileResponse(ok=True, path=saved, size=written)
+
+
+@app.put("/files/upload", response_model=UploadFileResponse)
+async def files_upload(
+    path: str,
+    request: Request,
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Upload du corps brut de la requête, écrit sur disque au fil de l'eau.
+    """
+    workspace = await run_in_threadpool(workspaces.get, email)
+    length = request.headers.get("content-length")
+    size = int(length) if length and length.isdigit() else None
+    return await _upload(workspace, path, request.stream(), size)
+
+
+@app.post("/files/upload", response_model=UploadFileResponse)
+async def files_upload_form(
+    file: UploadFile = File(...),
+    path: Optional[str] = Form(None),
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Variante multipart (formulaire du front) ; path par défaut = nom du fichier.
+    """
+    workspace = await run_in_threadpool(workspaces.get, email)
+
+    async def chunks() -> AsyncIterator[bytes]:
+        while True:
+            chunk = await file.read(FILES_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    return await _upload(workspace, path or file.filename or "", chunks(), file.size)
+
+
 @app.post("/files/delete", response_model=DeleteFileResponse)
 def files_delete(
     payload: DeleteFileRequest,
     email: str = Depends(get_current_user_email),
 ):
     try:
-        delete_file(payload.path)
+        delete_file(payload.path, workspaces.get(email))
         return DeleteFileResponse(ok=True, path=payload.path)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# =========================
+# 🔹 Snapshots (JWT requis)
+# =========================
+
+@app.get("/snapshots", response_model=SnapshotListResponse)
+def snapshots_list(
+    session_id: Optional[str] = None,
+    email: str = Depends(get_current_user_email),
+):
+    items = list_snapshots(workspaces.get(email), session_id)
+    return SnapshotListResponse(snapshots=[SnapshotInfo(**s) for s in items])
+
+
+@app.get("/snapshots/diff", response_model=SnapshotDiffResponse)
+def snapshots_diff(
+    a: str,
+    b: Optional[str] = None,
+    email: str = Depends(get_current_user_email),
+):
+    """
+    Fichiers ajoutés / supprimés / modifiés de a vers b (sans b : vers
+    l'état actuel du workspace).
+    """
+    try:
+        return SnapshotDiffResponse(**diff_snapshots(workspaces.get(email), a, b))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/snapshots/{snapshot_id}/restore", response_model=SnapshotRestoreResponse)
+def snapshots_restore(
+    snapshot_id: str,
+    prune: bool = True,
+    email: str = Depends(get_current_user_email),
+):
+    try:
+        result = restore_snapshot(workspaces.get(email), snapshot_id, prune=prune)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SnapshotRestoreResponse(ok=True, **result)
+
+
 # =========================
 # 🔹 /build (JWT requis) - STABLE (sans CodeAgent)
 # =========================
 
+def _parse_json_reply(raw: str) -> dict:
+    try:
+        return extract_json_block(raw)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Réponse non-JSON / invalide: {str(e)}"
+        )
+
+
+async def _snapshot(workspace: Workspace, session_id: str, summary: str) -> Optional[str]:
+    # un snapshot raté ne fait pas échouer le build (fichiers déjà écrits)
+    try:
+        snapshot = await run_in_threadpool(create_snapshot, workspace, session_id, summary)
+    except QuotaExceeded as e:
+        logger.warning("snapshot du build %s ignoré : %s", session_id, e)
+        return None
+    except Exception:
+        logger.exception("snapshot du build %s en échec", session_id)
+        return None
+    return snapshot["id"]
+
+
 @app.post("/build", response_model=BuildResponse)
-def build_code(
+async def build_code(
     request: BuildRequest,
     email: str = Depends(get_current_user_email)
 ):
@@ -520,105 +1086,352 @@ def build_code(
         raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
 
     session_id = request.session_id or str(uuid.uuid4())
+    agent = _resolve_agent(request)
+    max_tokens = _cap_max_tokens(request.max_tokens, default=900)
 
-    agent = request.agent
-    if agent == "auto":
-        agent = pick_agent(request.prompt)
+    system_prompt = build_system_prompt(request.language)
+    user_content = _build_user_content(request, agent)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, user_content)
+    messages = _chat_messages(system_prompt, turns, user_content)
 
-    DEFAULT_MAX = 900
-    HARD_MAX = 2048
-    max_tokens = min(request.max_tokens or DEFAULT_MAX, HARD_MAX)
-
-    history = get_session_history(session_id)
-
-    system_prompt = f"""
-Tu es un agent de génération de code (style Cursor/Bolt).
-
-OBJECTIF:
-Générer des fichiers complets pour un projet.
-
-RÈGLES STRICTES :
-- Réponds UNIQUEMENT en JSON valide (double quotes obligatoires)
-- Aucun texte hors JSON
-- Le JSON doit contenir exactement :
-  - "summary": string
-  - "files": liste d'objets {{"path": "...", "content": "..."}}
-- Les fichiers doivent être complets et propres.
-- Langue du résumé : {request.language}
-
-FORMAT EXACT :
-{{
-  "summary": "....",
-  "files": [
-    {{"path": "exemple.txt", "content": "contenu"}}
-  ]
-}}
-""".strip()
+    async with scheduler.slot(email, LANE_BATCH):
+        try:
+            chat, similarity = await _chat_near_cached(
+                near_scope("build", agent, request.language),
+                request.prompt,
+                messages,
+                max_tokens,
+                cache_scope="build",
+                session_id=session_id,
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
 
-    full_prompt = f"""
-{system_prompt}
+    raw = (chat.text or "").strip()
 
-Contexte utile :
-{history}
+    # extraction + réparation JSON en un passage
+    payload = _parse_json_reply(raw)
 
-Agent sélectionné: {agent}
+    summary = str(payload.get("summary", "")).strip()
+    files = payload.get("files", [])
 
-Demande :
-{request.prompt}
-""".strip()
+    if not isinstance(files, list) or len(files) == 0:
+        raise HTTPException(status_code=400, detail="Aucun fichier généré par le modèle")
+
+    workspace = await run_in_threadpool(workspaces.get, email)
+    batch = [
+        ((f.get("path") or "").strip(), f.get("content") or "")
+        for f in files
+        if isinstance(f, dict)
+    ]
 
+    # tout le lot ou rien : chemins validés d'abord, écriture atomique
     try:
-        raw = generate(prompt=full_prompt, max_tokens=max_tokens)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+        written = await run_in_threadpool(write_files, batch, workspace)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    raw = (raw or "").strip()
+    created_paths = written.written + written.unchanged
 
-    # 1) extraction JSON direct
-    try:
-        payload = extract_json_block(raw)
-    except Exception:
-        # 2) tentative de réparation JSON
+    if len(created_paths) == 0:
+        raise HTTPException(status_code=400, detail="Aucun fichier valide n'a été créé")
+
+    await run_in_threadpool(add_turns, session_id, f"USER: {request.prompt.strip()}", f"AI({agent}): BUILD {len(created_paths)} files")
+    snapshot_id = await _snapshot(workspace, session_id, summary)
+
+    return BuildResponse(
+        ok=True,
+        session_id=session_id,
+        agent=agent,
+        summary=summary,
+        files_created=created_paths,
+        files_unchanged=written.unchanged,
+        files_skipped=written.skipped,
+        snapshot_id=snapshot_id,
+        similarity=similarity,
+        **_generation_stats(chat),
+    )
+
+
+async def _sse_build(
+    messages: List[dict],
+    max_tokens: int,
+    session_id: str,
+    agent: str,
+    workspace: Workspace,
+    on_done: Callable[[List[str]], None],
+) -> AsyncIterator[str]:
+    """
+    Les tokens passent dans le parseur JSON incrémental : chaque fichier est
+    écrit dès que son objet se ferme (événement "file"), sans attendre la
+    fin de la génération. Si la réponse est coupée, les fichiers complets
+    restent écrits.
+    """
+    parser = BuildStreamParser()
+    final = ChatResult(text="")
+    created_paths: List[str] = []
+    started = time.perf_counter()
+
+    async def write(raw: str) -> str:
         try:
-            fixed = repair_json_loose(raw)
-            payload = json.loads(fixed)
+            f = extract_json_block(raw)
+            path = (f.get("path") or "").strip()
+            if not path:
+                raise ValueError("Chemin vide")
+            saved = await run_in_threadpool(write_file, path, f.get("content") or "", workspace)
         except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Réponse non-JSON / invalide: {str(e)}"
-            )
+            return sse_event({"index": parser.objects, "detail": str(e)}, event="file_error")
+        created_paths.append(saved)
+        return sse_event(
+            {
+                "index": parser.objects,
+                "path": path,
+                "saved_path": saved,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+            event="file",
+        )
+
+    error = None
+    try:
+        async for chunk in astream_chat(messages, max_tokens=max_tokens, cache_scope="build", session_id=session_id):
+            if isinstance(chunk, ChatResult):
+                final = chunk
+                continue
+            for raw in parser.feed(chunk):
+                yield await write(raw)
+    except Exception as e:
+        error = f"Ollama error: {repr(e)}"
+
+    snapshot_id = None
+    if created_paths:
+        await run_in_threadpool(on_done, created_paths)
+        snapshot_id = await _snapshot(workspace, session_id, (parser.summary or "").strip())
+
+    if error is not None and not created_paths:
+        yield sse_event({"detail": error}, event="error")
+        return
+
+    yield sse_event(
+        {
+            "session_id": session_id,
+            "agent": agent,
+            "summary": (parser.summary or "").strip(),
+            "files_created": created_paths,
+            "snapshot_id": snapshot_id,
+            **_generation_stats(final),
+            "truncated": parser.truncated or final.truncated,
+            "error": error,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+        event="done",
+    )
 
-    summary = str(payload.get("summary", "")).strip()
-    files = payload.get("files", [])
 
-    if not isinstance(files, list) or len(files) == 0:
-        raise HTTPException(status_code=400, detail="Aucun fichier généré par le modèle")
+@app.post("/build/stream")
+async def build_code_stream(
+    request: BuildRequest,
+    email: str = Depends(get_current_user_email)
+):
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
+
+    session_id = request.session_id or str(uuid.uuid4())
+    agent = _resolve_agent(request)
+    max_tokens = _cap_max_tokens(request.max_tokens, default=900)
+
+    system_prompt = build_system_prompt(request.language)
+    user_content = _build_user_content(request, agent)
+    turns = await _turns_for(session_id, max_tokens, system_prompt, user_content)
+    messages = _chat_messages(system_prompt, turns, user_content)
+
+    def on_done(created_paths: List[str]):
+        add_turns(session_id, f"USER: {request.prompt.strip()}", f"AI({agent}): BUILD {len(created_paths)} files")
+
+    workspace = await run_in_threadpool(workspaces.get, email)
+    ticket = await scheduler.acquire(email, LANE_BATCH)
+    return _sse_response(ticket, _sse_build(messages, max_tokens, session_id, agent, workspace, on_done))
+
+
+# =========================
+# 🔹 /build/pipeline (JWT requis)
+# =========================
+
+# Planification courte, puis un appel par fichier avec son propre budget
+BUILD_MAX_FILES = int(os.getenv("BUILD_MAX_FILES", "12"))
+BUILD_MAX_PARALLEL = int(os.getenv("BUILD_MAX_PARALLEL", "4"))
+BUILD_PLAN_MAX_TOKENS = int(os.getenv("BUILD_PLAN_MAX_TOKENS", "512"))
+BUILD_FILE_TIMEOUT = float(os.getenv("BUILD_FILE_TIMEOUT", "180"))
 
-    created_paths: list[str] = []
+_code_fence = re.compile(r"^```[^\n]*\n(.*?)\n?```\s*$", re.DOTALL)
 
-    for f in files:
+
+def _plan_files(payload: dict, max_files: int) -> List[Tuple[str, str]]:
+    """
+    (path, rôle) du plan, sans doublons ni entrées invalides.
+    """
+    planned: dict = {}
+    for f in payload.get("files") or []:
         if not isinstance(f, dict):
             continue
+        path = (f.get("path") or "").strip().lstrip("/")
+        if path and path not in planned:
+            planned[path] = str(f.get("role") or "").strip()
+        if len(planned) >= max_files:
+            break
+    return list(planned.items())
 
-        path = (f.get("path") or "").strip()
-        content = f.get("content") or ""
 
-        if not path:
-            continue
+def _file_user_content(request: BuildRequest, agent: str, summary: str, plan: List[Tuple[str, str]], path: str) -> str:
+    # plan identique pour tous les fichiers : seul le nom du fichier change
+    # en fin de message, le reste du préfixe est partagé dans le cache KV
+    listing = "\n".join(f"- {p} : {role}" if role else f"- {p}" for p, role in plan)
+    return f"""
+Agent sélectionné: {agent}
 
-        saved = write_file(path, content)
-        created_paths.append(saved)
+Demande :
+{request.prompt}
 
-    if len(created_paths) == 0:
-        raise HTTPException(status_code=400, detail="Aucun fichier valide n'a été créé")
+Résumé du projet :
+{summary}
 
-    add_to_session(session_id, f"USER: {request.prompt.strip()}")
-    add_to_session(session_id, f"AI({agent}): BUILD {len(created_paths)} files")
+Plan :
+{listing}
 
-    return BuildResponse(
+Fichier à écrire : {path}
+""".strip()
+
+
+def _strip_code_fence(text: str) -> str:
+    m = _code_fence.match(text.strip())
+    return m.group(1) if m else text
+
+
+async def _build_file(
+    path: str,
+    role: str,
+    messages: List[dict],
+    email: str,
+    workspace: Workspace,
+    session_id: str,
+    max_tokens: int,
+    limit: asyncio.Semaphore,
+) -> BuildFileResult:
+    async def call() -> Tuple[str, ChatResult]:
+        async with limit, scheduler.slot(email, LANE_BATCH):
+            chat = await achat(messages, max_tokens=max_tokens, cache_scope="build", session_id=session_id)
+        content = _strip_code_fence(chat.text or "")
+        if not content.strip():
+            raise ValueError("Contenu vide")
+        return content, chat
+
+    started = time.perf_counter()
+    try:
+        safe_path(path, workspace)  # chemin refusé : pas la peine de générer
+        content, chat = await asyncio.wait_for(call(), timeout=BUILD_FILE_TIMEOUT)
+        saved = await run_in_threadpool(write_file, path, content, workspace)
+    except asyncio.TimeoutError:
+        error = f"timeout après {BUILD_FILE_TIMEOUT:g}s"
+    except HTTPException as e:
+        error = str(e.detail)
+    except ValueError as e:
+        error = str(e)
+    except Exception as e:
+        error = f"Ollama error: {repr(e)}"
+    else:
+        return BuildFileResult(
+            path=path,
+            role=role,
+            saved_path=saved,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+            **_generation_stats(chat),
+        )
+
+    return BuildFileResult(
+        path=path,
+        role=role,
+        ok=False,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        error=error,
+    )
+
+
+@app.post("/build/pipeline", response_model=BuildPipelineResponse)
+async def build_pipeline(
+    request: BuildPipelineRequest,
+    email: str = Depends(get_current_user_email)
+):
+    """
+    Build en deux temps : un appel court qui planifie la liste des fichiers,
+    puis une génération par fichier en parallèle, chacune avec son budget.
+    Un fichier en échec n'empêche pas l'écriture des autres.
+    """
+    if not request.prompt or not request.prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt vide non autorisé")
+
+    session_id = request.session_id or str(uuid.uuid4())
+    agent = _resolve_agent(request)
+    max_files = min(request.max_files or BUILD_MAX_FILES, BUILD_MAX_FILES)
+    file_max_tokens = _cap_max_tokens(request.file_max_tokens, default=1024)
+
+    started = time.perf_counter()
+
+    # 1) plan
+    system_prompt = plan_system_prompt(request.language)
+    user_content = _build_user_content(request, agent)
+    turns = await _turns_for(session_id, BUILD_PLAN_MAX_TOKENS, system_prompt, user_content)
+    messages = _chat_messages(system_prompt, turns, user_content)
+
+    async with scheduler.slot(email, LANE_BATCH):
+        try:
+            chat = await achat(messages, max_tokens=BUILD_PLAN_MAX_TOKENS, cache_scope="build", session_id=session_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {repr(e)}")
+
+    payload = _parse_json_reply((chat.text or "").strip())
+    summary = str(payload.get("summary", "")).strip()
+    plan = _plan_files(payload, max_files)
+
+    if not plan:
+        raise HTTPException(status_code=400, detail="Aucun fichier planifié par le modèle")
+
+    plan_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    # 2) un fichier par appel, en parallèle borné
+    system_prompt = file_system_prompt(request.language)
+    limit = asyncio.Semaphore(max(1, BUILD_MAX_PARALLEL))
+    workspace = await run_in_threadpool(workspaces.get, email)
+    results = await asyncio.gather(*(
+        _build_file(
+            path,
+            role,
+            _chat_messages(system_prompt, [], _file_user_content(request, agent, summary, plan, path)),
+            email,
+            workspace,
+            session_id,
+            file_max_tokens,
+            limit,
+        )
+        for path, role in plan
+    ))
+
+    created_paths = [r.saved_path for r in results if r.ok]
+    if not created_paths:
+        raise HTTPException(status_code=500, detail="Aucun fichier n'a pu être généré")
+
+    await run_in_threadpool(add_turns, session_id, f"USER: {request.prompt.strip()}", f"AI({agent}): BUILD {len(created_paths)} files")
+
+    return BuildPipelineResponse(
         ok=True,
         session_id=session_id,
         agent=agent,
         summary=summary,
-        files_created=created_paths
+        files_created=created_paths,
+        files=results,
+        partial=len(created_paths) < len(results),
+        snapshot_id=await _snapshot(workspace, session_id, summary),
+        plan_ms=plan_ms,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
     )
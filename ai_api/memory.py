@@ -1,30 +1,131 @@
 # ai_api/memory.py
+import os
+import re
+import threading
 import uuid
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-_sessions: Dict[str, List[str]] = {}
+from ai_api.session_store import SessionStore, MemorySessionStore, SqliteSessionStore
+from ai_api.tokens import (
+    OLLAMA_NUM_CTX,
+    HISTORY_MAX_MESSAGE_TOKENS,
+    count_tokens,
+    truncate_head_tail,
+)
+
+# "sqlite" (durable, multi-workers) ou "memory" (un seul worker)
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+
+# En dessous, un message tronqué n'apporte plus rien au contexte
+MIN_TRUNCATED_MESSAGE_TOKENS = 32
+
+_turn_prefix = re.compile(r"^(USER|AI)(?:\([^)]*\))?: ?")
+
+
+# Fonctions bloquantes (SQLite) : depuis un endpoint async, les appeler
+# via run_in_threadpool pour ne pas bloquer la boucle d'événements.
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def _make_store() -> SessionStore:
+    if SESSION_STORE == "memory":
+        return MemorySessionStore()
+    return SqliteSessionStore(SESSION_DB)
+
+
+def get_store() -> SessionStore:
+    # créé au premier usage (pas de sessions.db créée à l'import)
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _make_store()
+    return _store
 
 
 def create_session() -> str:
     session_id = str(uuid.uuid4())
-    _sessions[session_id] = []
+    get_store().create(session_id)
     return session_id
 
 
 def list_sessions() -> List[str]:
-    return list(_sessions.keys())
+    return get_store().list_ids()
 
 
 def add_to_session(session_id: str, text: str):
-    if session_id not in _sessions:
-        _sessions[session_id] = []
-    _sessions[session_id].append(text)
+    get_store().append(session_id, text)
+
+
+def add_turns(session_id: str, *texts: str):
+    # plusieurs messages d'un coup : un seul passage par le threadpool
+    store = get_store()
+    for text in texts:
+        store.append(session_id, text)
 
 
 def get_session_messages(session_id: str) -> List[str]:
-    return _sessions.get(session_id, [])
+    return get_store().messages(session_id)
+
+
+def _pack_messages(session_id: str, budget_tokens: Optional[int]) -> List[str]:
+    """
+    Les messages les plus récents qui tiennent dans budget_tokens
+    (voir tokens.context_budget), dans l'ordre chronologique.
+    Un message trop long est tronqué tête + queue au lieu d'évincer le reste.
+    """
+    if budget_tokens is None:
+        budget_tokens = OLLAMA_NUM_CTX // 2
+
+    packed: List[str] = []
+    used = 0
+
+    for text, tokens in reversed(get_store().entries(session_id)):
+        if tokens is None:
+            tokens = count_tokens(text)
+
+        remaining = budget_tokens - used - 1  # saut de ligne
+        cap = min(HISTORY_MAX_MESSAGE_TOKENS, remaining)
+        if tokens > cap:
+            if cap < MIN_TRUNCATED_MESSAGE_TOKENS:
+                break
+            text = truncate_head_tail(text, cap, tokens)
+            tokens = count_tokens(text)
+            if tokens > remaining:
+                break
+
+        packed.append(text)
+        used += tokens + 1
+
+    packed.reverse()
+    return packed
+
+
+def get_session_history(session_id: str, budget_tokens: Optional[int] = None) -> str:
+    return "\n".join(_pack_messages(session_id, budget_tokens))
+
+
+def get_session_turns(session_id: str, budget_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Même historique que get_session_history, sous forme de messages de chat
+    ("USER: ..." -> user, "AI(...): ..." -> assistant).
+    """
+    turns = []
+    for text in _pack_messages(session_id, budget_tokens):
+        m = _turn_prefix.match(text)
+        if m and m.group(1) == "AI":
+            turns.append({"role": "assistant", "content": text[m.end():]})
+        elif m:
+            turns.append({"role": "user", "content": text[m.end():]})
+        else:
+            turns.append({"role": "user", "content": text})
+    return turns
 
 
-def get_session_history(session_id: str) -> str:
-    msgs = _sessions.get(session_id, [])
-    return "\n".join(msgs[-20:])
+def session_store_stats() -> dict:
+    if _store is None:
+        return {"backend": SESSION_STORE, "loaded": False}
+    return _store.stats()
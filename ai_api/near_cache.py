@@ -0,0 +1,198 @@
+# ai_api/near_cache.py
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+# Cache approximatif désactivé par défaut (opt-in)
+NEAR_CACHE_ENABLED = os.getenv("NEAR_CACHE_ENABLED", "0") == "1"
+
+# Similarité (Jaccard sur shingles de caractères) minimale pour servir un hit
+NEAR_CACHE_THRESHOLD = float(os.getenv("NEAR_CACHE_THRESHOLD", "0.8"))
+
+NEAR_CACHE_MAX_ENTRIES = int(os.getenv("NEAR_CACHE_MAX_ENTRIES", "200000"))
+NEAR_CACHE_TTL = int(os.getenv("NEAR_CACHE_TTL", "86400"))
+
+# MinHash : NUM_PERM = BANDS * ROWS
+NEAR_CACHE_BANDS = int(os.getenv("NEAR_CACHE_BANDS", "16"))
+NEAR_CACHE_ROWS = int(os.getenv("NEAR_CACHE_ROWS", "4"))
+
+SHINGLE_SIZE = 4
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_non_word = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Minuscules, accents retirés, ponctuation et espaces multiples réduits.
+    """
+    text = unicodedata.normalize("NFKD", prompt or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _non_word.sub(" ", text.lower()).strip()
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> Set[str]:
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def _hash32(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class _Entry:
+    __slots__ = ("scope", "shingles", "bands", "value", "expires_at")
+
+    def __init__(self, scope: str, shingles: Set[str], bands: List[int], value: str, expires_at: float):
+        self.scope = scope
+        self.shingles = shingles
+        self.bands = bands
+        self.value = value
+        self.expires_at = expires_at
+
+
+class NearDuplicateCache:
+    """
+    Cache approximatif des réponses : les prompts normalisés sont signés par
+    MinHash et rangés dans des buckets LSH (une clé par bande). Une recherche
+    ne compare que les entrées qui partagent au moins une bande, puis vérifie
+    la similarité exacte (Jaccard) avant de servir la réponse.
+    """
+
+    def __init__(
+        self,
+        threshold: float = NEAR_CACHE_THRESHOLD,
+        max_entries: int = NEAR_CACHE_MAX_ENTRIES,
+        ttl: int = NEAR_CACHE_TTL,
+        bands: int = NEAR_CACHE_BANDS,
+        rows: int = NEAR_CACHE_ROWS,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = rows
+
+        rnd = random.Random(1337)  # permutations stables entre redémarrages
+        num_perm = bands * rows
+        self._perms = [
+            (rnd.randrange(1, _MERSENNE_PRIME), rnd.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = {}
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _band_keys(self, sh: Set[str]) -> List[int]:
+        hashes = [_hash32(s) for s in sh]
+        signature = []
+        for a, b in self._perms:
+            signature.append(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes))
+
+        keys = []
+        for i in range(self.bands):
+            band = tuple(signature[i * self.rows:(i + 1) * self.rows])
+            keys.append(hash(band))
+        return keys
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for i, k in enumerate(entry.bands):
+            bucket = self._buckets.get((entry.scope, i, k))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(entry.scope, i, k)]
+
+    def lookup(self, scope: str, prompt: str) -> Optional[Tuple[str, float]]:
+        """
+        Retourne (réponse, similarité) si un prompt assez proche est en cache.
+        """
+        sh = shingles(normalize_prompt(prompt))
+        if not sh:
+            return None
+        keys = self._band_keys(sh)
+        now = time.time()
+
+        with self._lock:
+            candidates: Set[int] = set()
+            for i, k in enumerate(keys):
+                candidates |= self._buckets.get((scope, i, k), set())
+
+            best_id, best_sim = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if entry.expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                sim = jaccard(sh, entry.shingles)
+                if sim > best_sim:
+                    best_id, best_sim = entry_id, sim
+
+            if best_id is None or best_sim < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].value, round(best_sim, 4)
+
+    def add(self, scope: str, prompt: str, value: str):
+        sh = shingles(normalize_prompt(prompt))
+        if not sh or not value:
+            return
+        keys = self._band_keys(sh)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(scope, sh, keys, value, time.time() + self.ttl)
+            for i, k in enumerate(keys):
+                self._buckets.setdefault((scope, i, k), set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": NEAR_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+        }
+
+
+def near_scope(endpoint: str, agent: str, language: str) -> str:
+    return f"{endpoint}:{agent}:{normalize_prompt(language)}"
+
+
+near_cache = NearDuplicateCache()
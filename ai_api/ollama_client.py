@@ -1,22 +1,369 @@
 # ai_api/ollama_client.py
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+import httpx
 import requests
 
-OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
-MODEL = "deepseek-coder"
+from ai_api.backends import pool
+from ai_api.providers.base import GenerationResult
+from ai_api.response_cache import response_cache, cache_enabled_for
+from ai_api.singleflight import SingleFlight
+from ai_api.tokens import OLLAMA_NUM_CTX, count_tokens
+
+# Chemins de l'API Ollama (les instances sont dans backends.OLLAMA_URLS)
+GENERATE_PATH = "/api/generate"
+CHAT_PATH = "/api/chat"
+
+MODEL = os.getenv("OLLAMA_MODEL", "deepseek-coder")
+
+# Garde le modèle (et son cache KV) chargé entre deux requêtes
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Surcoût approximatif du gabarit de chat par message (rôle, séparateurs)
+CHAT_TEMPLATE_TOKENS_PER_MESSAGE = 4
+
+# Timeouts (secondes) : connexion courte, lecture longue (génération lente)
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "900"))
+OLLAMA_POOL_TIMEOUT = float(os.getenv("OLLAMA_POOL_TIMEOUT", "60"))
+
+# Pool keep-alive borné (client async)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))
 
 _session = requests.Session()
 _session.trust_env = False  # ignore HTTP_PROXY / HTTPS_PROXY
 
-def generate(prompt: str, max_tokens: int = 512) -> str:
-    payload = {
+_async_client: Optional[httpx.AsyncClient] = None
+
+# Appels identiques en vol (même prompt final, modèle, options) partagés
+flights = SingleFlight()
+
+# Réutilisation du préfixe (cache KV Ollama) cumulée
+prefix_stats = {"requests": 0, "reused_tokens": 0, "saved_ms": 0.0}
+
+
+# Compteurs conservés avec le texte dans le cache de réponses
+_CACHED_STATS = ("done_reason", "prompt_eval_count", "eval_count")
+
+
+@dataclass
+class ChatResult(GenerationResult):
+    prompt_tokens: int = 0          # estimation du prompt complet
+    prefill_saved_ms: float = 0.0   # temps de prefill évité grâce au préfixe en cache
+    cached: bool = False            # servi par le cache de réponses
+
+
+def _options(max_tokens: int) -> dict:
+    return {"num_predict": max_tokens, "num_ctx": OLLAMA_NUM_CTX}
+
+
+def _payload(prompt: str, max_tokens: int, stream: bool = False) -> dict:
+    return {
         "model": MODEL,
         "prompt": prompt,
-        "stream": False,
-        "options": {"num_predict": max_tokens},
+        "stream": stream,
+        "options": _options(max_tokens),
     }
 
-    r = _session.post(OLLAMA_URL, json=payload, timeout=900)
+
+def _chat_payload(messages: List[Dict[str, str]], max_tokens: int, stream: bool = False) -> dict:
+    return {
+        "model": MODEL,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": _options(max_tokens),
+    }
+
+
+def request_key(payload: dict) -> str:
+    """
+    Clé stable d'une requête de génération : modèle + prompt + options
+    (le mode stream n'en fait pas partie, le résultat est le même).
+    """
+    ident = {k: v for k, v in payload.items() if k not in ("stream", "keep_alive")}
+    raw = json.dumps(ident, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_key(payload: dict) -> str:
+    """
+    Clé du cache de réponses : modèle + hash du prompt final + options.
+    """
+    if "messages" in payload:
+        prompt = json.dumps(payload["messages"], ensure_ascii=False)
+    else:
+        prompt = payload["prompt"]
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    options = json.dumps(payload.get("options") or {}, sort_keys=True)
+    # v2 : valeur = JSON {"text", done_reason, compteurs}
+    return f"v2:{payload['model']}:{prompt_hash}:{options}"
+
+
+async def _cache_get(payload: dict) -> Optional[dict]:
+    value = await response_cache.aget(cache_key(payload))
+    if value is None:
+        return None
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return None
+    return dict(data, cached=True)
+
+
+async def _cache_set(payload: dict, data: dict):
+    entry = {"text": data["text"]}
+    entry.update({k: data[k] for k in _CACHED_STATS if data.get(k) is not None})
+    await response_cache.aset(cache_key(payload), json.dumps(entry, ensure_ascii=False))
+
+
+def _text_of(data: dict) -> str:
+    if "message" in data:
+        return (data.get("message") or {}).get("content") or ""
+    return data.get("response") or ""
+
+
+# =========================
+# 🔹 Client sync (code_agent, scripts)
+# =========================
+
+def generate(prompt: str, max_tokens: int = 512) -> str:
+    backend = pool.pick_sync()
+    try:
+        r = _session.post(
+            backend.url + GENERATE_PATH,
+            json=_payload(prompt, max_tokens),
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+        )
+    except requests.ConnectionError as e:
+        pool.mark_failed(backend, e)
+        raise
     r.raise_for_status()
     data = r.json()
     return (data.get("response") or "").strip()
 
+
+# =========================
+# 🔹 Client async (endpoints FastAPI)
+# =========================
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Client httpx partagé : les connexions vers Ollama sont réutilisées
+    (keep-alive) et leur nombre est borné par OLLAMA_MAX_CONNECTIONS.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                connect=OLLAMA_CONNECT_TIMEOUT,
+                read=OLLAMA_READ_TIMEOUT,
+                write=OLLAMA_CONNECT_TIMEOUT,
+                pool=OLLAMA_POOL_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+            ),
+            trust_env=False,
+        )
+    return _async_client
+
+
+async def achat(
+    messages: List[Dict[str, str]],
+    max_tokens: int = 512,
+    cache_scope: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> ChatResult:
+    """
+    Génération via /api/chat. Les messages commencent par un prompt système
+    identique octet pour octet d'un appel à l'autre (par agent et langue),
+    suivi des tours de la session : Ollama réutilise alors le cache KV du
+    préfixe commun au lieu de le ré-évaluer.
+    """
+    data = await _complete(CHAT_PATH, _chat_payload(messages, max_tokens), cache_scope, session_id)
+    return _chat_result(messages, data["text"], data)
+
+
+async def astream_chat(
+    messages: List[Dict[str, str]],
+    max_tokens: int = 512,
+    cache_scope: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> AsyncIterator[Union[str, ChatResult]]:
+    """
+    Morceaux de texte au fil de l'eau, puis en dernier un ChatResult
+    (texte complet, done_reason, compteurs et durées d'Ollama).
+    """
+    payload = _chat_payload(messages, max_tokens, stream=True)
+    parts: list[str] = []
+    stats: dict = {}
+    async for chunk in _stream(CHAT_PATH, payload, cache_scope, session_id):
+        if isinstance(chunk, str):
+            parts.append(chunk)
+            yield chunk
+        else:
+            stats = chunk
+    yield _chat_result(messages, "".join(parts).strip(), stats)
+
+
+def _chat_result(messages: List[Dict[str, str]], text: str, data: dict) -> ChatResult:
+    result = ChatResult(text=text, **GenerationResult.stats_from_ollama(data))
+    if data.get("cached"):
+        result.cached = True
+        return result
+    result.prompt_tokens = estimate_chat_tokens(messages)
+    result.prefill_saved_ms = _record_prefix_reuse(result)
+    return result
+
+
+def estimate_chat_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(m.get("content") or "") + CHAT_TEMPLATE_TOKENS_PER_MESSAGE for m in messages)
+
+
+def _record_prefix_reuse(result: ChatResult) -> float:
+    """
+    Tokens du prompt non ré-évalués (préfixe en cache) et temps de prefill
+    correspondant, au débit de prefill mesuré sur la requête.
+    """
+    if result.prompt_eval_count <= 0:
+        return 0.0
+    reused = max(0, result.prompt_tokens - result.prompt_eval_count)
+    ms_per_token = result.prompt_eval_ms / result.prompt_eval_count
+    saved_ms = round(reused * ms_per_token, 2)
+
+    prefix_stats["requests"] += 1
+    prefix_stats["reused_tokens"] += reused
+    prefix_stats["saved_ms"] = round(prefix_stats["saved_ms"] + saved_ms, 2)
+    return saved_ms
+
+
+async def _complete(
+    path: str,
+    payload: dict,
+    cache_scope: Optional[str],
+    session_id: Optional[str] = None,
+) -> dict:
+    """
+    Appel non-streaming commun : cache de réponses, puis coalescence des
+    appels identiques en vol. Retourne la réponse Ollama avec "text".
+    """
+    use_cache = cache_enabled_for(cache_scope)
+
+    if use_cache:
+        cached = await _cache_get(payload)
+        if cached is not None:
+            return cached
+
+    key = request_key(payload)
+
+    # un stream identique est déjà en cours : on s'y rattache
+    if flights.is_streaming(key):
+        parts: list[str] = []
+        data = {}
+        async for chunk in flights.stream(key, lambda: _astream_raw(path, payload, session_id)):
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            else:
+                data = dict(chunk)
+        data["text"] = "".join(parts).strip()
+    else:
+        data = await flights.do(key, lambda: _apost_raw(path, payload, session_id))
+
+    if use_cache:
+        await _cache_set(payload, data)
+    return data
+
+
+async def _stream(
+    path: str,
+    payload: dict,
+    cache_scope: Optional[str],
+    session_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Morceaux de texte, puis un dict avec les statistiques finales d'Ollama.
+    """
+    use_cache = cache_enabled_for(cache_scope)
+
+    if use_cache:
+        cached = await _cache_get(payload)
+        if cached is not None:
+            yield cached.pop("text")
+            yield cached
+            return
+
+    parts: list[str] = []
+    stats: dict = {}
+    key = request_key(payload)
+    async for chunk in flights.stream(key, lambda: _astream_raw(path, payload, session_id)):
+        if isinstance(chunk, str):
+            parts.append(chunk)
+        else:
+            stats = chunk
+        yield chunk
+
+    if use_cache:
+        await _cache_set(payload, dict(stats, text="".join(parts).strip()))
+
+
+async def _apost_raw(path: str, payload: dict, session_id: Optional[str] = None) -> dict:
+    client = get_async_client()
+
+    # instance injoignable : elle sort de la rotation, on réessaie ailleurs
+    for attempt in range(len(pool.backends)):
+        try:
+            async with pool.lease(session_id) as backend:
+                r = await client.post(backend.url + path, json=dict(payload, stream=False))
+                r.raise_for_status()
+                break
+        except httpx.ConnectError:
+            if attempt == len(pool.backends) - 1:
+                raise
+
+    data = r.json()
+    data["text"] = _text_of(data).strip()
+    return data
+
+
+async def _astream_raw(path: str, payload: dict, session_id: Optional[str] = None) -> AsyncIterator[Union[str, dict]]:
+    """
+    Lit le flux NDJSON d'Ollama (une ligne JSON par chunk). Le dernier
+    message (done) est renvoyé tel quel, sans le texte : il porte
+    done_reason, les compteurs et les durées.
+    """
+    payload = dict(payload, stream=True)
+    client = get_async_client()
+    async with pool.lease(session_id) as backend:
+        async with client.stream("POST", backend.url + path, json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+
+                chunk = _text_of(data)
+                if chunk:
+                    yield chunk
+
+                if data.get("done") is True:
+                    yield {k: v for k, v in data.items() if k not in ("message", "response")}
+                    break
+
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,262 @@
+# ai_api/output_cleaner.py
+import re
+from typing import List, Optional
+
+# Lignes de politesse / méta en tête de réponse (comparées au début de ligne)
+BAD_PREFIXES = (
+    "bonjour",
+    "salut",
+    "hello",
+    "coucou",
+    "bonsoir",
+    "je suis",
+    "en tant qu",
+    "avec plaisir",
+    "bien sûr",
+    "bien sur",
+    "d'accord",
+    "ok",
+    "certainement",
+    "bienvenue",
+    "que voulez-vous",
+    "que veux-tu",
+    "comment puis-je",
+    "comment je peux",
+    "je peux",
+    "laissez-moi",
+    "laisse-moi",
+    "agent:",
+    "ai:",
+    "assistant:",
+)
+
+# Phrases de fin : la réponse est coupée à la première occurrence de la
+# première phrase de la liste présente dans le texte (ordre = priorité)
+ENDINGS_TO_REMOVE = (
+    "que voulez-vous que je réponde",
+    "que veux-tu que je réponde",
+    "voulez-vous que je continue",
+    "souhaitez-vous que je continue",
+    "comment puis-je vous aider",
+    "comment je peux t'aider",
+)
+
+# Automates précompilés (alternatives littérales) au lieu de boucles sur les listes
+_PREFIX_RE = re.compile("|".join(re.escape(p) for p in BAD_PREFIXES))
+_ENDING_RE = re.compile("|".join(re.escape(e) for e in ENDINGS_TO_REMOVE))
+_ENDING_RANK = {e: i for i, e in enumerate(ENDINGS_TO_REMOVE)}
+_ENDING_MAXLEN = max(len(e) for e in ENDINGS_TO_REMOVE)
+
+# Débuts de préfixe : tant que la ligne en est un, on ne peut pas encore décider
+_PREFIX_STEMS = {p[:i] for p in BAD_PREFIXES for i in range(1, len(p))}
+
+# Séparateurs reconnus par str.splitlines()
+_LINE_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+def _lower(text: str) -> str:
+    # minuscules caractère pour caractère (positions alignées sur le texte)
+    low = text.lower()
+    if len(low) == len(text):
+        return low
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+class StreamCleaner:
+    """
+    Nettoyage incrémental d'une réponse du modèle, morceau par morceau :
+    - lignes vides supprimées, blancs en début/fin de ligne retirés
+    - lignes de tête de type salutation / "Assistant:" supprimées
+    - texte coupé à la phrase de fin ("Souhaitez-vous que je continue ?")
+
+    feed() retourne ce qui peut déjà être envoyé ; seuls sont retenus le
+    début de ligne encore ambigu (préfixe), les derniers caractères qui
+    pourraient commencer une phrase de fin, et les blancs en fin de texte.
+    finish() retourne le reste. Si tout a été supprimé, c'est le texte
+    d'origine (strippé) qui est retourné, comme clean_output.
+    """
+
+    def __init__(self):
+        self._raw: Optional[List[str]] = []  # gardé tant que rien n'est émis (repli)
+        self._emitted = False
+
+        # découpage en lignes
+        self._line_started = False
+        self._ws = ""
+
+        # préfixes : tant qu'aucune ligne n'a été gardée
+        self._in_prefix = True
+        self._line = ""
+        self._dropping = False
+
+        # phrases de fin, en positions absolues dans le texte nettoyé
+        self._pending: List[str] = []
+        self._buf = ""
+        self._low = ""
+        self._buf_start = 0
+        self._searched = 0
+        self._cut_at: Optional[int] = None
+        self._rank: Optional[int] = None
+        self._final = False
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return ""
+        if self._raw is not None:
+            self._raw.append(chunk)
+
+        parts = chunk.splitlines()
+        if chunk[-1] in _LINE_BREAKS:
+            parts.append("")  # morceau terminé par un saut de ligne
+        last = len(parts) - 1
+        i = 0
+        while i <= last:
+            if i:
+                self._end_line()
+            if parts[i]:
+                self._line_text(parts[i])
+            i += 1
+            if not self._in_prefix and i < last:
+                # lignes complètes au milieu du morceau : traitées en bloc
+                self._end_line()
+                lines = [line for line in (p.strip() for p in parts[i:last]) if line]
+                if lines:
+                    self._cleaned("\n" + "\n".join(lines))
+                i = last
+        return self._flush()
+
+    def finish(self) -> str:
+        if self._in_prefix and self._line and not self._dropping:
+            self._promote()
+        self._scan()
+
+        limit = self._buf_start + len(self._buf) if self._cut_at is None else self._cut_at
+        rest = self._buf[:max(0, limit - self._buf_start)].rstrip()
+        self._buf = self._low = ""
+
+        if not self._emitted:
+            rest = rest.lstrip()
+            if not rest:
+                return "".join(self._raw or []).strip()
+        self._emitted = self._emitted or bool(rest)
+        self._raw = None
+        return rest
+
+    # -------------------------
+    # Lignes
+    # -------------------------
+
+    def _line_text(self, part: str):
+        if not self._line_started:
+            part = part.lstrip()
+            if not part:
+                return
+            self._line_started = True
+            self._start_line()
+            body = part
+        else:
+            body = self._ws + part
+
+        content = body.rstrip()
+        self._ws = body[len(content):]
+        if content:
+            self._line_content(content)
+
+    def _start_line(self):
+        if self._in_prefix:
+            self._line = ""
+            self._dropping = False
+        else:
+            self._cleaned("\n")
+
+    def _end_line(self):
+        self._line_started = False
+        self._ws = ""
+        if self._in_prefix and self._line and not self._dropping:
+            # ligne terminée sans préfixe interdit complet : on la garde
+            self._promote()
+
+    def _line_content(self, text: str):
+        if not self._in_prefix:
+            self._cleaned(text)
+            return
+        if self._dropping:
+            return
+
+        self._line += text
+        low = _lower(self._line)
+        if _PREFIX_RE.match(low):
+            self._dropping = True
+            self._line = ""
+        elif low not in _PREFIX_STEMS:
+            self._promote()
+
+    def _promote(self):
+        self._in_prefix = False
+        line, self._line = self._line, ""
+        self._cleaned(line)
+
+    # -------------------------
+    # Phrases de fin
+    # -------------------------
+
+    def _cleaned(self, text: str):
+        if not self._final:
+            self._pending.append(text)
+
+    def _scan(self):
+        # un seul passage de l'automate sur ce qui est arrivé depuis le dernier appel
+        if not self._pending:
+            return
+        added = "".join(self._pending)
+        self._pending = []
+        self._buf += added
+        self._low += _lower(added)
+
+        last_end = self._searched
+        for m in _ENDING_RE.finditer(self._low, self._searched - self._buf_start):
+            rank = _ENDING_RANK[m.group()]
+            start = self._buf_start + m.start()
+            last_end = self._buf_start + m.end()
+            if self._cut_at is None or rank < self._rank:
+                self._cut_at, self._rank = start, rank
+                if rank == 0:
+                    # priorité maximale : la suite ne peut plus rien changer
+                    self._final = True
+                    self._searched = start
+                    keep = start - self._buf_start
+                    self._buf = self._buf[:keep]
+                    self._low = self._low[:keep]
+                    return
+
+        end = self._buf_start + len(self._buf)
+        self._searched = max(last_end, end - (_ENDING_MAXLEN - 1))
+
+    def _flush(self) -> str:
+        self._scan()
+        limit = self._searched if self._cut_at is None else min(self._cut_at, self._searched)
+        n = limit - self._buf_start
+        if n <= 0:
+            return ""
+        # les blancs restent en attente : ils peuvent finir le texte
+        piece = self._buf[:n].rstrip()
+        if not piece:
+            return ""
+        k = len(piece)
+        self._buf = self._buf[k:]
+        self._low = self._low[k:]
+        self._buf_start += k
+        self._emitted = True
+        self._raw = None
+        return piece
+
+
+def clean_output(text: str) -> str:
+    if not text:
+        return text
+    cleaner = StreamCleaner()
+    return cleaner.feed(text) + cleaner.finish()
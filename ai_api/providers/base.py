@@ -1,7 +1,56 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class GenerationResult:
+    """
+    Résultat d'une génération avec les compteurs renvoyés par le modèle
+    (Ollama : prompt_eval_count, eval_count, done_reason, *_duration en ns).
+    """
+    text: str
+    prompt_eval_count: int = 0      # tokens du prompt réellement évalués
+    eval_count: int = 0             # tokens générés
+    done_reason: Optional[str] = None  # "stop", "length" (num_predict atteint)...
+    total_ms: float = 0.0
+    load_ms: float = 0.0
+    prompt_eval_ms: float = 0.0
+    eval_ms: float = 0.0
+
+    @property
+    def truncated(self) -> bool:
+        return self.done_reason == "length"
+
+    @property
+    def tokens_per_second(self) -> float:
+        if self.eval_count <= 0 or self.eval_ms <= 0:
+            return 0.0
+        return round(self.eval_count / (self.eval_ms / 1000), 2)
+
+    @staticmethod
+    def stats_from_ollama(data: dict) -> dict:
+        """
+        Champs de GenerationResult à partir d'une réponse (ou du dernier
+        message d'un stream) Ollama.
+        """
+        return {
+            "prompt_eval_count": int(data.get("prompt_eval_count") or 0),
+            "eval_count": int(data.get("eval_count") or 0),
+            "done_reason": data.get("done_reason"),
+            "total_ms": (data.get("total_duration") or 0) / 1e6,
+            "load_ms": (data.get("load_duration") or 0) / 1e6,
+            "prompt_eval_ms": (data.get("prompt_eval_duration") or 0) / 1e6,
+            "eval_ms": (data.get("eval_duration") or 0) / 1e6,
+        }
+
 
 class BaseLLMProvider(ABC):
 
     @abstractmethod
     def generate(self, prompt: str, max_tokens: int) -> str:
         pass
+
+    @abstractmethod
+    def generate_result(self, prompt: str, max_tokens: int) -> GenerationResult:
+        pass
@@ -1,14 +1,21 @@
 import requests
 from typing import Iterator
-from .base import BaseLLMProvider
+from .base import BaseLLMProvider, GenerationResult
+from ai_api.backends import pool
 
 
 class OllamaProvider(BaseLLMProvider):
     def __init__(self, model: str = "qwen2.5:3b"):
         self.model = model
-        self.endpoint = "http://localhost:11434/api/generate"
+
+    @property
+    def endpoint(self) -> str:
+        return pool.pick_sync().url + "/api/generate"
 
     def generate(self, prompt: str, max_tokens: int = 512) -> str:
+        return self.generate_result(prompt, max_tokens).text
+
+    def generate_result(self, prompt: str, max_tokens: int = 512) -> GenerationResult:
         response = requests.post(
             self.endpoint,
             json={
@@ -22,7 +29,11 @@ class OllamaProvider(BaseLLMProvider):
             timeout=300
         )
         response.raise_for_status()
-        return response.json().get("response", "").strip()
+        data = response.json()
+        return GenerationResult(
+            text=(data.get("response") or "").strip(),
+            **GenerationResult.stats_from_ollama(data),
+        )
 
     def generate_stream(self, prompt: str, max_tokens: int = 512) -> Iterator[str]:
         response = requests.post(
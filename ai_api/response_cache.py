@@ -0,0 +1,295 @@
+# ai_api/response_cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+# Durée de vie d'une réponse en cache (secondes)
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+
+# Limites mémoire (tier LRU) et disque (tier SQLite)
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+LLM_CACHE_MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+LLM_CACHE_DISK_MAX_BYTES = int(os.getenv("LLM_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Fichier SQLite du tier persistant (vide = mémoire seulement)
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.db")
+
+# Dates de lecture écrites en lot (pas un commit par hit disque)
+LLM_CACHE_TOUCH_BATCH = int(os.getenv("LLM_CACHE_TOUCH_BATCH", "64"))
+
+# Endpoints qui utilisent le cache (opt-in)
+LLM_CACHE_ENDPOINTS = {
+    e.strip() for e in os.getenv("LLM_CACHE_ENDPOINTS", "orchestrate,build").split(",") if e.strip()
+}
+
+
+class ResponseCache:
+    """
+    Cache exact des réponses LLM : tier mémoire LRU + TTL borné en octets,
+    et tier SQLite optionnel qui survit aux redémarrages.
+
+    La base SQLite est ouverte au premier accès disque (ou par open() au
+    démarrage), pas à l'import. Depuis du code async, utiliser aget / aset :
+    le tier mémoire est lu sur place, le tier disque dans le threadpool.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = LLM_CACHE_DB,
+        ttl: int = LLM_CACHE_TTL,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        max_entry_bytes: int = LLM_CACHE_MAX_ENTRY_BYTES,
+        disk_max_bytes: int = LLM_CACHE_DISK_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._mem_bytes = 0
+
+        self.db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._opened = False
+        self._disk_bytes = 0
+        self._touched: Dict[str, float] = {}  # key -> last_access pas encore écrit
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    # -------------------------
+    # Tier disque
+    # -------------------------
+
+    def open(self, db_path: Optional[str] = None):
+        """
+        Ouvre le tier disque (db_path remplace le chemin configuré ;
+        vide = mémoire seulement). Appelé au démarrage, sinon au premier accès.
+        """
+        with self._lock:
+            if db_path is not None:
+                self.db_path = db_path
+            if self._opened:
+                return
+            self._opened = True
+            if self.db_path:
+                self._open_db(self.db_path)
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        # à appeler sous self._lock
+        if not self._opened:
+            self._opened = True
+            if self.db_path:
+                self._open_db(self.db_path)
+        return self._db
+
+    def _open_db(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_access ON llm_cache(last_access)")
+        self._db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+        self._db.commit()
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        self._disk_bytes = int(row[0])
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        row = self._db.execute(
+            "SELECT value, expires_at, size FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, size = row
+        if expires_at < now:
+            self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._db.commit()
+            self._disk_bytes -= size
+            return None
+        self._touched[key] = now
+        if len(self._touched) >= LLM_CACHE_TOUCH_BATCH:
+            self._flush_touched()
+            self._db.commit()
+        return expires_at, value
+
+    def _flush_touched(self):
+        # dates de lecture en attente, écrites dans la transaction en cours
+        if self._touched:
+            self._db.executemany(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _disk_set(self, key: str, value: str, size: int, expires_at: float, now: float):
+        # l'éviction s'appuie sur last_access : les lectures en attente d'abord
+        self._flush_touched()
+        old = self._db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self._disk_bytes -= old[0]
+        self._db.execute(
+            "INSERT OR REPLACE INTO llm_cache(key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, value, size, expires_at, now),
+        )
+        self._disk_bytes += size
+
+        # éviction des entrées les moins récemment lues
+        while self._disk_bytes > self.disk_max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for k, s in rows:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (k,))
+                self._disk_bytes -= s
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+        self._db.commit()
+
+    # -------------------------
+    # Tier mémoire
+    # -------------------------
+
+    def _mem_put(self, key: str, expires_at: float, value: str, size: int):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= old[2]
+        self._mem[key] = (expires_at, value, size)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_bytes and self._mem:
+            _, (_, _, s) = self._mem.popitem(last=False)
+            self._mem_bytes -= s
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    def _mem_get(self, key: str, now: float) -> Optional[str]:
+        # à appeler sous self._lock
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        expires_at, value, size = item
+        if expires_at >= now:
+            self._mem.move_to_end(key)
+            self.hits_memory += 1
+            return value
+        del self._mem[key]
+        self._mem_bytes -= size
+        return None
+
+    def _has_disk(self) -> bool:
+        return bool(self.db_path) or self._db is not None
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            value = self._mem_get(key, now)
+            if value is not None:
+                return value
+            return self._get_disk(key, now)
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        # à appeler sous self._lock
+        if self._disk() is not None:
+            found = self._disk_get(key, now)
+            if found is not None:
+                expires_at, value = found
+                self._mem_put(key, expires_at, value, len(value.encode("utf-8")))
+                self.hits_disk += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def _locked_get_disk(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            # peut avoir été mise en mémoire entre-temps
+            value = self._mem_get(key, now)
+            if value is not None:
+                return value
+            return self._get_disk(key, now)
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if not value or size > self.max_entry_bytes:
+            return
+
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._mem_put(key, expires_at, value, size)
+            if self._disk() is not None:
+                self._disk_set(key, value, size, expires_at, now)
+
+    async def aget(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            value = self._mem_get(key, now)
+            if value is not None or not self._has_disk():
+                if value is None:
+                    self.misses += 1
+                return value
+        return await run_in_threadpool(self._locked_get_disk, key, now)
+
+    async def aset(self, key: str, value: str):
+        if self._has_disk():
+            await run_in_threadpool(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def flush(self):
+        # écrit les dates de lecture en attente (arrêt du serveur)
+        with self._lock:
+            if self._db is not None and self._touched:
+                self._flush_touched()
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._mem_bytes = 0
+            self._touched.clear()
+            if self._disk() is not None:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+                self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else 0.0,
+            "entries_memory": len(self._mem),
+            "bytes_memory": self._mem_bytes,
+            "bytes_disk": self._disk_bytes,
+            "endpoints": sorted(LLM_CACHE_ENDPOINTS),
+        }
+
+
+def cache_enabled_for(scope: Optional[str]) -> bool:
+    return bool(scope) and scope in LLM_CACHE_ENDPOINTS
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,243 @@
+# ai_api/scheduler.py
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from ai_api.backends import pool
+
+LANE_INTERACTIVE = "interactive"  # /generate, /continue, /orchestrate
+LANE_BATCH = "batch"              # /build et générations longues
+LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+# Générations simultanées max (par défaut : somme des slots des instances)
+LLM_MAX_CONCURRENCY = int(
+    os.getenv("LLM_MAX_CONCURRENCY", str(sum(b.max_concurrency for b in pool.backends)))
+)
+
+# Attente max en file avant 503, taille max de la file avant 429
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "30"))
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "256"))
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "8"))
+
+# Nombre de passages interactifs consécutifs avant de laisser passer un batch
+LLM_INTERACTIVE_BURST = int(os.getenv("LLM_INTERACTIVE_BURST", "4"))
+
+
+class Ticket:
+    __slots__ = ("user", "lane", "enqueued_at", "granted_at", "future", "released")
+
+    def __init__(self, user: str, lane: str):
+        self.user = user
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+        self.released = False
+
+
+class AdmissionScheduler:
+    """
+    Contrôle d'admission devant Ollama :
+    - limite globale de générations simultanées
+    - deux voies de priorité (interactive avant batch, sans famine du batch)
+    - équité entre utilisateurs : round-robin sur les files par utilisateur
+    - attente bornée : 429 (file pleine) ou 503 (attente trop longue),
+      avec Retry-After
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_wait: float = LLM_MAX_QUEUE_WAIT,
+        max_queue: int = LLM_MAX_QUEUE_DEPTH,
+        max_queued_per_user: int = LLM_MAX_QUEUED_PER_USER,
+        interactive_burst: int = LLM_INTERACTIVE_BURST,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.interactive_burst = interactive_burst
+
+        self._active = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {lane: OrderedDict() for lane in LANES}
+        self._depth: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._queued_per_user: Dict[str, int] = {}
+        self._interactive_streak = 0
+
+        # observabilité
+        self._waits_ms: Deque[float] = deque(maxlen=1024)
+        self._service_s = 5.0  # moyenne glissante de la durée d'une génération
+        self.granted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    async def acquire(self, user: str, lane: str = LANE_INTERACTIVE) -> Ticket:
+        ticket = Ticket(user, lane)
+
+        if self._active < self.max_concurrency and self.queued == 0:
+            self._grant(ticket)
+            return ticket
+
+        if self.queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            self._reject(429, "File d'attente pleine, réessayez plus tard")
+        if self._queued_per_user.get(user, 0) >= self.max_queued_per_user:
+            self.rejected_queue_full += 1
+            self._reject(429, "Trop de requêtes en attente pour cet utilisateur")
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._enqueue(ticket)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if ticket.granted_at is not None:
+                return ticket
+            self._dequeue(ticket)
+            self.rejected_timeout += 1
+            self._reject(503, "Serveur LLM saturé, réessayez plus tard")
+        except asyncio.CancelledError:
+            if ticket.granted_at is not None:
+                self.release(ticket)
+            else:
+                self._dequeue(ticket)
+            raise
+
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """
+        Libère le slot (idempotent : peut être appelé plusieurs fois).
+        """
+        if ticket.released or ticket.granted_at is None:
+            return
+        ticket.released = True
+        self._active -= 1
+
+        elapsed = time.monotonic() - ticket.granted_at
+        self._service_s = 0.9 * self._service_s + 0.1 * elapsed
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, lane: str = LANE_INTERACTIVE) -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(user, lane)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @property
+    def queued(self) -> int:
+        return sum(self._depth.values())
+
+    # -------------------------
+    # Interne
+    # -------------------------
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted_at = time.monotonic()
+        self._active += 1
+        self.granted += 1
+        self._waits_ms.append((ticket.granted_at - ticket.enqueued_at) * 1000)
+
+    def _enqueue(self, ticket: Ticket):
+        users = self._queues[ticket.lane]
+        users.setdefault(ticket.user, deque()).append(ticket)
+        self._depth[ticket.lane] += 1
+        self._queued_per_user[ticket.user] = self._queued_per_user.get(ticket.user, 0) + 1
+
+    def _dequeue(self, ticket: Ticket):
+        users = self._queues[ticket.lane]
+        q = users.get(ticket.user)
+        if q is None or ticket not in q:
+            return
+        q.remove(ticket)
+        if not q:
+            del users[ticket.user]
+        self._forget(ticket)
+
+    def _forget(self, ticket: Ticket):
+        self._depth[ticket.lane] -= 1
+        left = self._queued_per_user.get(ticket.user, 1) - 1
+        if left > 0:
+            self._queued_per_user[ticket.user] = left
+        else:
+            self._queued_per_user.pop(ticket.user, None)
+
+    def _next_lane(self) -> Optional[str]:
+        interactive = self._depth[LANE_INTERACTIVE] > 0
+        batch = self._depth[LANE_BATCH] > 0
+        if interactive and (not batch or self._interactive_streak < self.interactive_burst):
+            self._interactive_streak += 1
+            return LANE_INTERACTIVE
+        if batch:
+            self._interactive_streak = 0
+            return LANE_BATCH
+        return None
+
+    def _pop(self, lane: str) -> Ticket:
+        # round-robin : le premier utilisateur passe, puis retourne en fin de file
+        users = self._queues[lane]
+        user, q = next(iter(users.items()))
+        ticket = q.popleft()
+        if q:
+            users.move_to_end(user)
+        else:
+            del users[user]
+        self._forget(ticket)
+        return ticket
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            ticket = self._pop(lane)
+            if ticket.future is None or ticket.future.done():
+                continue
+            self._grant(ticket)
+            ticket.future.set_result(True)
+
+    def _retry_after(self) -> int:
+        waves = (self.queued + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self._service_s))
+
+    def _reject(self, status_code: int, detail: str):
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self._retry_after())},
+        )
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits_ms)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "queued": dict(self._depth),
+            "granted": self.granted,
+            "rejected": {
+                "queue_full": self.rejected_queue_full,
+                "timeout": self.rejected_timeout,
+            },
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits), 2) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95) - 1], 2) if waits else 0.0,
+                "max": round(waits[-1], 2) if waits else 0.0,
+            },
+            "avg_service_s": round(self._service_s, 2),
+        }
+
+
+scheduler = AdmissionScheduler()
@@ -23,8 +23,12 @@ class ContinueRequest(BaseModel):
 
 class GenerateResponse(BaseModel):
     result: str
-    truncated: bool = False
+    truncated: bool = False  # génération arrêtée sur max_tokens (done_reason == "length")
     session_id: str
+    prefill_saved_ms: float = 0.0  # prefill évité grâce au préfixe en cache (estimation)
+    prompt_tokens: int = 0          # tokens du prompt évalués par Ollama (prompt_eval_count)
+    completion_tokens: int = 0      # tokens générés (eval_count)
+    tokens_per_second: float = 0.0
 
 
 # =========================
@@ -44,6 +48,41 @@ class OrchestrateResponse(BaseModel):
     result: str
     truncated: bool = False
     session_id: str
+    similarity: Optional[float] = None  # renseigné si servi par le cache approximatif
+    prefill_saved_ms: float = 0.0  # prefill évité grâce au préfixe en cache (estimation)
+    prompt_tokens: int = 0          # tokens du prompt évalués par Ollama (prompt_eval_count)
+    completion_tokens: int = 0      # tokens générés (eval_count)
+    tokens_per_second: float = 0.0
+
+
+class OrchestrateFanoutRequest(BaseModel):
+    prompt: str
+    agents: List[Literal["backend", "frontend", "devops", "writer"]] = []  # vide = tous les agents pertinents
+    language: str = "français"
+    max_tokens: int = 512
+    session_id: Optional[str] = None
+    timeout_s: Optional[float] = None  # délai max par agent (défaut : FANOUT_AGENT_TIMEOUT)
+
+
+class AgentResult(BaseModel):
+    agent: str
+    ok: bool = True
+    result: str = ""
+    truncated: bool = False
+    elapsed_ms: float = 0.0
+    error: Optional[str] = None
+    similarity: Optional[float] = None
+    prefill_saved_ms: float = 0.0
+    prompt_tokens: int = 0          # tokens du prompt évalués par Ollama (prompt_eval_count)
+    completion_tokens: int = 0      # tokens générés (eval_count)
+    tokens_per_second: float = 0.0
+
+
+class OrchestrateFanoutResponse(BaseModel):
+    session_id: str
+    results: List[AgentResult]
+    partial: bool = False  # au moins un agent en échec ou hors délai
+    elapsed_ms: float = 0.0
 
 
 # =========================
@@ -60,8 +99,30 @@ class CreateFileResponse(BaseModel):
     path: str
 
 
+class FileInfo(BaseModel):
+    path: str
+    size: int
+    mtime: float
+    hash: str  # sha256 du contenu
+
+
 class ListFilesResponse(BaseModel):
     files: List[str]
+    entries: List[FileInfo] = []
+    next_cursor: Optional[str] = None  # à repasser en ?cursor= pour la page suivante
+
+
+class SearchMatchInfo(BaseModel):
+    path: str
+    line: int
+    column: int
+    snippet: str
+
+
+class SearchResponse(BaseModel):
+    matches: List[SearchMatchInfo]
+    next_cursor: Optional[str] = None
+    files_scanned: int = 0  # fichiers lus après le préfiltre trigrammes
 
 
 class ReadFileRequest(BaseModel):
@@ -74,6 +135,58 @@ class ReadFileResponse(BaseModel):
     content: str
 
 
+class UploadFileResponse(BaseModel):
+    ok: bool = True
+    path: str
+    size: int
+
+
+class BatchWriteFile(BaseModel):
+    path: str
+    content: str
+
+
+class BatchWriteRequest(BaseModel):
+    files: List[BatchWriteFile]
+    fsync: bool = False
+
+
+class BatchWriteResponse(BaseModel):
+    ok: bool = True
+    written: List[str] = []
+    unchanged: List[str] = []  # contenu identique, pas réécrits
+    skipped: List[str] = []    # chemin vide ou doublon
+
+
+class SnapshotInfo(BaseModel):
+    id: str
+    session_id: str
+    build_id: str
+    created_at: float
+    summary: str = ""
+    file_count: int = 0
+    bytes: int = 0
+    new_blobs: int = 0  # contenus ajoutés au store par ce snapshot
+
+
+class SnapshotListResponse(BaseModel):
+    snapshots: List[SnapshotInfo]
+
+
+class SnapshotDiffResponse(BaseModel):
+    added: List[str] = []
+    removed: List[str] = []
+    modified: List[str] = []
+
+
+class SnapshotRestoreResponse(BaseModel):
+    ok: bool = True
+    snapshot_id: str
+    restored: List[str] = []
+    removed: List[str] = []
+    unchanged: int = 0
+
+
 class DeleteFileRequest(BaseModel):
     path: str
 
@@ -101,8 +214,47 @@ class BuildRequest(BaseModel):
 
 
 class BuildResponse(BaseModel):
+    ok: bool = True
+    session_id: str
+    agent: str
+    summary: str
+    files_created: List[str] = []    # fichiers du build en place (écrits ou inchangés)
+    files_unchanged: List[str] = []  # déjà identiques sur disque : pas réécrits
+    files_skipped: List[str] = []
+    snapshot_id: Optional[str] = None  # état du workspace après ce build
+    similarity: Optional[float] = None  # renseigné si servi par le cache approximatif
+    truncated: bool = False
+    prompt_tokens: int = 0          # tokens du prompt évalués par Ollama (prompt_eval_count)
+    completion_tokens: int = 0      # tokens générés (eval_count)
+    tokens_per_second: float = 0.0
+
+
+class BuildPipelineRequest(BuildRequest):
+    max_files: Optional[int] = None  # plafonné par BUILD_MAX_FILES
+    file_max_tokens: int = 1024      # budget de génération par fichier
+
+
+class BuildFileResult(BaseModel):
+    path: str
+    role: str = ""
+    ok: bool = True
+    saved_path: Optional[str] = None
+    truncated: bool = False
+    elapsed_ms: float = 0.0
+    error: Optional[str] = None
+    prompt_tokens: int = 0          # tokens du prompt évalués par Ollama (prompt_eval_count)
+    completion_tokens: int = 0      # tokens générés (eval_count)
+    tokens_per_second: float = 0.0
+
+
+class BuildPipelineResponse(BaseModel):
     ok: bool = True
     session_id: str
     agent: str
     summary: str
     files_created: List[str] = []
+    files: List[BuildFileResult] = []
+    partial: bool = False  # au moins un fichier en échec
+    snapshot_id: Optional[str] = None
+    plan_ms: float = 0.0
+    elapsed_ms: float = 0.0
@@ -0,0 +1,358 @@
+# ai_api/search_index.py
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse  # Python >= 3.11
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+from ai_api.workspace_index import FileEntry, WorkspaceIndex, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Fichiers plus gros ignorés par la recherche (logs, dumps...)
+SEARCH_MAX_FILE_BYTES = int(os.getenv("SEARCH_MAX_FILE_BYTES", str(1024 * 1024)))
+
+# Longueur max d'un extrait de ligne retourné
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "200"))
+
+# Index persisté dans le dossier interne du workspace (voir RESERVED_DIRS)
+SEARCH_INDEX_FILE = Path(".store") / "search.json.gz"
+
+_FORMAT_VERSION = 1
+_BINARY_SNIFF = 8192
+
+
+@dataclass(frozen=True)
+class SearchMatch:
+    path: str
+    line: int     # à partir de 1
+    column: int   # à partir de 1
+    snippet: str
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    # trigrammes en minuscules : servent aussi aux recherches insensibles à la casse
+    text = text.lower()
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _required_literals(items) -> List[str]:
+    """
+    Suites de caractères littéraux que toute correspondance de la regex
+    contient forcément. Volontairement prudent : alternatives, classes,
+    répétitions optionnelles... coupent les suites sans rien exiger.
+    """
+    runs: List[str] = []
+    current: List[str] = []
+
+    def cut():
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            cut()
+            runs.extend(_required_literals(av[2]))
+        elif op is sre_parse.SUBPATTERN:
+            cut()
+            runs.extend(_required_literals(av[-1]))
+        else:
+            cut()
+    cut()
+    return runs
+
+
+def required_trigrams(pattern: str, is_regex: bool) -> Set[str]:
+    """
+    Trigrammes présents dans tout fichier qui correspond ; ensemble vide :
+    pas de préfiltre possible (tous les fichiers texte sont lus).
+    """
+    if not is_regex:
+        return set(trigrams(pattern))
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError):
+        return set()
+    out: Set[str] = set()
+    for run in _required_literals(list(parsed)):
+        out.update(trigrams(run))
+    return out
+
+
+def _read_text(full: Path) -> Optional[str]:
+    # None pour les fichiers binaires, non UTF-8 ou trop gros
+    try:
+        if full.stat().st_size > SEARCH_MAX_FILE_BYTES:
+            return None
+        data = full.read_bytes()
+    except OSError:
+        return None
+    if b"\0" in data[:_BINARY_SNIFF]:
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def _snippet(line: str, start: int) -> str:
+    if len(line) <= SEARCH_SNIPPET_CHARS:
+        return line
+    begin = max(0, min(start - SEARCH_SNIPPET_CHARS // 4, len(line) - SEARCH_SNIPPET_CHARS))
+    return line[begin:begin + SEARCH_SNIPPET_CHARS]
+
+
+class SearchIndex:
+    """
+    Index trigrammes des fichiers texte d'un workspace : trigramme ->
+    fichiers qui le contiennent. Une recherche ne lit que les fichiers qui
+    contiennent tous les trigrammes de la requête.
+
+    Le listener de l'index workspace note les changements (écritures,
+    suppressions, uploads, restaurations, changements hors API vus par le
+    scan) sans lire le fichier : les écritures ne ralentissent pas. La
+    tâche de fond des workspaces les applique (update) ; en attendant, une
+    recherche lit directement les fichiers notés au lieu de se fier à leurs
+    anciens trigrammes.
+
+    Construit par la tâche de fond (ou la première recherche si elle passe
+    avant) depuis le fichier persisté : seuls les fichiers dont le hash a
+    changé depuis la sauvegarde sont relus.
+    """
+
+    def __init__(self, index: WorkspaceIndex):
+        self.index = index
+        self.path = index.root / SEARCH_INDEX_FILE
+        self._lock = threading.RLock()
+        self._files: Dict[str, Tuple[str, Optional[FrozenSet[str]]]] = {}  # chemin -> (hash, trigrammes ou None si binaire)
+        self._postings: Dict[str, Set[str]] = {}
+        self._pending: Dict[str, Optional[FileEntry]] = {}
+        self._built = False
+        self._dirty = False
+        self.reused = 0
+        self.reindexed = 0
+        index.add_listener(self._on_change)
+
+    def _on_change(self, path: str, entry: Optional[FileEntry]):
+        # noté même avant la construction : un fichier écrit pendant
+        # ensure_built est revu ensuite (rien à faire si son hash n'a pas bougé)
+        with self._lock:
+            self._pending[path] = entry
+
+    # -------------------------
+    # Mise à jour
+    # -------------------------
+
+    def _add(self, path: str, digest: str, grams: Optional[FrozenSet[str]]):
+        self._remove(path)
+        self._files[path] = (digest, grams)
+        for g in grams or ():
+            self._postings.setdefault(g, set()).add(path)
+        self._dirty = True
+
+    def _remove(self, path: str):
+        old = self._files.pop(path, None)
+        if old is None:
+            return
+        for g in old[1] or ():
+            paths = self._postings.get(g)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[g]
+        self._dirty = True
+
+    def _file_trigrams(self, entry: FileEntry) -> Optional[FrozenSet[str]]:
+        text = _read_text(self.index.root / entry.path)
+        return trigrams(text) if text is not None else None
+
+    def _index_file(self, entry: FileEntry):
+        self._add(entry.path, entry.hash, self._file_trigrams(entry))
+        self.reindexed += 1
+
+    def _load(self) -> Dict[str, Tuple[str, Optional[FrozenSet[str]]]]:
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, EOFError):
+            logger.warning("index de recherche illisible (%s) : reconstruit", self.path)
+            return {}
+        if data.get("version") != _FORMAT_VERSION:
+            return {}
+        out = {}
+        for path, (digest, packed) in data.get("files", {}).items():
+            grams = None if packed is None else frozenset(packed[i:i + 3] for i in range(0, len(packed), 3))
+            out[path] = (digest, grams)
+        return out
+
+    def ensure_built(self):
+        with self._lock:
+            if self._built:
+                return
+            saved = self._load()
+            for entry in self.index.list()[0]:
+                old = saved.get(entry.path)
+                if old is not None and old[0] == entry.hash:
+                    self._add(entry.path, entry.hash, old[1])
+                    self.reused += 1
+                else:
+                    self._index_file(entry)
+            self._dirty = len(saved) != self.reused or self.reindexed > 0
+            self._built = True
+
+    def update(self):
+        """
+        Construit l'index si besoin et applique les changements notés.
+        Appelé par la tâche de fond des workspaces : les recherches n'ont
+        pas à payer la relecture d'un gros /build.
+        """
+        self.ensure_built()
+        self._apply_pending()
+
+    def _apply_pending(self):
+        # fichiers relus hors verrou : les recherches continuent pendant ce temps
+        with self._lock:
+            pending = dict(self._pending)
+        updates = []
+        for path, entry in pending.items():
+            if entry is None or self._files.get(path, (None,))[0] == entry.hash:
+                updates.append((path, entry, None))
+            else:
+                updates.append((path, entry, self._file_trigrams(entry)))
+        with self._lock:
+            for path, entry, grams in updates:
+                if path not in self._pending or self._pending[path] is not entry:
+                    continue  # changé de nouveau entre-temps : au prochain passage
+                del self._pending[path]
+                if entry is None:
+                    self._remove(path)
+                elif self._files.get(path, (None,))[0] != entry.hash:
+                    self._add(path, entry.hash, grams)
+                    self.reindexed += 1
+
+    def save(self):
+        """
+        Écrit l'index sur disque s'il a changé (tmp + os.replace).
+        """
+        if not self._built:
+            return
+        self._apply_pending()
+        with self._lock:
+            if not self._dirty:
+                return
+            files = {
+                path: [digest, None if grams is None else "".join(sorted(grams))]
+                for path, (digest, grams) in self._files.items()
+            }
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.tmp")
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=1) as f:
+                json.dump({"version": _FORMAT_VERSION, "files": files}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            self._dirty = True
+            logger.exception("sauvegarde de l'index de recherche en échec (%s)", self.path)
+
+    # -------------------------
+    # Recherche
+    # -------------------------
+
+    def candidates(self, required: Set[str], prefix: str = "") -> List[str]:
+        """
+        Fichiers à lire : ceux qui contiennent tous les trigrammes requis,
+        plus les fichiers modifiés pas encore réindexés (trigrammes périmés).
+        """
+        with self._lock:
+            if required:
+                # intersection en partant de la liste la plus courte
+                lists = sorted((self._postings.get(g, set()) for g in required), key=len)
+                found = set(lists[0])
+                for paths in lists[1:]:
+                    found &= paths
+                    if not found:
+                        break
+            else:
+                found = {p for p, (_, grams) in self._files.items() if grams is not None}
+            for path, entry in self._pending.items():
+                if entry is None:
+                    found.discard(path)
+                else:
+                    found.add(path)
+        return sorted(p for p in found if p.startswith(prefix))
+
+    def search(
+        self,
+        query: str,
+        is_regex: bool = False,
+        case_sensitive: bool = True,
+        prefix: str = "",
+        accept: Optional[Callable[[str], bool]] = None,
+        cursor: Optional[str] = None,
+        limit: int = 50,
+    ) -> Tuple[List[SearchMatch], Optional[str], int]:
+        """
+        Recherche ligne par ligne (les regex ne s'étendent pas sur plusieurs
+        lignes). Résultats triés par fichier puis ligne ; pagination par
+        curseur (dernier fichier / ligne retournés).
+        Retourne (résultats, curseur suivant ou None, fichiers lus).
+        """
+        if not query:
+            raise ValueError("Recherche vide")
+        try:
+            regex = re.compile(query if is_regex else re.escape(query), 0 if case_sensitive else re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Regex invalide : {e}")
+        after = decode_cursor("search", cursor) if cursor else None  # (ligne, chemin)
+
+        self.ensure_built()
+        paths = self.candidates(required_trigrams(query, is_regex), prefix)
+
+        out: List[SearchMatch] = []
+        scanned = 0
+        for path in paths:
+            if after is not None and path < after[1]:
+                continue
+            if accept is not None and not accept(path):
+                continue
+            text = _read_text(self.index.root / path)
+            if text is None:
+                continue
+            scanned += 1
+            for number, line in enumerate(text.splitlines(), 1):
+                if after is not None and path == after[1] and number <= after[0]:
+                    continue
+                m = regex.search(line)
+                if m is None:
+                    continue
+                if len(out) >= limit:
+                    last = out[-1]
+                    return out, encode_cursor("search", (last.line, last.path)), scanned
+                out.append(SearchMatch(path=path, line=number, column=m.start() + 1, snippet=_snippet(line, m.start())))
+        return out, None, scanned
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self._built,
+                "files": len(self._files),
+                "trigrams": len(self._postings),
+                "pending": len(self._pending),
+                "reused": self.reused,
+                "reindexed": self.reindexed,
+            }
@@ -0,0 +1,275 @@
+# ai_api/session_store.py
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from ai_api.tokens import count_tokens
+
+# Tier chaud (mémoire, par worker)
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SESSION_IDLE_TTL = int(os.getenv("SESSION_IDLE_TTL", "3600"))
+
+
+class _HotSession:
+    __slots__ = ("messages", "tokens", "last_id", "size", "last_access")
+
+    def __init__(self):
+        self.messages: List[str] = []
+        self.tokens: List[int] = []  # calculé une fois par message
+        self.last_id = 0
+        self.size = 0
+        self.last_access = time.time()
+
+
+class HotTier:
+    """
+    Cache LRU des sessions récentes : borné en octets, avec expiration
+    des sessions inactives depuis plus de idle_ttl secondes.
+    """
+
+    def __init__(self, max_bytes: int = SESSION_CACHE_MAX_BYTES, idle_ttl: int = SESSION_IDLE_TTL):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._items: "OrderedDict[str, _HotSession]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, session_id: str) -> Optional[_HotSession]:
+        item = self._items.get(session_id)
+        if item is None:
+            return None
+        now = time.time()
+        if now - item.last_access > self.idle_ttl:
+            self.drop(session_id)
+            return None
+        item.last_access = now
+        self._items.move_to_end(session_id)
+        return item
+
+    def ensure(self, session_id: str) -> _HotSession:
+        item = self.get(session_id)
+        if item is None:
+            item = _HotSession()
+            self._items[session_id] = item
+        return item
+
+    def append(self, item: _HotSession, text: str, msg_id: int = 0, tokens: Optional[int] = None):
+        size = len(text.encode("utf-8"))
+        item.messages.append(text)
+        item.tokens.append(count_tokens(text) if tokens is None else tokens)
+        item.size += size
+        item.last_id = max(item.last_id, msg_id)
+        self._bytes += size
+        self._evict()
+
+    def drop(self, session_id: str):
+        item = self._items.pop(session_id, None)
+        if item is not None:
+            self._bytes -= item.size
+
+    def ids(self) -> List[str]:
+        return list(self._items.keys())
+
+    def _evict(self):
+        now = time.time()
+        # sessions inactives d'abord (les plus anciennes sont en tête)
+        while self._items:
+            sid, oldest = next(iter(self._items.items()))
+            if now - oldest.last_access <= self.idle_ttl and self._bytes <= self.max_bytes:
+                break
+            self.drop(sid)
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._items), "bytes": self._bytes}
+
+
+class SessionStore(ABC):
+
+    @abstractmethod
+    def create(self, session_id: str):
+        pass
+
+    @abstractmethod
+    def append(self, session_id: str, text: str):
+        pass
+
+    @abstractmethod
+    def messages(self, session_id: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def list_ids(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def entries(self, session_id: str) -> List[Tuple[str, int]]:
+        """
+        Messages de la session avec leur nombre de tokens.
+        """
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Stockage mémoire seul (un worker, données perdues au redémarrage).
+    """
+
+    def __init__(self, hot: Optional[HotTier] = None):
+        self.hot = hot or HotTier()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str):
+        with self._lock:
+            self.hot.ensure(session_id)
+
+    def append(self, session_id: str, text: str):
+        with self._lock:
+            self.hot.append(self.hot.ensure(session_id), text)
+
+    def messages(self, session_id: str) -> List[str]:
+        with self._lock:
+            item = self.hot.get(session_id)
+            return list(item.messages) if item else []
+
+    def entries(self, session_id: str) -> List[Tuple[str, int]]:
+        with self._lock:
+            item = self.hot.get(session_id)
+            return list(zip(item.messages, item.tokens)) if item else []
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return self.hot.ids()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "hot": self.hot.stats()}
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Tier durable append-only en SQLite (WAL), partagé par tous les workers,
+    devant lequel chaque worker garde un tier chaud en mémoire.
+
+    Cohérence entre workers : à chaque lecture on ne récupère que les
+    messages d'id supérieur au dernier id connu (requête indexée), ce qui
+    rattrape les écritures faites par les autres processus.
+    """
+
+    def __init__(self, db_path: str, hot: Optional[HotTier] = None):
+        self.db_path = db_path
+        self.hot = hot or HotTier()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                tokens INTEGER,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_session_messages_sid ON session_messages(session_id, id)"
+        )
+
+        # bases créées avant le comptage des tokens
+        cols = [row[1] for row in conn.execute("PRAGMA table_info(session_messages)")]
+        if "tokens" not in cols:
+            conn.execute("ALTER TABLE session_messages ADD COLUMN tokens INTEGER")
+
+    def create(self, session_id: str):
+        self._conn().execute(
+            "INSERT OR IGNORE INTO sessions(id, created_at) VALUES (?, ?)",
+            (session_id, time.time()),
+        )
+
+    def append(self, session_id: str, text: str):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions(id, created_at) VALUES (?, ?)",
+                (session_id, now),
+            )
+            conn.execute(
+                "INSERT INTO session_messages(session_id, text, tokens, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, text, count_tokens(text), now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # le prochain rattrapage récupère ce message (et ceux des autres workers)
+        self._refresh(session_id)
+
+    def _refresh(self, session_id: str) -> Optional[_HotSession]:
+        while True:
+            with self._lock:
+                item = self.hot.get(session_id)
+                last_id = item.last_id if item else 0
+
+            rows = self._conn().execute(
+                "SELECT id, text, tokens FROM session_messages WHERE session_id = ? AND id > ? ORDER BY id",
+                (session_id, last_id),
+            ).fetchall()
+
+            with self._lock:
+                item = self.hot.get(session_id)
+                if item is None:
+                    if last_id:
+                        continue  # évincée entre-temps : relire depuis le début
+                    if not rows:
+                        return None
+                    item = self.hot.ensure(session_id)
+                for msg_id, text, tokens in rows:
+                    if msg_id > item.last_id:
+                        self.hot.append(item, text, msg_id, tokens)
+                return item
+
+    def messages(self, session_id: str) -> List[str]:
+        item = self._refresh(session_id)
+        with self._lock:
+            return list(item.messages) if item else []
+
+    def entries(self, session_id: str) -> List[Tuple[str, int]]:
+        item = self._refresh(session_id)
+        with self._lock:
+            return list(zip(item.messages, item.tokens)) if item else []
+
+    def list_ids(self) -> List[str]:
+        rows = self._conn().execute("SELECT id FROM sessions ORDER BY created_at").fetchall()
+        return [r[0] for r in rows]
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "hot": self.hot.stats()}
@@ -0,0 +1,117 @@
+# ai_api/singleflight.py
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class _StreamFlight:
+    """
+    Un stream en cours partagé : les chunks sont conservés pour que les
+    abonnés arrivés en retard rejouent le début puis suivent le direct
+    (y compris le dernier élément, statistiques de fin comprises).
+    """
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalescence des appels identiques en vol : tant qu'un appel pour une clé
+    est en cours, les appels suivants s'y rattachent au lieu d'en relancer un.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls or key in self._streams
+
+    def is_streaming(self, key: str) -> bool:
+        return key in self._streams
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._calls.get(key)
+        if fut is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            fut = asyncio.ensure_future(fn())
+            self._calls[key] = fut
+            fut.add_done_callback(lambda f: self._done(key, f))
+
+        # shield : l'annulation d'un appelant n'annule pas l'appel partagé
+        return await asyncio.shield(fut)
+
+    def _done(self, key: str, fut: asyncio.Future):
+        self._calls.pop(key, None)
+        # tous les appelants ont pu partir (timeout) : l'erreur est consommée ici
+        if not fut.cancelled():
+            fut.exception()
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        flight = self._streams.get(key)
+        if flight is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._produce(key, flight, fn))
+
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                if i < len(flight.chunks):
+                    yield flight.chunks[i]
+                    i += 1
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            # plus personne n'écoute : inutile de continuer la génération
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                flight.task.cancel()
+
+    async def _produce(self, key: str, flight: _StreamFlight, fn: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for chunk in fn():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("Stream annulé")
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.notify()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
@@ -0,0 +1,329 @@
+# ai_api/snapshots.py
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ai_api.file_actions import STAGING_DIR, WORKSPACE_FSYNC, commit_staged, safe_path
+from ai_api.workspaces import Workspace, QuotaExceeded, WORKSPACE_QUOTA_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Snapshots gardés par workspace (les plus anciens et leurs blobs orphelins
+# sont supprimés au-delà)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "50"))
+
+# Espace max du store (blobs + manifests) par workspace, en plus du quota
+# des fichiers ; au-delà, les plus anciens snapshots sont supprimés (0 = illimité)
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", str(WORKSPACE_QUOTA_BYTES)))
+
+STORE_DIR = ".store"
+
+_locks: Dict[Path, threading.Lock] = {}
+_sizes: Dict[Path, int] = {}  # octets du store par workspace (calculés au premier accès)
+_locks_guard = threading.Lock()
+
+
+def _lock_for(ws: Workspace) -> threading.Lock:
+    # snapshot / restore d'un même workspace : un à la fois
+    with _locks_guard:
+        return _locks.setdefault(ws.root, threading.Lock())
+
+
+def _store(ws: Workspace) -> Path:
+    return ws.root / STORE_DIR
+
+
+def _dir_bytes(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.stat(os.path.join(root, f)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def _store_bytes(ws: Workspace, refresh: bool = False) -> int:
+    # blobs + manifests (à appeler sous _lock_for(ws))
+    if refresh or ws.root not in _sizes:
+        store = _store(ws)
+        _sizes[ws.root] = _dir_bytes(store / "blobs") + _dir_bytes(store / "snapshots")
+    return _sizes[ws.root]
+
+
+def store_usage(ws: Workspace) -> dict:
+    with _lock_for(ws):
+        return {"store_bytes": _store_bytes(ws), "store_max_bytes": SNAPSHOT_MAX_BYTES}
+
+
+def _blob_path(ws: Workspace, digest: str) -> Path:
+    return _store(ws) / "blobs" / digest[:2] / digest
+
+
+def _manifest_path(ws: Workspace, snapshot_id: str) -> Path:
+    if not snapshot_id or "/" in snapshot_id or "\\" in snapshot_id or snapshot_id.startswith("."):
+        raise ValueError("Snapshot invalide")
+    return _store(ws) / "snapshots" / f"{snapshot_id}.json"
+
+
+def _put_blob(ws: Workspace, full: Path, digest: str) -> bool:
+    """
+    Copie le contenu dans le store s'il n'y est pas déjà (contenus
+    identiques stockés une fois). Les blobs sont en lecture seule : un
+    fichier restauré par hardlink ne peut pas les modifier en place.
+    """
+    blob = _blob_path(ws, digest)
+    if blob.exists():
+        return False
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    tmp = blob.with_name(f".{digest}.{uuid.uuid4().hex}")
+    shutil.copyfile(full, tmp)
+    os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.replace(tmp, blob)
+    _sizes[ws.root] = _store_bytes(ws) + blob.stat().st_size
+    return True
+
+
+def _make_room(ws: Workspace, needed: int, keep: set):
+    """
+    Supprime les plus anciens snapshots jusqu'à ce que needed octets tiennent
+    sous SNAPSHOT_MAX_BYTES ; lève QuotaExceeded si même un store vide ne
+    suffit pas. keep : blobs à garder (ceux du snapshot en cours).
+    """
+    if not SNAPSHOT_MAX_BYTES or _store_bytes(ws) + needed <= SNAPSHOT_MAX_BYTES:
+        return
+    # impossible même en vidant le store : on ne supprime rien
+    kept = sum(b.stat().st_size for b in (_blob_path(ws, h) for h in keep) if b.exists())
+    if kept + needed > SNAPSHOT_MAX_BYTES:
+        raise QuotaExceeded(f"Espace des snapshots insuffisant ({SNAPSHOT_MAX_BYTES} octets)")
+    manifests = sorted((_store(ws) / "snapshots").glob("*.json"))
+    while manifests and _store_bytes(ws) + needed > SNAPSHOT_MAX_BYTES:
+        manifests.pop(0).unlink(missing_ok=True)
+        gc_blobs(ws, keep)
+    if _store_bytes(ws) + needed > SNAPSHOT_MAX_BYTES:
+        raise QuotaExceeded(f"Espace des snapshots insuffisant ({SNAPSHOT_MAX_BYTES} octets)")
+
+
+def _summary(manifest: dict) -> dict:
+    return {k: v for k, v in manifest.items() if k != "files"}
+
+
+# =========================
+# 🔹 Snapshots
+# =========================
+
+def create_snapshot(ws: Workspace, session_id: str, summary: str = "") -> dict:
+    """
+    Enregistre l'état courant du workspace (chemin -> hash, depuis l'index).
+    Seuls les contenus absents du store sont copiés ; le manifest ne
+    contient que des hash. Les plus anciens snapshots sont supprimés si le
+    store dépasserait SNAPSHOT_MAX_BYTES (QuotaExceeded si ça ne suffit pas).
+    """
+    with _lock_for(ws):
+        entries = []
+        for entry in ws.index.list()[0]:
+            full = ws.root / entry.path
+            try:
+                st = full.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_size != entry.size or st.st_mtime_ns != entry.mtime_ns:
+                # modifié hors API depuis le dernier scan : hash à jour d'abord
+                entry = ws.index.refresh(full)
+                if entry is None:
+                    continue
+            entries.append(entry)
+
+        hashes = {e.hash for e in entries}
+        missing = {e.hash: e.size for e in entries if not _blob_path(ws, e.hash).exists()}
+        _make_room(ws, sum(missing.values()), hashes)
+
+        files: Dict[str, str] = {}
+        total = 0
+        new_blobs = 0
+        for entry in entries:
+            try:
+                new_blobs += _put_blob(ws, ws.root / entry.path, entry.hash)
+            except FileNotFoundError:
+                continue
+            files[entry.path] = entry.hash
+            total += entry.size
+
+        now = time.time()
+        build_id = uuid.uuid4().hex[:12]
+        # ids triables par date (à la milliseconde)
+        snapshot_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now))}{int(now * 1000) % 1000:03d}-{build_id}"
+        manifest = {
+            "id": snapshot_id,
+            "session_id": session_id,
+            "build_id": build_id,
+            "created_at": now,
+            "summary": summary,
+            "file_count": len(files),
+            "bytes": total,
+            "new_blobs": new_blobs,
+            "files": files,
+        }
+
+        path = _manifest_path(ws, snapshot_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        _sizes[ws.root] = _store_bytes(ws) + path.stat().st_size
+
+        _prune(ws)
+        return _summary(manifest)
+
+
+def load_snapshot(ws: Workspace, snapshot_id: str) -> dict:
+    path = _manifest_path(ws, snapshot_id)
+    if not path.is_file():
+        raise FileNotFoundError("Snapshot introuvable")
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def snapshot_files(ws: Workspace, snapshot_id: str) -> List[Tuple[str, Path]]:
+    """
+    Fichiers d'un snapshot : (chemin, blob du store), triés par chemin.
+    """
+    files = load_snapshot(ws, snapshot_id)["files"]
+    return [(path, _blob_path(ws, files[path])) for path in sorted(files)]
+
+
+def list_snapshots(ws: Workspace, session_id: Optional[str] = None) -> List[dict]:
+    folder = _store(ws) / "snapshots"
+    if not folder.is_dir():
+        return []
+    out = []
+    for path in folder.glob("*.json"):
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if session_id and manifest.get("session_id") != session_id:
+            continue
+        out.append(_summary(manifest))
+    out.sort(key=lambda m: m.get("created_at", 0), reverse=True)
+    return out
+
+
+def _current_files(ws: Workspace) -> Dict[str, str]:
+    return {e.path: e.hash for e in ws.index.list()[0]}
+
+
+def diff_snapshots(ws: Workspace, a: str, b: Optional[str] = None) -> dict:
+    """
+    Différences de a vers b (b = None : état actuel du workspace).
+    Comparaison des manifests seulement (hash), sans lire les fichiers.
+    """
+    before = load_snapshot(ws, a)["files"]
+    after = load_snapshot(ws, b)["files"] if b else _current_files(ws)
+    return {
+        "added": sorted(after.keys() - before.keys()),
+        "removed": sorted(before.keys() - after.keys()),
+        "modified": sorted(p for p in before.keys() & after.keys() if before[p] != after[p]),
+    }
+
+
+def restore_snapshot(ws: Workspace, snapshot_id: str, prune: bool = True) -> dict:
+    """
+    Remet le workspace dans l'état du snapshot : les fichiers différents
+    sont des hardlinks vers les blobs (pas de copie ; copie seulement si le
+    système de fichiers refuse le lien), mis en place par os.replace avec
+    annulation en cas d'échec. Les écritures de l'API passent par un
+    fichier temporaire + os.replace : elles cassent le lien sans toucher
+    au blob. prune : supprime aussi les
+    fichiers absents du snapshot.
+    """
+    with _lock_for(ws):
+        target = load_snapshot(ws, snapshot_id)["files"]
+        current = _current_files(ws)
+
+        changes = [(p, h) for p, h in target.items() if current.get(p) != h]
+        extra = sorted(current.keys() - target.keys()) if prune else []
+
+        staging = ws.root / STAGING_DIR / uuid.uuid4().hex
+        staging.mkdir(parents=True)
+        try:
+            staged = []
+            sizes = []
+            for i, (path, digest) in enumerate(changes):
+                blob = _blob_path(ws, digest)
+                if not blob.is_file():
+                    raise FileNotFoundError(f"Contenu manquant dans le store : {path}")
+                tmp = staging / str(i)
+                try:
+                    os.link(blob, tmp)
+                except OSError:
+                    # EXDEV, système de fichiers sans hardlinks...
+                    shutil.copyfile(blob, tmp)
+                full = safe_path(path, ws)
+                staged.append((tmp, full))
+                sizes.append((full, blob.stat().st_size))
+
+            with ws.reserve_all(sizes):
+                commit_staged(staging, staged, WORKSPACE_FSYNC)
+                for (path, digest), (_, full) in zip(changes, staged):
+                    ws.index.refresh(full, digest=digest)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        for path in extra:
+            full = ws.root / path
+            try:
+                full.unlink()
+            except FileNotFoundError:
+                pass
+            ws.index.remove(full)
+
+        return {
+            "snapshot_id": snapshot_id,
+            "restored": sorted(p for p, _ in changes),
+            "removed": extra,
+            "unchanged": len(target) - len(changes),
+        }
+
+
+# =========================
+# 🔹 Rétention
+# =========================
+
+def _prune(ws: Workspace):
+    folder = _store(ws) / "snapshots"
+    manifests = sorted(folder.glob("*.json"))
+    if len(manifests) <= SNAPSHOT_KEEP:
+        return
+    for path in manifests[:len(manifests) - SNAPSHOT_KEEP]:
+        path.unlink(missing_ok=True)
+    gc_blobs(ws)
+
+
+def gc_blobs(ws: Workspace, keep: Optional[set] = None) -> int:
+    """
+    Supprime les blobs qui ne sont référencés par aucun snapshot (ni dans keep).
+    """
+    referenced = set(keep or ())
+    for path in (_store(ws) / "snapshots").glob("*.json"):
+        try:
+            referenced.update(json.loads(path.read_text(encoding="utf-8"))["files"].values())
+        except (OSError, ValueError, KeyError):
+            # manifest illisible : on ne supprime rien plutôt que de perdre des données
+            logger.warning("manifest illisible %s : GC des blobs annulé", path)
+            return 0
+
+    removed = 0
+    for blob in (_store(ws) / "blobs").glob("*/*"):
+        if blob.name not in referenced and not blob.name.startswith("."):
+            blob.unlink(missing_ok=True)
+            removed += 1
+    _store_bytes(ws, refresh=True)
+    return removed
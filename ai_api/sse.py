@@ -0,0 +1,19 @@
+# ai_api/sse.py
+import json
+from typing import Any, Optional
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # désactive le buffering nginx
+}
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    Formate un événement Server-Sent-Events (data en JSON sur une ligne).
+    """
+    out = ""
+    if event:
+        out += f"event: {event}\n"
+    out += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return out
@@ -0,0 +1,63 @@
+# ai_api/tokens.py
+import os
+import re
+
+# Taille de la fenêtre de contexte du modèle (envoyée à Ollama en num_ctx)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+
+# Marge de sécurité (gabarit du prompt, imprécision de l'estimation)
+CONTEXT_MARGIN_TOKENS = int(os.getenv("CONTEXT_MARGIN_TOKENS", "64"))
+
+# Un message d'historique ne peut pas dépasser cette taille (tronqué tête + queue)
+HISTORY_MAX_MESSAGE_TOKENS = int(os.getenv("HISTORY_MAX_MESSAGE_TOKENS", "768"))
+
+_pieces = re.compile(r"\w+|[^\w\s]")
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimation du nombre de tokens BPE : un token par signe de ponctuation,
+    un token par tranche de 4 caractères pour les mots (code compris).
+    Volontairement un peu pessimiste.
+    """
+    if not text:
+        return 0
+    n = 0
+    for piece in _pieces.findall(text):
+        n += 1 + (len(piece) - 1) // 4
+    return n
+
+
+def truncate_head_tail(text: str, max_tokens: int, tokens: int = 0) -> str:
+    """
+    Garde le début et la fin d'un texte trop long (ex: stack trace),
+    le milieu est remplacé par un marqueur.
+    """
+    tokens = tokens or count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    # conversion tokens -> caractères au ratio moyen du texte, puis
+    # ajustement si les coupures de mots font déborder l'estimation
+    target = max_tokens - count_tokens(TRUNCATION_MARKER)
+    while target > 0:
+        keep_chars = int(len(text) * target / tokens)
+        head = keep_chars // 2
+        tail = keep_chars - head
+        out = text[:head].rstrip() + TRUNCATION_MARKER + text[len(text) - tail:].lstrip()
+        overflow = count_tokens(out) - max_tokens
+        if overflow <= 0:
+            return out
+        target -= overflow + 1
+    return TRUNCATION_MARKER.strip()
+
+
+def context_budget(max_tokens: int, *fixed_parts: str) -> int:
+    """
+    Tokens disponibles pour l'historique : contexte du modèle moins la
+    génération demandée et les parties fixes du prompt (système, question).
+    """
+    used = sum(count_tokens(p) for p in fixed_parts)
+    return max(0, OLLAMA_NUM_CTX - max_tokens - used - CONTEXT_MARGIN_TOKENS)
@@ -0,0 +1,363 @@
+# ai_api/workspace_index.py
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Intervalle (secondes) du scan des workspaces chargés, pour les changements
+# faits hors de l'API (tâche de fond de WorkspaceRegistry)
+WORKSPACE_WATCH_INTERVAL = float(os.getenv("WORKSPACE_WATCH_INTERVAL", "2"))
+
+SORT_KEYS = ("path", "size", "mtime")
+
+# Dossiers internes à la racine d'un workspace : jamais indexés ni listés
+RESERVED_DIRS = frozenset({".staging", ".store"})
+
+_HASH_CHUNK = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class FileEntry:
+    path: str    # relatif à la racine, séparateurs "/"
+    size: int
+    mtime: float
+    mtime_ns: int
+    hash: str    # sha256 du contenu
+
+
+# listener(path, entry) : entry = None si le fichier a été supprimé
+Listener = Callable[[str, Optional[FileEntry]], None]
+
+
+def _hash_file(full: Path) -> str:
+    h = hashlib.sha256()
+    with open(full, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(sort: str, cursor: str) -> tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Curseur invalide")
+    # le curseur doit venir d'une page triée de la même façon
+    if not isinstance(data, list) or len(data) != (2 if sort == "path" else 3) or data[0] != sort:
+        raise ValueError("Curseur invalide")
+    key = tuple(data[1:])
+    if not isinstance(key[-1], str) or (sort != "path" and not isinstance(key[0], (int, float))):
+        raise ValueError("Curseur invalide")
+    return key
+
+
+class WorkspaceIndex:
+    """
+    Index mémoire des fichiers d'un dossier (chemin, taille, mtime, hash).
+
+    Construit au premier accès (ensure_built, à la première utilisation du
+    workspace), puis tenu à jour par les chemins d'écriture / suppression
+    (refresh / remove) et, pour les changements faits hors de l'API, par
+    scan, appelé périodiquement par la tâche de fond de WorkspaceRegistry.
+    Le scan ne relit un fichier que si sa taille ou son mtime a changé.
+
+    Les vues triées (par chemin, taille, mtime) sont calculées à la demande
+    et gardées jusqu'au prochain changement ; la liste par chemin est tenue
+    triée en continu (bisect), ce qui rend les filtres par préfixe en
+    O(log n + k).
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.RLock()
+        self._entries: Dict[str, FileEntry] = {}
+        self._paths: List[str] = []  # triée
+        self._views: Dict[str, List[tuple]] = {}
+        self._bytes = 0
+        self._listeners: List[Listener] = []
+        self._built = False
+        self.scans = 0
+        self.changes = 0
+
+    # -------------------------
+    # Listeners
+    # -------------------------
+
+    def add_listener(self, listener: Listener):
+        self._listeners.append(listener)
+
+    def _notify(self, events: List[Tuple[str, Optional[FileEntry]]]):
+        for path, entry in events:
+            for listener in self._listeners:
+                try:
+                    listener(path, entry)
+                except Exception:
+                    logger.exception("listener de l'index workspace en échec (%s)", path)
+
+    # -------------------------
+    # Mise à jour
+    # -------------------------
+
+    def rel(self, full: Path) -> str:
+        return str(full.relative_to(self.root)).replace("\\", "/")
+
+    def _walk(self):
+        # os.scandir récursif : un seul stat par entrée (mis en cache par DirEntry)
+        root = str(self.root)
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            try:
+                it = os.scandir(current)
+            except OSError:
+                continue
+            with it:
+                for de in it:
+                    try:
+                        if de.is_dir(follow_symlinks=False):
+                            if current == root and de.name in RESERVED_DIRS:
+                                continue
+                            stack.append(de.path)
+                        elif de.is_file(follow_symlinks=False):
+                            yield de.path, de.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+    def _make_entry(
+        self,
+        rel: str,
+        st: os.stat_result,
+        full: str,
+        data: Optional[bytes] = None,
+        digest: Optional[str] = None,
+    ) -> FileEntry:
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest() if data is not None else _hash_file(Path(full))
+        return FileEntry(path=rel, size=st.st_size, mtime=st.st_mtime, mtime_ns=st.st_mtime_ns, hash=digest)
+
+    def _put(self, entry: FileEntry) -> bool:
+        old = self._entries.get(entry.path)
+        if old == entry:
+            return False
+        if old is None:
+            bisect.insort(self._paths, entry.path)
+        else:
+            self._bytes -= old.size
+        self._entries[entry.path] = entry
+        self._bytes += entry.size
+        self._views.clear()
+        self.changes += 1
+        return True
+
+    def _drop(self, rel: str) -> bool:
+        old = self._entries.pop(rel, None)
+        if old is None:
+            return False
+        self._bytes -= old.size
+        i = bisect.bisect_left(self._paths, rel)
+        del self._paths[i]
+        self._views.clear()
+        self.changes += 1
+        return True
+
+    def build(self):
+        entries = {}
+        for full, st in self._walk():
+            rel = self.rel(Path(full))
+            try:
+                entries[rel] = self._make_entry(rel, st, full)
+            except OSError:
+                continue
+        with self._lock:
+            self._entries = entries
+            self._paths = sorted(entries)
+            self._bytes = sum(e.size for e in entries.values())
+            self._views.clear()
+            self._built = True
+
+    def ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self.build()
+
+    def refresh(self, full: Path, data: Optional[bytes] = None, digest: Optional[str] = None) -> Optional[FileEntry]:
+        """
+        Met à jour un fichier après écriture (data = contenu écrit, ou
+        digest = hash déjà connu : évite de relire le fichier).
+        """
+        self.ensure_built()
+        rel = self.rel(full)
+        try:
+            st = full.stat()
+            entry = self._make_entry(rel, st, str(full), data, digest)
+        except OSError:
+            self.remove(full)
+            return None
+        with self._lock:
+            changed = self._put(entry)
+        if changed:
+            self._notify([(rel, entry)])
+        return entry
+
+    def remove(self, full: Path):
+        self.ensure_built()
+        rel = self.rel(full)
+        with self._lock:
+            changed = self._drop(rel)
+        if changed:
+            self._notify([(rel, None)])
+
+    def scan(self) -> int:
+        """
+        Compare le disque à l'index (taille + mtime) ; retourne le nombre
+        de changements appliqués.
+        """
+        self.ensure_built()
+        with self._lock:
+            known = dict(self._entries)
+
+        events: List[Tuple[str, Optional[FileEntry]]] = []
+        seen = set()
+        for full, st in self._walk():
+            rel = self.rel(Path(full))
+            seen.add(rel)
+            old = known.get(rel)
+            if old is not None and old.size == st.st_size and old.mtime_ns == st.st_mtime_ns:
+                continue
+            try:
+                events.append((rel, self._make_entry(rel, st, full)))
+            except OSError:
+                continue
+        events.extend((rel, None) for rel in known.keys() - seen)
+
+        applied = []
+        with self._lock:
+            self.scans += 1
+            for rel, entry in events:
+                # déjà mis à jour par refresh / remove pendant le scan : on garde
+                if self._entries.get(rel) is not known.get(rel):
+                    continue
+                if entry is None:
+                    if self._drop(rel):
+                        applied.append((rel, None))
+                elif self._put(entry):
+                    applied.append((rel, entry))
+        self._notify(applied)
+        return len(applied)
+
+    # -------------------------
+    # Lecture
+    # -------------------------
+
+    def get(self, rel: str) -> Optional[FileEntry]:
+        self.ensure_built()
+        return self._entries.get(rel)
+
+    def paths(self) -> List[str]:
+        self.ensure_built()
+        with self._lock:
+            return list(self._paths)
+
+    def _view(self, sort: str) -> List[tuple]:
+        view = self._views.get(sort)
+        if view is None:
+            if sort == "path":
+                view = [(p,) for p in self._paths]
+            else:
+                view = sorted((getattr(e, sort), e.path) for e in self._entries.values())
+            self._views[sort] = view
+        return view
+
+    def list(
+        self,
+        prefix: str = "",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+        sort: str = "path",
+        order: str = "asc",
+    ) -> Tuple[List[FileEntry], Optional[str]]:
+        """
+        Page de fichiers triés, filtrés par préfixe de chemin.
+        Pagination par curseur (clé de tri du dernier élément retourné) :
+        stable même si des fichiers sont ajoutés ou supprimés entre deux pages.
+        Retourne (entrées, curseur suivant ou None).
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Tri inconnu : {sort}")
+        self.ensure_built()
+        after = decode_cursor(sort, cursor) if cursor else None
+        desc = order == "desc"
+
+        with self._lock:
+            view = self._view(sort)
+            if sort == "path" and prefix:
+                # plage contiguë des chemins qui commencent par le préfixe
+                lo = bisect.bisect_left(view, (prefix,))
+                hi = bisect.bisect_left(view, (prefix + "\U0010ffff",))
+            else:
+                lo, hi = 0, len(view)
+
+            if desc:
+                if after is not None:
+                    hi = max(lo, min(hi, bisect.bisect_left(view, after, lo, hi)))
+                indexes = range(hi - 1, lo - 1, -1)
+            else:
+                if after is not None:
+                    lo = min(hi, max(lo, bisect.bisect_right(view, after, lo, hi)))
+                indexes = range(lo, hi)
+
+            out: List[FileEntry] = []
+            last_key = None
+            more = False
+            for i in indexes:
+                key = view[i]
+                path = key[-1]
+                if prefix and not path.startswith(prefix):
+                    continue
+                if limit is not None and len(out) >= limit:
+                    more = True
+                    break
+                out.append(self._entries[path])
+                last_key = key
+
+        next_cursor = encode_cursor(sort, last_key) if more and last_key is not None else None
+        return out, next_cursor
+
+    def usage(self) -> Tuple[int, int]:
+        # (fichiers, octets) : compteurs tenus à jour, O(1)
+        return len(self._entries), self._bytes
+
+    def reconcile(self) -> int:
+        """
+        Recalcule le compteur d'octets depuis les entrées ; retourne l'écart
+        corrigé (0 si les compteurs étaient justes).
+        """
+        with self._lock:
+            actual = sum(e.size for e in self._entries.values())
+            drift = actual - self._bytes
+            self._bytes = actual
+        if drift:
+            logger.warning("compteur du workspace %s corrigé (%+d octets)", self.root, drift)
+        return abs(drift)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._bytes,
+                "scans": self.scans,
+                "changes": self.changes,
+            }
@@ -0,0 +1,323 @@
+# ai_api/workspaces.py
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ai_api.workspace_index import WorkspaceIndex, WORKSPACE_WATCH_INTERVAL, RESERVED_DIRS
+from ai_api.search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Racine des workspaces utilisateurs (un sous-dossier par utilisateur)
+USER_WORKSPACES_DIR = Path(os.getenv("USER_WORKSPACES_DIR", "workspaces")).resolve()
+
+# Quotas par utilisateur (0 = illimité)
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(200 * 1024 * 1024)))
+WORKSPACE_QUOTA_FILES = int(os.getenv("WORKSPACE_QUOTA_FILES", "10000"))
+
+# Maintenance : réconciliation des compteurs + GC
+WORKSPACE_MAINTENANCE_INTERVAL = float(os.getenv("WORKSPACE_MAINTENANCE_INTERVAL", "300"))
+# Index déchargé de la mémoire après cette inactivité (secondes)
+WORKSPACE_IDLE_TTL = float(os.getenv("WORKSPACE_IDLE_TTL", "3600"))
+# Workspaces sans modification depuis N jours (ou vides) supprimés du disque (0 = jamais)
+WORKSPACE_RETENTION_DAYS = float(os.getenv("WORKSPACE_RETENTION_DAYS", "0"))
+
+
+# Dossiers en cours de suppression par le GC (jamais un nom de workspace)
+_TRASH_PREFIX = ".deleted-"
+
+
+class QuotaExceeded(ValueError):
+    pass
+
+
+def workspace_name(email: str) -> str:
+    # nom de dossier stable, sans caractère spécial, sans exposer l'email
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+class Workspace:
+    """
+    Dossier de fichiers d'un utilisateur (ou partagé) + son index.
+    L'usage (octets, nombre de fichiers) vient des compteurs de l'index,
+    tenus à jour à chaque écriture : vérifier un quota est en O(1).
+    Les écritures en cours sont réservées pour que deux écritures
+    concurrentes ne dépassent pas le quota ensemble.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 0, max_files: int = 0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.index = WorkspaceIndex(root)
+        self.search = SearchIndex(self.index)  # construit par la tâche de fond du registre
+        self.last_used = time.monotonic()
+        self.closed = False  # déchargé par le GC : le registre ne le sert plus
+        self._lock = threading.Lock()
+        self._pending_bytes = 0
+        self._pending_files = 0
+        self._writes = 0  # écritures en cours (réservations ouvertes)
+
+    def ensure(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def usage(self) -> dict:
+        files, size = self.index.usage()
+        return {
+            "files": files,
+            "bytes": size,
+            "max_files": self.max_files,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _delta(self, full: Path, size: int) -> Tuple[int, int]:
+        old = self.index.get(self.index.rel(full))
+        return max(0, size - (old.size if old else 0)), 0 if old else 1
+
+    def _check(self, add_bytes: int, add_files: int):
+        files, used = self.index.usage()
+        if self.max_files and add_files and files + self._pending_files + add_files > self.max_files:
+            raise QuotaExceeded(f"Quota de fichiers atteint ({self.max_files})")
+        if self.max_bytes and add_bytes and used + self._pending_bytes + add_bytes > self.max_bytes:
+            raise QuotaExceeded(f"Quota d'espace atteint ({self.max_bytes} octets)")
+
+    def check_quota(self, full: Path, size: int):
+        """
+        Vérifie sans réserver (ex: upload annoncé par Content-Length).
+        """
+        with self._lock:
+            self._check(*self._delta(full, size))
+
+    def reserve(self, full: Path, size: int):
+        """
+        Réserve la place d'une écriture de size octets sur full ; lève
+        QuotaExceeded si le quota serait dépassé.
+        """
+        return self.reserve_all([(full, size)])
+
+    @contextmanager
+    def reserve_all(self, items: List[Tuple[Path, int]]):
+        # réservation unique pour un lot d'écritures
+        add_bytes = add_files = 0
+        for full, size in items:
+            b, f = self._delta(full, size)
+            add_bytes += b
+            add_files += f
+
+        with self._lock:
+            self._check(add_bytes, add_files)
+            self._pending_bytes += add_bytes
+            self._pending_files += add_files
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending_bytes -= add_bytes
+                self._pending_files -= add_files
+                self._writes -= 1
+
+    @property
+    def writing(self) -> bool:
+        with self._lock:
+            return self._writes > 0
+
+
+class WorkspaceRegistry:
+    """
+    Workspaces utilisateurs chargés en mémoire, créés au premier accès.
+    Une tâche de fond (run) scanne les workspaces chargés (changements hors
+    API), met à jour leurs index de recherche, réconcilie les compteurs, décharge les index inactifs et supprime
+    les dossiers vides ou expirés (si WORKSPACE_RETENTION_DAYS > 0).
+    """
+
+    def __init__(
+        self,
+        base: Path = USER_WORKSPACES_DIR,
+        max_bytes: int = WORKSPACE_QUOTA_BYTES,
+        max_files: int = WORKSPACE_QUOTA_FILES,
+    ):
+        self.base = base
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._items: Dict[str, Workspace] = {}
+        self.reconciled_drift = 0
+        self.gc_unloaded = 0
+        self.gc_removed = 0
+
+    def get(self, email: str) -> Workspace:
+        name = workspace_name(email)
+        while True:
+            with self._lock:
+                ws = self._items.get(name)
+                if ws is None:
+                    ws = Workspace(self.base / name, self.max_bytes, self.max_files)
+                    self._items[name] = ws
+                # sous le verrou : le GC voit cet accès avant de décharger
+                ws.touch()
+            ws.ensure()
+            ws.index.ensure_built()
+            # déchargé entre-temps (TTL très court) : reprendre l'instance
+            # du registre plutôt que d'en garder deux pour le même dossier
+            if not ws.closed:
+                return ws
+
+    def loaded(self):
+        with self._lock:
+            return list(self._items.items())
+
+    # -------------------------
+    # Maintenance
+    # -------------------------
+
+    def scan(self):
+        for _, ws in self.loaded():
+            ws.index.scan()
+        self.update_search()
+
+    def update_search(self):
+        # index de recherche construits / mis à jour ici plutôt qu'à la recherche suivante
+        for name, ws in self.loaded():
+            try:
+                ws.search.update()
+            except Exception:
+                logger.exception("mise à jour de l'index de recherche du workspace %s en échec", name)
+
+    def reconcile(self) -> int:
+        drift = 0
+        for _, ws in self.loaded():
+            ws.index.scan()
+            drift += ws.index.reconcile()
+        self.reconciled_drift += drift
+        return drift
+
+    def save_indexes(self):
+        # index de recherche persistés : rechargés vite au prochain démarrage
+        for name, ws in self.loaded():
+            try:
+                ws.search.save()
+            except Exception:
+                logger.exception("sauvegarde de l'index de recherche du workspace %s en échec", name)
+
+    def gc(self):
+        now = time.monotonic()
+        with self._lock:
+            unloaded = []
+            for name, ws in list(self._items.items()):
+                if now - ws.last_used > WORKSPACE_IDLE_TTL and not ws.writing:
+                    ws.closed = True
+                    del self._items[name]
+                    unloaded.append(ws)
+                    self.gc_unloaded += 1
+            loaded = set(self._items)
+        for ws in unloaded:
+            ws.search.save()
+
+        if WORKSPACE_RETENTION_DAYS <= 0 or not self.base.is_dir():
+            return
+        cutoff = time.time() - WORKSPACE_RETENTION_DAYS * 86400
+        for entry in os.scandir(self.base):
+            if not entry.is_dir(follow_symlinks=False) or entry.name in loaded:
+                continue
+            if entry.name.startswith(_TRASH_PREFIX):
+                # suppression interrompue (arrêt du serveur) : on la termine
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            try:
+                newest = _newest_mtime(entry.path)
+                if newest is not None and newest >= cutoff:
+                    continue
+                # renommé sous le verrou (instantané) : un get() concurrent
+                # recrée un dossier vide au lieu de voir une suppression à moitié
+                # faite ; le rmtree, lent, se fait hors verrou
+                trash = self.base / f"{_TRASH_PREFIX}{entry.name}-{uuid.uuid4().hex[:8]}"
+                with self._lock:
+                    if entry.name in self._items:  # rechargé entre-temps
+                        continue
+                    os.rename(entry.path, trash)
+                shutil.rmtree(trash, ignore_errors=True)
+                self.gc_removed += 1
+            except OSError:
+                logger.exception("GC du workspace %s en échec", entry.name)
+
+    def maintenance(self):
+        self.reconcile()
+        self.update_search()
+        self.save_indexes()
+        self.gc()
+
+    async def run(
+        self,
+        scan_interval: float = WORKSPACE_WATCH_INTERVAL,
+        maintenance_interval: float = WORKSPACE_MAINTENANCE_INTERVAL,
+    ):
+        loop = asyncio.get_running_loop()
+        last_maintenance = time.monotonic()
+        while True:
+            await asyncio.sleep(scan_interval)
+            try:
+                if time.monotonic() - last_maintenance >= maintenance_interval:
+                    last_maintenance = time.monotonic()
+                    await loop.run_in_executor(None, self.maintenance)
+                else:
+                    await loop.run_in_executor(None, self.scan)
+            except Exception:
+                logger.exception("maintenance des workspaces en échec")
+
+    def stats(self) -> dict:
+        loaded = self.loaded()
+        return {
+            "loaded": len(loaded),
+            "files": sum(ws.index.usage()[0] for _, ws in loaded),
+            "bytes": sum(ws.index.usage()[1] for _, ws in loaded),
+            "reconciled_drift": self.reconciled_drift,
+            "gc_unloaded": self.gc_unloaded,
+            "gc_removed": self.gc_removed,
+        }
+
+
+def _newest_mtime(path: str) -> Optional[float]:
+    """
+    mtime du fichier ou snapshot le plus récent, None si aucun des deux.
+    Les autres fichiers internes (.staging, blobs, index de recherche) ne
+    comptent pas ; un workspace sans fichier mais avec des snapshots n'est
+    pas vide.
+    """
+    newest = None
+
+    def seen(full: str):
+        nonlocal newest
+        try:
+            mtime = os.stat(full).st_mtime
+        except OSError:
+            return
+        newest = mtime if newest is None else max(newest, mtime)
+
+    for root, dirs, files in os.walk(path):
+        if root == path:
+            dirs[:] = [d for d in dirs if d not in RESERVED_DIRS]
+        for f in files:
+            seen(os.path.join(root, f))
+
+    # manifests des snapshots (voir ai_api.snapshots)
+    snapshots = os.path.join(path, ".store", "snapshots")
+    if os.path.isdir(snapshots):
+        for entry in os.scandir(snapshots):
+            if entry.name.endswith(".json"):
+                seen(entry.path)
+    return newest
+
+
+workspaces = WorkspaceRegistry()
@@ -0,0 +1,130 @@
+# benchmarks/bench_json.py
+"""
+Extraction / réparation JSON : ancienne version (regex + find/rfind +
+réécritures globales) contre ai_api.json_utils (un seul passage).
+
+    python benchmarks/bench_json.py [--repeat N] [--scale K]
+
+Pour chaque échantillon de benchmarks/json_corpus/ : résultat de chaque
+version (ok / échec) et temps moyen. --scale gonfle le contenu des
+fichiers pour mesurer sur des réponses de plusieurs centaines de Ko.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ai_api.json_utils import extract_json_block  # noqa: E402
+
+CORPUS_DIR = Path(__file__).resolve().parent / "json_corpus"
+
+
+# =========================
+# 🔹 Ancienne version (main.py / code_agent.py)
+# =========================
+
+def legacy_extract_json_block(text: str) -> dict:
+    if not text:
+        raise ValueError("Réponse vide du modèle")
+
+    m = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
+    if m:
+        return json.loads(m.group(1))
+
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        candidate = text[start:end + 1]
+        return json.loads(candidate)
+
+    raise ValueError("JSON non trouvé dans la réponse du modèle")
+
+
+def legacy_repair_json_loose(text: str) -> str:
+    if not text:
+        return text
+
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        text = text[start:end + 1]
+
+    text = re.sub(r"(?<!\\)'", '"', text)
+    text = re.sub(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:', r'\1"\2":', text)
+
+    return text
+
+
+def legacy_parse(text: str) -> dict:
+    # enchaînement utilisé par /build
+    try:
+        return legacy_extract_json_block(text)
+    except Exception:
+        return json.loads(legacy_repair_json_loose(text))
+
+
+# =========================
+# 🔹 Corpus
+# =========================
+
+def inflate(text: str, scale: int) -> str:
+    """
+    Multiplie la taille des contenus de fichiers (chaînes "content") pour
+    simuler de grosses réponses, sans changer la structure.
+    """
+    if scale <= 1:
+        return text
+    return re.sub(
+        r'("content":\s*")((?:[^"\\]|\\.)*)(")',
+        lambda m: m.group(1) + m.group(2) * scale + m.group(3),
+        text,
+    )
+
+
+def load_corpus(scale: int):
+    for path in sorted(CORPUS_DIR.glob("*.txt")):
+        yield path.name, inflate(path.read_text(encoding="utf-8"), scale)
+
+
+def timed(fn, text: str, repeat: int):
+    try:
+        result = fn(text)
+        ok = isinstance(result, dict) and "files" in result
+    except Exception:
+        ok = False
+    started = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            fn(text)
+        except Exception:
+            pass
+    return ok, (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'échantillon':40} {'Ko':>7} {'ancien':>14} {'nouveau':>14}")
+    totals = [0.0, 0.0]
+    for name, text in load_corpus(args.scale):
+        old_ok, old_ms = timed(legacy_parse, text, args.repeat)
+        new_ok, new_ms = timed(extract_json_block, text, args.repeat)
+        totals[0] += old_ms
+        totals[1] += new_ms
+        print(
+            f"{name:40} {len(text) / 1024:7.1f} "
+            f"{('ok' if old_ok else 'ÉCHEC'):>5} {old_ms:6.3f}ms "
+            f"{('ok' if new_ok else 'ÉCHEC'):>5} {new_ms:6.3f}ms"
+        )
+    print(f"{'total':48} {totals[0]:12.3f}ms {totals[1]:12.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/check_json_stream.py
+"""
+Non-régression du parseur incrémental de /build/stream : pour chaque
+échantillon de benchmarks/json_corpus/, les fichiers obtenus en streaming
+(découpage aléatoire en morceaux, comme les tokens d'Ollama) doivent être
+ceux de extract_json_block sur la réponse complète (/build).
+
+    python benchmarks/check_json_stream.py [--chunkings N]
+
+Code de sortie 1 si un résultat diffère.
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ai_api.json_stream import BuildStreamParser  # noqa: E402
+from ai_api.json_utils import extract_json_block  # noqa: E402
+
+CORPUS_DIR = Path(__file__).resolve().parent / "json_corpus"
+
+# Clés / chaînes hors guillemets doubles : le parseur incrémental ne les
+# suit pas (aucun fichier en streaming), seul /build les répare
+NOT_STREAMED = {"04_single_quotes.txt", "05_unquoted_keys_trailing_commas.txt"}
+
+# Cas absents du corpus /build : texte avant le JSON piégeux pour le streaming
+EXTRA_CASES = {
+    "bloc_autre_langage": (
+        "Lance d'abord :\n```bash\necho {a,b}\n```\nPuis :\n```json\n"
+        '{"summary": "x", "files": [{"path": "a.txt", "content": "{}"}]}\n```'
+    ),
+    "accolade_vide_en_tete": '{\n\n}',
+}
+
+
+def paths_of(files) -> list:
+    return [(f.get("path") or "").strip() for f in files]
+
+
+def streamed(text: str, rnd: random.Random):
+    parser = BuildStreamParser()
+    raws = []
+    i = 0
+    while i < len(text):
+        n = rnd.randint(1, 12)
+        raws.extend(parser.feed(text[i:i + n]))
+        i += n
+    return paths_of(extract_json_block(raw) for raw in raws), parser.truncated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunkings", type=int, default=50)
+    args = parser.parse_args()
+
+    cases = {p.name: p.read_text(encoding="utf-8") for p in sorted(CORPUS_DIR.glob("*.txt"))}
+    cases.update(EXTRA_CASES)
+    rnd = random.Random(0)
+    failures = 0
+
+    for name, text in cases.items():
+        if name in NOT_STREAMED:
+            expected = ([], True)
+        else:
+            expected = (paths_of(extract_json_block(text).get("files") or []), False)
+        got = [streamed(text, rnd) for _ in range(args.chunkings)]
+        bad = [g for g in got if g != expected]
+        if bad:
+            failures += 1
+            print(f"{name:40} DIFF attendu {expected!r} obtenu {bad[0]!r}")
+        else:
+            print(f"{name:40} ok {expected[0]}")
+
+    print(f"{len(cases)} cas, {failures} différence(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# benchmarks/check_output_cleaner.py
+"""
+Non-régression du nettoyage des réponses : ancienne fonction clean_output
+(texte complet) contre ai_api.output_cleaner, en une fois et en streaming
+(découpage aléatoire en morceaux, comme les tokens d'Ollama).
+
+    python benchmarks/check_output_cleaner.py [--chunkings N] [--repeat N]
+
+Code de sortie 1 si une sortie diffère.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ai_api.output_cleaner import StreamCleaner, clean_output  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent / "clean_output_corpus.json"
+
+
+# =========================
+# 🔹 Ancienne version (main.py)
+# =========================
+
+def legacy_clean_output(text: str) -> str:
+    if not text:
+        return text
+
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if not lines:
+        return text.strip()
+
+    bad_prefixes = [
+        "bonjour", "salut", "hello", "coucou", "bonsoir", "je suis",
+        "en tant qu", "avec plaisir", "bien sûr", "bien sur", "d'accord",
+        "ok", "certainement", "bienvenue", "que voulez-vous", "que veux-tu",
+        "comment puis-je", "comment je peux", "je peux", "laissez-moi",
+        "laisse-moi",
+    ]
+
+    while lines:
+        low = lines[0].lower()
+        if any(low.startswith(x) for x in bad_prefixes):
+            lines.pop(0)
+            continue
+        if low.startswith("agent:") or low.startswith("ai:") or low.startswith("assistant:"):
+            lines.pop(0)
+            continue
+        break
+
+    cleaned = "\n".join(lines).strip()
+
+    endings_to_remove = [
+        "que voulez-vous que je réponde",
+        "que veux-tu que je réponde",
+        "voulez-vous que je continue",
+        "souhaitez-vous que je continue",
+        "comment puis-je vous aider",
+        "comment je peux t'aider",
+    ]
+
+    low_cleaned = cleaned.lower()
+    for end in endings_to_remove:
+        if end in low_cleaned:
+            idx = low_cleaned.find(end)
+            cleaned = cleaned[:idx].strip()
+            break
+
+    return cleaned if cleaned else text.strip()
+
+
+def streamed(text: str, rnd: random.Random) -> str:
+    cleaner = StreamCleaner()
+    out = []
+    i = 0
+    while i < len(text):
+        n = rnd.randint(1, 12)
+        out.append(cleaner.feed(text[i:i + n]))
+        i += n
+    out.append(cleaner.finish())
+    return "".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunkings", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    cases = json.loads(CORPUS.read_text(encoding="utf-8"))
+    rnd = random.Random(0)
+    failures = 0
+
+    for i, text in enumerate(cases):
+        expected = legacy_clean_output(text)
+        got = [clean_output(text)] + [streamed(text, rnd) for _ in range(args.chunkings)]
+        bad = [g for g in got if g != expected]
+        if bad:
+            failures += 1
+            print(f"[{i}] DIFF {text!r}\n    attendu {expected!r}\n    obtenu  {bad[0]!r}")
+
+    print(f"{len(cases)} cas, {failures} différence(s)")
+
+    # temps sur une longue réponse
+    big = "Bonjour !\n" + "Ligne de code utile avec du contenu.\n" * 5000 + "Souhaitez-vous que je continue ?"
+    for name, fn in (("ancien", legacy_clean_output), ("nouveau", clean_output)):
+        started = time.perf_counter()
+        for _ in range(args.repeat // 10 or 1):
+            fn(big)
+        ms = (time.perf_counter() - started) / (args.repeat // 10 or 1) * 1000
+        print(f"{name:8} {len(big) / 1024:.0f} Ko : {ms:.3f}ms")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()